@@ -0,0 +1,4 @@
+from panama_joe.cli import main
+
+if __name__ == '__main__':  # Not when processes started with 'spawn' import the main module.
+    main()
@@ -0,0 +1,612 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from panama_joe.utils import demos, folders
+
+BASELINE_FILE_NAME = 'baseline.json'
+# Metrics are compared by the suffix of their name.
+HIGHER_IS_BETTER = ('_per_sec',)
+LOWER_IS_BETTER = ('_us', '_ms', '_s', '_bytes')
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Benchmark environment stepping, wrappers, demo I/O and policy inference.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    regressions = benchmark(**kwargs)
+    sys.exit(1 if len(regressions) > 0 else 0)
+
+
+def add_arguments(parser):
+    parser.add_argument('benchmarks',
+                        nargs='*',
+                        help=f'Benchmarks to run, of: {", ".join(BENCHMARKS.keys())}. By default, all of them.')
+    parser.add_argument('--steps',
+                        '-s',
+                        default=2000,
+                        type=int,
+                        help='Number of environment steps (or calls) to time per measurement.')
+    parser.add_argument('--baseline',
+                        type=str,
+                        help=f'Results to compare against. By default, `{BASELINE_FILE_NAME}` in the benchmarks'
+                             ' directory, if it exists.')
+    parser.add_argument('--tolerance',
+                        default=0.1,
+                        type=float,
+                        help='Fraction by which a metric may be worse than the baseline before it is a regression.')
+    parser.add_argument('--save_baseline',
+                        action='store_true',
+                        help='Flag to save the results as the new baseline.')
+    parser.add_argument('--seed',
+                        default=0,
+                        type=int,
+                        help='Seed to random number generator.')
+
+
+def benchmark(benchmarks=None, steps=2000, baseline=None, tolerance=0.1, save_baseline=False, seed=0):
+    """
+    Run benchmarks, save their results to the benchmarks directory and compare them against a baseline.
+
+    :return: Regressions, as `(benchmark, metric, baseline value, value)` tuples.
+    """
+    import torch
+
+    if not benchmarks:
+        benchmarks = tuple(BENCHMARKS.keys())
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown benchmark: {name}')
+    results = {
+        'time': int(time.time()),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'steps': steps,
+        'benchmarks': {}
+    }
+    for name in benchmarks:
+        print(f'{name}:')
+        start = time.perf_counter()
+        metrics = BENCHMARKS[name](steps, np.random.default_rng(seed))
+        for metric, value in metrics.items():
+            print(f'  {metric}: {value:.6g}')
+        print(f'  ({time.perf_counter() - start:.1f}s)')
+        results['benchmarks'][name] = metrics
+
+    benchmark_dir = folders.benchmark_dir()
+    path = os.path.join(benchmark_dir, f'{results["time"]:d}.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results: {path}')
+
+    regressions = []
+    if baseline is None and os.path.exists(os.path.join(benchmark_dir, BASELINE_FILE_NAME)):
+        baseline = os.path.join(benchmark_dir, BASELINE_FILE_NAME)
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(json.load(f), results, tolerance=tolerance)
+        for name, metric, old, new in regressions:
+            print(f'REGRESSION {name}.{metric}: {old:.6g} -> {new:.6g}')
+        print(f'{len(regressions):d} regression(s) against {baseline}')
+    if save_baseline:
+        shutil.copyfile(path, os.path.join(benchmark_dir, BASELINE_FILE_NAME))
+    return regressions
+
+
+def compare(baseline, results, tolerance=0.1):
+    """
+    :return: Metrics in both `baseline` and `results` which got worse by more than `tolerance` (a fraction), as
+        `(benchmark, metric, baseline value, value)` tuples.
+    """
+    regressions = []
+    for name, metrics in results['benchmarks'].items():
+        for metric, value in metrics.items():
+            old = baseline['benchmarks'].get(name, {}).get(metric)
+            if old is None:
+                continue
+            if metric.endswith(HIGHER_IS_BETTER) and value < old * (1 - tolerance):
+                regressions.append((name, metric, old, value))
+            elif metric.endswith(LOWER_IS_BETTER) and value > old * (1 + tolerance):
+                regressions.append((name, metric, old, value))
+    return regressions
+
+
+def bench_env_step(steps, rng):
+    """
+    Steps per second of the bare emulator (`ale.act` plus reading the observation) against `make_env`, for each
+    observation type and frameskip, and of the preprocessed pixel pipeline.
+    """
+    from panama_joe.utils import montezuma
+
+    metrics = {}
+    actions = rng.integers(0, 18, size=steps)
+    for obs_type in ('ram', 'rgb'):
+        for frameskip in (1, 4):
+            env = montezuma.make_env(obs_type=obs_type, frameskip=frameskip, render_mode=None)
+            env.reset(seed=0)
+            atari_env = env.unwrapped
+            ale = atari_env.ale
+            get_obs = ale.getRAM if obs_type == 'ram' else ale.getScreenRGB
+            start = time.perf_counter()
+            for a in actions:
+                for _ in range(frameskip):
+                    ale.act(atari_env._action_set[a])
+                if ale.game_over():
+                    ale.reset_game()
+                get_obs()
+            metrics[f'raw_ale_{obs_type}_fs{frameskip:d}_steps_per_sec'] = steps / (time.perf_counter() - start)
+            metrics[f'make_env_{obs_type}_fs{frameskip:d}_steps_per_sec'] = _env_steps_per_sec(env, actions)
+            env.close()
+    env = montezuma.make_env(obs_type='rgb', frameskip=4, render_mode=None, preprocess=True)
+    metrics['make_env_rgb_preprocessed_fs4_steps_per_sec'] = _env_steps_per_sec(env, actions)
+    env.close()
+    return metrics
+
+
+def bench_demo_record(steps, rng):
+    """
+    Cost per step of recording with `AtariDemo` (observation copies, checkpoints and rewind snapshots).
+    """
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.wrappers import AtariDemo
+
+    metrics = {}
+    actions = rng.integers(0, 18, size=steps)
+    for obs_type in ('ram', 'rgb'):
+        env = montezuma.make_env(obs_type=obs_type, render_mode=None)
+        plain = _env_steps_per_sec(env, actions)
+        demo = _env_steps_per_sec(AtariDemo(env), actions)
+        metrics[f'{obs_type}_plain_steps_per_sec'] = plain
+        metrics[f'{obs_type}_recording_steps_per_sec'] = demo
+        metrics[f'{obs_type}_recording_overhead_us'] = 1e6 * (1 / demo - 1 / plain)
+        env.close()
+    return metrics
+
+
+def bench_time_travel(steps, rng):
+    """
+    Latency of the first step after traveling back in time (which restores the past state) as a function of the
+    number of steps traveled.
+    """
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.wrappers import AtariDemo
+
+    metrics = {}
+    actions = np.zeros(steps, dtype=np.int64)  # Standing still never loses a life, so every action is recorded.
+    time_travel = 19
+    for distance in (1, 10, 100, 1000, 10000):
+        if distance >= steps:
+            break
+        env = AtariDemo(montezuma.make_env(render_mode=None))
+        env.reset()
+        for a in actions:
+            env.step(int(a))
+        for _ in range(distance):
+            env.step(time_travel)
+        start = time.perf_counter()
+        env.step(0)
+        metrics[f'restore_{distance:d}_ms'] = 1e3 * (time.perf_counter() - start)
+        env.close()
+    return metrics
+
+
+def bench_demo_io(steps, rng):
+    """
+    Save and load time and size on disk of a demo of `steps` steps, for each observation type and file format.
+    """
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.wrappers import AtariDemo
+
+    metrics = {}
+    actions = rng.integers(0, 18, size=steps)
+    with tempfile.TemporaryDirectory() as demos_dir:
+        for obs_type in ('ram', 'rgb'):
+            env = AtariDemo(montezuma.make_env(obs_type=obs_type, render_mode=None), demos_dir=demos_dir)
+            env.reset()
+            for a in actions:
+                env.step(int(a))
+            for demo_format, suffix in demos.DEMO_FORMAT_SUFFIXES.items():
+                file_name = obs_type + suffix
+                start = time.perf_counter()
+                env.save_to_file(file_name)
+                metrics[f'{obs_type}_{demo_format}_save_s'] = time.perf_counter() - start
+                metrics[f'{obs_type}_{demo_format}_size_bytes'] = demos.size_on_disk(os.path.join(demos_dir, file_name))
+                loader = AtariDemo(montezuma.make_env(obs_type=obs_type, render_mode=None), demos_dir=demos_dir)
+                start = time.perf_counter()
+                loader.load_from_file(file_name)
+                metrics[f'{obs_type}_{demo_format}_load_s'] = time.perf_counter() - start
+                loader.close()
+            env.close()
+    return metrics
+
+
+def bench_predict(steps, rng):
+    """
+    Latency of `model.predict` on single observations, for an MLP on RAM and CNNs on raw and preprocessed frames, and
+    of the same policies exported to TorchScript (see `export_model`), as they are and with quantized linear layers.
+    """
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.export import ExportedPolicy, export_policy
+
+    metrics = {}
+    configs = (
+        ('mlp', 'MlpPolicy', {'obs_type': 'ram'}),
+        ('cnn', 'CnnPolicy', {'obs_type': 'rgb', 'preprocess': True}),
+        ('cnn_raw', 'CnnPolicy', {'obs_type': 'rgb'})
+    )
+    for name, policy, env_kwargs in configs:
+        env = montezuma.make_env(render_mode=None, **env_kwargs)
+        model = PPO(policy, env, seed=0)
+        obs, _ = env.reset(seed=0)
+        obs = np.array(obs)
+        policies = [(name, model)]
+        with tempfile.TemporaryDirectory() as model_dir:
+            model.save(os.path.join(model_dir, 'model'))
+            for suffix, quantize in (('exported', False), ('exported_int8', True)):
+                path = os.path.join(model_dir, f'{suffix}.pt')
+                export_policy(os.path.join(model_dir, 'model.zip'), path, quantize=quantize)
+                policies.append((f'{name}_{suffix}', ExportedPolicy(path)))
+        for metric, policy in policies:
+            policy.predict(obs)  # Warm up.
+            latencies = np.zeros(min(steps, 1000))
+            for i in range(len(latencies)):
+                start = time.perf_counter()
+                policy.predict(obs)
+                latencies[i] = time.perf_counter() - start
+            metrics[f'predict_{metric}_p50_ms'] = 1e3 * float(np.percentile(latencies, 50))
+            metrics[f'predict_{metric}_p99_ms'] = 1e3 * float(np.percentile(latencies, 99))
+        env.close()
+    return metrics
+
+
+def bench_inference_server(steps, rng):
+    """
+    Actions per second of `model.predict` on single observations against an `InferenceServer` serving 1 to 32 clients
+    (threads, each waiting for its action like a rollout worker), with the server's batch sizes and queue latency.
+    """
+    import threading
+
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.inference import InferenceServer
+
+    metrics = {}
+    env = montezuma.make_env(render_mode=None)
+    model = PPO('MlpPolicy', env, seed=0)
+    obs = rng.integers(0, 256, size=(steps, *env.observation_space.shape)).astype(env.observation_space.dtype)
+    model.predict(obs[0])  # Warm up.
+    start = time.perf_counter()
+    for o in obs:
+        model.predict(o)
+    metrics['local_actions_per_sec'] = steps / (time.perf_counter() - start)
+
+    def run_client(client, n):
+        for o in obs[:n]:
+            client.predict(o)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        path = os.path.join(model_dir, 'model.zip')
+        model.save(path)
+        for n_clients in (1, 8, 32):
+            with InferenceServer(path, env.observation_space, n_clients=n_clients) as server:
+                clients = [server.channels.connect() for _ in range(n_clients)]
+                clients[0].predict(obs[0])  # Waits for the server to load the model.
+                threads = [threading.Thread(target=run_client, args=(client, steps // n_clients))
+                           for client in clients]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                server_metrics = server.close()
+            metrics[f'server_n{n_clients:d}_actions_per_sec'] = server_metrics['actions_per_sec']
+            metrics[f'server_n{n_clients:d}_batch_size'] = server_metrics['batch_size_mean']
+            metrics[f'server_n{n_clients:d}_queue_latency_p50_us'] = server_metrics['queue_latency_p50_us']
+    env.close()
+    return metrics
+
+
+def bench_vec_shaping(steps, rng):
+    """
+    Cost per vectorized step of the death cost applied by a `DeathCostWrapper` in each environment against a single
+    `VecDeathCost`, for 8 to 64 environments. Environments replay a recorded stream of steps, and batches of their steps
+    are replayed in turn to `VecDeathCost`, so that only the shaping is timed. The shaped rewards must be equal.
+    """
+    import gymnasium as gym
+    from stable_baselines3.common.vec_env import DummyVecEnv
+
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.lives_buffer import RESET, STEP, LivesBuffer
+    from panama_joe.utils.vec_wrappers import VecDeathCost
+    from panama_joe.utils.wrappers import DeathCostWrapper
+
+    class ReplayEnv(gym.Env):
+        """
+        Replays `transitions` from `offset`, looping; `before[t]` is the observation and info before transition `t`.
+        """
+
+        def __init__(self, offset):
+            self.t = offset
+            self.observation_space = observation_space
+            self.action_space = action_space
+
+        def reset(self, seed=None, options=None):
+            return before[self.t]
+
+        def step(self, action):
+            obs, reward, terminated, truncated, info = transitions[self.t]
+            self.t += 1
+            if self.t == len(transitions):
+                self.t = 0
+                truncated = True
+            return obs, reward, terminated, truncated, info
+
+    class ReplayVecEnv(DummyVecEnv):
+        """
+        Returns recorded `(rewards, dones, infos, reset_infos)` batches in turn, without stepping its environments.
+        """
+
+        def __init__(self, env_fns, reset_infos, batches, lives_buffer=None):
+            super(ReplayVecEnv, self).__init__(env_fns)
+            self.first_reset_infos = reset_infos
+            self.batches = batches
+            self.lives_buffer = lives_buffer
+            self.t = 0
+
+        def reset(self):
+            self.t = 0
+            self.reset_infos = self.first_reset_infos
+            if self.lives_buffer is not None:
+                self.lives_buffer.lives[RESET] = [info['lives'] for info in self.reset_infos]
+            return self._obs_from_buf()
+
+        def step_wait(self):
+            rewards, dones, infos, self.reset_infos = self.batches[self.t]
+            if self.lives_buffer is not None:  # As the environments' `LivesWrapper`s would.
+                self.lives_buffer.lives[STEP] = [info['lives'] for info in infos]
+                self.lives_buffer.lives[RESET, dones] = [self.reset_infos[i]['lives'] for i in np.flatnonzero(dones)]
+            self.t += 1
+            return self._obs_from_buf(), np.copy(rewards), dones, infos
+
+    def step_envs(envs):
+        # As `DummyVecEnv.step_wait`, without copying observations and infos.
+        rewards = np.zeros(len(envs), dtype=np.float32)
+        dones = np.zeros(len(envs), dtype=bool)
+        infos = [{}] * len(envs)
+        reset_infos = [{}] * len(envs)
+        for i, env_ in enumerate(envs):
+            _, rewards[i], terminated, truncated, infos[i] = env_.step(0)
+            dones[i] = terminated or truncated
+            if dones[i]:
+                _, reset_infos[i] = env_.reset()
+        return rewards, dones, infos, reset_infos
+
+    env = montezuma.make_env(frameskip=4, render_mode=None, death_cost=0)
+    observation_space, action_space = env.observation_space, env.action_space
+    transitions = []
+    before = [env.reset(seed=0)]
+    for a in rng.integers(0, 18, size=steps):
+        obs, reward, terminated, truncated, info = env.step(int(a))
+        transitions.append((obs, reward, terminated, truncated, info))
+        if len(transitions) < steps:
+            before.append(env.reset() if terminated or truncated else (obs, info))
+    env.close()
+
+    metrics = {}
+    death_cost = -10
+    for n_envs in (8, 16, 32, 64):
+        offsets = [i * steps // n_envs for i in range(n_envs)]
+        # Variants take turns, so that noise affects them alike, and are compared by their median step time.
+        latencies = {name: np.zeros(steps) for name in ('base', 'scalar', 'replay', 'vectorized', 'replay_buffered',
+                                                         'buffered')}
+        bare_envs = [ReplayEnv(offset) for offset in offsets]
+        shaped_envs = [DeathCostWrapper(ReplayEnv(offset), death_cost=death_cost) for offset in offsets]
+        reset_infos = [env_.reset()[1] for env_ in bare_envs]
+        for env_ in shaped_envs:
+            env_.reset()
+        batches = []
+        scalar_rewards = np.zeros((steps, n_envs), dtype=np.float32)
+        for t in range(steps):
+            start = time.perf_counter()
+            batches.append(step_envs(bare_envs))
+            latencies['base'][t] = time.perf_counter() - start
+            start = time.perf_counter()
+            scalar_rewards[t] = step_envs(shaped_envs)[0]
+            latencies['scalar'][t] = time.perf_counter() - start
+
+        env_fns = [(lambda offset=offset: ReplayEnv(offset)) for offset in offsets]
+        replay = ReplayVecEnv(env_fns, reset_infos, batches)
+        vectorized = VecDeathCost(ReplayVecEnv(env_fns, reset_infos, batches), death_cost=death_cost)
+        replay_buffer, buffer = LivesBuffer(n_envs), LivesBuffer(n_envs)
+        replay_buffered = ReplayVecEnv(env_fns, reset_infos, batches, lives_buffer=replay_buffer)
+        buffered = VecDeathCost(ReplayVecEnv(env_fns, reset_infos, batches, lives_buffer=buffer),
+                                death_cost=death_cost, lives_buffer=buffer)
+        for venv in (replay, vectorized, replay_buffered, buffered):
+            venv.reset()
+        actions = np.zeros(n_envs, dtype=np.int64)
+        vectorized_rewards = np.zeros((steps, n_envs), dtype=np.float32)
+        buffered_rewards = np.zeros((steps, n_envs), dtype=np.float32)
+        for t in range(steps):
+            start = time.perf_counter()
+            replay.step(actions)
+            latencies['replay'][t] = time.perf_counter() - start
+            start = time.perf_counter()
+            _, vectorized_rewards[t], _, _ = vectorized.step(actions)
+            latencies['vectorized'][t] = time.perf_counter() - start
+            start = time.perf_counter()
+            replay_buffered.step(actions)
+            latencies['replay_buffered'][t] = time.perf_counter() - start
+            start = time.perf_counter()
+            _, buffered_rewards[t], _, _ = buffered.step(actions)
+            latencies['buffered'][t] = time.perf_counter() - start
+        if not all(np.array_equal(scalar_rewards, rewards) for rewards in (vectorized_rewards, buffered_rewards)):
+            raise RuntimeError(f'Vectorized shaping differs from per-environment shaping with {n_envs:d} environments')
+
+        times = {name: float(np.median(latency)) for name, latency in latencies.items()}
+        metrics[f'n{n_envs:d}_scalar_us'] = 1e6 * (times['scalar'] - times['base'])
+        metrics[f'n{n_envs:d}_vectorized_us'] = 1e6 * (times['vectorized'] - times['replay'])
+        # The replay writes the lives, as the environments' workers would, so only reading them is timed.
+        metrics[f'n{n_envs:d}_buffered_us'] = 1e6 * (times['buffered'] - times['replay_buffered'])
+    return metrics
+
+
+def bench_ram_features(steps, rng):
+    """
+    Cost per environment step of decoding RAM observations into features one at a time (as `RamFeatureWrapper` does)
+    against a batch at a time (as `VecRamFeatures` does), for 8 to 64 environments, and time of a PPO gradient step on
+    a minibatch of 64 raw RAM observations against their features. Decoded batches must equal decoded observations.
+    """
+    import torch
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils import montezuma, ram
+
+    env = montezuma.make_env(frameskip=4, render_mode=None)
+    observations = [env.reset(seed=0)[0]]
+    for a in rng.integers(0, 18, size=steps - 1):
+        obs, _, terminated, truncated, _ = env.step(int(a))
+        observations.append(env.reset()[0] if terminated or truncated else obs)
+    observations = np.array(observations)
+
+    metrics = {}
+    for n_envs in (8, 16, 32, 64):
+        batches = observations[:len(observations) // n_envs * n_envs].reshape((-1, n_envs, 128))
+        scalar = np.zeros((len(batches), n_envs, ram.N_FEATURES), dtype=np.float32)
+        start = time.perf_counter()
+        for t, batch in enumerate(batches):
+            for i, obs in enumerate(batch):
+                scalar[t, i] = ram.ram_features(obs)
+        scalar_time = time.perf_counter() - start
+        vectorized = np.zeros_like(scalar)
+        start = time.perf_counter()
+        for t, batch in enumerate(batches):
+            vectorized[t] = ram.ram_features(batch)
+        vectorized_time = time.perf_counter() - start
+        if not np.array_equal(scalar, vectorized):
+            raise RuntimeError(f'Batched RAM features differ from single ones with {n_envs:d} environments')
+        metrics[f'n{n_envs:d}_scalar_us'] = 1e6 * scalar_time / (len(batches) * n_envs)
+        metrics[f'n{n_envs:d}_vectorized_us'] = 1e6 * vectorized_time / (len(batches) * n_envs)
+
+    minibatch = observations[rng.integers(0, len(observations), size=64)]
+    actions = torch.as_tensor(rng.integers(0, 18, size=64))
+    for name, env_kwargs, obs in (('raw', {}, minibatch), ('features', {'ram_features': True},
+                                                            ram.ram_features(minibatch))):
+        env = montezuma.make_env(render_mode=None, **env_kwargs)
+        policy = PPO('MlpPolicy', env, seed=0).policy
+        obs = torch.as_tensor(obs)
+        latencies = np.zeros(min(steps, 1000))
+        for i in range(len(latencies)):
+            start = time.perf_counter()
+            values, log_prob, entropy = policy.evaluate_actions(obs, actions)
+            loss = values.mean() - log_prob.mean() - entropy.mean()
+            policy.optimizer.zero_grad()
+            loss.backward()
+            policy.optimizer.step()
+            latencies[i] = time.perf_counter() - start
+        metrics[f'train_step_{name}_p50_us'] = 1e6 * float(np.percentile(latencies, 50))
+        env.close()
+    return metrics
+
+
+def bench_count_bonus(steps, rng):
+    """
+    Cost per step of the count-based exploration bonus: of counting a state in a `CountTable` (local and in shared
+    memory), of keying it by cell or by SimHash of a preprocessed frame, and environment steps per second without and
+    with `CountBonusWrapper`.
+    """
+    from panama_joe.utils import montezuma, ram
+    from panama_joe.utils.counts import CountTable, SimHash
+
+    metrics = {}
+    keys = rng.integers(0, 2**40, size=max(steps, 10000)).tolist()
+    for name, shared in (('local', False), ('shared', True)):
+        table = CountTable(shared=shared)
+        start = time.perf_counter()
+        for key in keys:
+            table.increment(key)
+        metrics[f'increment_{name}_us'] = 1e6 * (time.perf_counter() - start) / len(keys)
+        table.close()
+
+    env = montezuma.make_env(render_mode=None)
+    obs, _ = env.reset(seed=0)
+    start = time.perf_counter()
+    for _ in range(steps):
+        ram.cell_key(obs)
+    metrics['cell_key_us'] = 1e6 * (time.perf_counter() - start) / steps
+    frame = np.asarray(montezuma.make_env(obs_type='rgb', render_mode=None, preprocess=True).reset(seed=0)[0])
+    simhash = SimHash(frame.shape)
+    start = time.perf_counter()
+    for _ in range(steps):
+        simhash(frame)
+    metrics['simhash_us'] = 1e6 * (time.perf_counter() - start) / steps
+
+    actions = rng.integers(0, 18, size=steps)
+    for count_bonus in (0, 1):
+        env = montezuma.make_env(frameskip=4, render_mode=None, count_bonus=count_bonus)
+        metrics[f'{"bonus" if count_bonus else "plain"}_steps_per_sec'] = _env_steps_per_sec(env, actions)
+        env.close()
+    return metrics
+
+
+def bench_cli_startup(steps, rng):
+    """
+    Wall time of `python -m panama_joe <command> --help` for each command, and of the utility commands, which should
+    never import PyTorch. Each is the fastest of a few runs.
+    """
+    from panama_joe import cli
+
+    metrics = {}
+    runs = [(f'help_{name}', [name, '--help']) for name in cli.COMMANDS.keys()]
+    runs += [('demos_list', ['demos', 'list']), ('models_list', ['models', 'list'])]
+    for metric, args in runs:
+        elapsed = []
+        for _ in range(3):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', cli.PROG] + args, check=True, stdout=subprocess.DEVNULL)
+            elapsed.append(time.perf_counter() - start)
+        metrics[f'{metric}_s'] = min(elapsed)
+    return metrics
+
+
+def _env_steps_per_sec(env, actions):
+    env.reset(seed=0)
+    start = time.perf_counter()
+    for a in actions:
+        _, _, terminated, truncated, _ = env.step(int(a))
+        if terminated or truncated:
+            env.reset()
+    return len(actions) / (time.perf_counter() - start)
+
+
+BENCHMARKS = {
+    'env_step': bench_env_step,
+    'demo_record': bench_demo_record,
+    'time_travel': bench_time_travel,
+    'demo_io': bench_demo_io,
+    'predict': bench_predict,
+    'inference_server': bench_inference_server,
+    'vec_shaping': bench_vec_shaping,
+    'ram_features': bench_ram_features,
+    'count_bonus': bench_count_bonus,
+    'cli_startup': bench_cli_startup
+}
+
+
+if __name__ == '__main__':
+    main()
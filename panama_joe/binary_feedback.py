@@ -1,18 +1,32 @@
 import argparse
+import collections
 import os
+import threading
 import time
 
 import numpy as np
-import torch
-from stable_baselines3.ppo import PPO
 
-from panama_joe.utils import folders, montezuma
+from panama_joe.utils import folders
 
+# Keys are `pygame.key.name`s.
+KEY_TO_FEEDBACK = {
+    '1': 1.0,  # Good.
+    '2': -1.0  # Bad.
+}
 
-def main():
+
+def main(argv=None, prog=None):
     parser = argparse.ArgumentParser(
+        prog=prog,
         description='Give TAMER-style feedback to a learning algorithm.'
     )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    binary_feedback(**kwargs)
+
+
+def add_arguments(parser):
     parser.add_argument('model_name',
                         choices=('ppo',),
                         help='Algorithm name.')
@@ -21,17 +35,43 @@ def main():
                         default=1,
                         type=int,
                         help='Number of episodes to evaluate.')
+    parser.add_argument('--fps',
+                        default=30,
+                        type=int,
+                        help='Frames per second.')
+    parser.add_argument('--zoom',
+                        default=3.0,
+                        type=float,
+                        help='Ratio to render frame from the default screen size.')
+    parser.add_argument('--credit_window',
+                        default=(0.2, 1.0),
+                        nargs=2,
+                        type=float,
+                        help='Steps taken between this many seconds before a key press are credited with its feedback.')
+    parser.add_argument('--batch_size',
+                        default=32,
+                        type=int,
+                        help='Number of labeled steps per gradient update.')
+    parser.add_argument('--buffer_size',
+                        default=5000,
+                        type=int,
+                        help='Number of labeled steps to keep for replay.')
+    parser.add_argument('--update_interval',
+                        default=0.1,
+                        type=float,
+                        help='Seconds between gradient updates.')
     parser.add_argument('--seed',
                         type=int,
                         help='Seed to random number generator.')
-    args = parser.parse_args()
-    kwargs = dict(vars(args))
-    binary_feedback(**kwargs)
 
 
-def binary_feedback(model_name, num_episodes=1, seed=None):
-    # env = montezuma.make_env(render_mode='human')
-    env = montezuma.make_env(obs_type='rgb', render_mode='human')
+def binary_feedback(model_name, num_episodes=1, seed=None, **kwargs):
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils import montezuma
+
+    # env = montezuma.make_env(render_mode='rgb_array')
+    env = montezuma.make_env(obs_type='rgb', render_mode='rgb_array', preprocess=True)
     if model_name == 'ppo':
         # model = PPO('MlpPolicy', env, seed=seed)
         model = PPO('CnnPolicy', env, seed=seed)
@@ -40,7 +80,7 @@ def binary_feedback(model_name, num_episodes=1, seed=None):
 
     # optimizer = torch.optim.Adam([model.get_parameters()])
     optimizer = model.policy.optimizer
-    learn_with_input(env, model, optimizer, num_episodes, seed=seed)
+    learn_with_input(env, model, optimizer, num_episodes, seed=seed, **kwargs)
     binary_dir = folders.model_dir('binary')
     model_dir = os.path.join(binary_dir, model_name)
     os.makedirs(model_dir, exist_ok=True)
@@ -49,32 +89,159 @@ def binary_feedback(model_name, num_episodes=1, seed=None):
     model.save(path)
 
 
-def learn_with_input(env, model, optimizer, num_episodes, seed=None):
+def learn_with_input(env, model, optimizer, num_episodes, seed=None, fps=30, zoom=3.0, credit_window=(0.2, 1.0),
+                     batch_size=32, buffer_size=5000, update_interval=0.1):
+    """
+    Play the model's policy in real time while a human presses keys (see `KEY_TO_FEEDBACK`) to label its behavior.
+    Each label is credited to the `(obs, action)` pairs of the steps taken during `credit_window` seconds before the key
+    press, stored in a replay buffer, and learned from in minibatches on a background thread.
+    """
+    import pygame
+    from gymnasium.utils import play
+
+    from panama_joe.utils import montezuma
+
+    pygame.init()
+    pygame.display.set_caption(f'Feedback for {montezuma.ENV_ID}: 1 = good, 2 = bad')
     env.reset(seed=seed)
+    frame = env.render()
+    video_size = int(frame.shape[1] * zoom), int(frame.shape[0] * zoom)
+    screen = pygame.display.set_mode(video_size)
+    clock = pygame.time.Clock()
+
+    key_to_feedback = {pygame.key.key_code(name): label for name, label in KEY_TO_FEEDBACK.items()}
+    lock = threading.Lock()  # Guards the policy's parameters between prediction and optimizer steps.
+    buffer = FeedbackBuffer(buffer_size, env.observation_space.shape, env.observation_space.dtype,
+                            action_shape=env.action_space.shape, action_dtype=env.action_space.dtype)
+    learner = FeedbackLearner(model, optimizer, buffer, lock, batch_size=batch_size, update_interval=update_interval,
+                              seed=seed)
+    learner.start()
+    history = collections.deque(maxlen=int(np.ceil(credit_window[1] * fps)) + 1)
+
+    running = True
     episode = 0
-    while episode < num_episodes:
+    while running and episode < num_episodes:
         total_reward = 0
+        n_labels = buffer.n_added
         obs, info = env.reset()
+        history.clear()
         terminated, truncated = False, False
-        while not terminated and not truncated:
-            # obs_tensor = torch.tensor(np.transpose(obs, axes=(2, 0, 1)))
-            action, _ = model.predict(obs)
+        while running and not terminated and not truncated:
+            with lock:
+                action, _ = model.predict(obs)
+            history.append((time.perf_counter(), np.array(obs), action))
             obs, reward, terminated, truncated, info = env.step(action)
-            feedback = input('ENTER: no reward; 1: reward! - ')
-            if feedback == '1':
-                # reward += 1
-                optimizer.zero_grad()
-                obs_tensor, vec_env = model.policy.obs_to_tensor(obs)
-                logits = model.policy.predict_values(obs_tensor)
-                print(logits)
-                loss = 1 - logits[0][0]
-                loss.backward()
-                optimizer.step()
-
             total_reward += reward
-        print(f'Total reward: {total_reward:d}')
+
+            play.display_arr(screen, env.render(), video_size=video_size, transpose=True)
+            pygame.display.flip()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key in key_to_feedback:
+                    credit_feedback(history, time.perf_counter(), key_to_feedback[event.key], buffer, credit_window)
+            clock.tick(fps)
+        print(f'Total reward: {total_reward:g}; labels: {buffer.n_added - n_labels:d};'
+              f' updates so far: {learner.n_updates:d}')
         episode += 1
 
+    learner.stop()
+    pygame.quit()
+
+
+def credit_feedback(history, feedback_time, label, buffer, credit_window):
+    """
+    Add every `(time, obs, action)` in `history` that happened within `credit_window` seconds before `feedback_time` to
+    `buffer` with `label`.
+    """
+    min_delay, max_delay = credit_window
+    for step_time, obs, action in history:
+        if min_delay <= feedback_time - step_time <= max_delay:
+            buffer.add(obs, action, label)
+
+
+class FeedbackBuffer:
+    """
+    Fixed-size, thread-safe replay buffer of labeled `(obs, action)` pairs. The oldest labels are overwritten first.
+    """
+
+    def __init__(self, capacity, obs_shape, obs_dtype, action_shape=(), action_dtype=np.int64):
+        self.obs = np.zeros((capacity, *obs_shape), dtype=obs_dtype)
+        self.actions = np.zeros((capacity, *action_shape), dtype=action_dtype)
+        self.labels = np.zeros(capacity, dtype=np.float32)
+        self.n_added = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.n_added, len(self.labels))
+
+    def add(self, obs, action, label):
+        with self.lock:
+            i = self.n_added % len(self.labels)
+            self.obs[i] = obs
+            self.actions[i] = action
+            self.labels[i] = label
+            self.n_added += 1
+
+    def sample(self, batch_size, rng):
+        with self.lock:
+            indices = rng.integers(0, len(self), size=min(batch_size, len(self)))
+            return self.obs[indices], self.actions[indices], self.labels[indices]
+
+
+class FeedbackLearner(threading.Thread):
+    """
+    Takes a gradient step on a minibatch from the feedback buffer every `update_interval` seconds, pushing the value
+    of labeled observations toward their labels, and the probability of the labeled actions up for good labels and
+    down for bad ones.
+    """
+
+    def __init__(self, model, optimizer, buffer, lock, batch_size=32, update_interval=0.1, seed=None):
+        super(FeedbackLearner, self).__init__(daemon=True)
+        self.model = model
+        self.optimizer = optimizer
+        self.buffer = buffer
+        self.lock = lock
+        self.batch_size = batch_size
+        self.update_interval = update_interval
+        self.rng = np.random.default_rng(seed)
+        self.n_updates = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.update_interval):
+            if len(self.buffer) > 0:
+                self.update()
+
+    def update(self):
+        import torch
+        from gymnasium import spaces
+
+        obs, actions, labels = self.buffer.sample(self.batch_size, self.rng)
+        policy = self.model.policy
+        obs_tensor, _ = policy.obs_to_tensor(obs)
+        actions = torch.as_tensor(actions, device=policy.device)
+        if isinstance(policy.action_space, spaces.Discrete):
+            actions = actions.long().flatten()
+        values, log_prob, _ = policy.evaluate_actions(obs_tensor, actions)
+        labels = torch.as_tensor(labels, device=policy.device)
+        # A regression onto the label: the values of replayed observations settle there rather than growing forever.
+        value_loss = torch.nn.functional.smooth_l1_loss(values.flatten(), labels)
+        # `-log p(action)` for good labels; `-log(1 - p(action))` for bad ones, which is bounded as `p` goes to 0.
+        bad_log_prob = torch.log1p(-torch.exp(log_prob).clamp(max=1 - 1e-6))
+        policy_loss = -torch.where(labels > 0, log_prob, bad_log_prob).mean()
+        loss = value_loss + policy_loss
+        self.optimizer.zero_grad()
+        loss.backward()
+        # The forward and backward passes only read the parameters, so the game loop only waits on the step itself.
+        with self.lock:
+            self.optimizer.step()
+        self.n_updates += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
 
 if __name__ == '__main__':
     main()
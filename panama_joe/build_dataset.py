@@ -0,0 +1,55 @@
+import argparse
+import os
+import time
+
+from panama_joe.utils import demos, folders, transitions
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Convert recorded demos to a sharded dataset of transitions for imitation learning.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    build_dataset(**kwargs)
+
+
+def add_arguments(parser):
+    parser.add_argument('file_names',
+                        nargs='*',
+                        help='Demos to include. By default, every demo in the demos directory.')
+    parser.add_argument('--demo_type',
+                        default='human',
+                        help='Subdirectory of the demos directory.')
+    parser.add_argument('--dataset_name',
+                        type=str,
+                        help='Name of the dataset. By default, the current timestamp.')
+    parser.add_argument('--shard_size',
+                        default=65536,
+                        type=int,
+                        help='Number of transitions per shard.')
+
+
+def build_dataset(file_names=None, demo_type='human', dataset_name=None, shard_size=65536):
+    from panama_joe.utils import montezuma
+
+    demo_dir = folders.demo_dir(demo_type)
+    if not file_names:
+        file_names = demos.list_demos(demo_dir)
+    if dataset_name is None:
+        dataset_name = f'{int(time.time()):d}'
+    env = montezuma.make_env()
+    n_actions = int(env.action_space.n)
+    env.close()
+
+    path = folders.dataset_dir(dataset_name)
+    demo_paths = [os.path.join(demo_dir, file_name) for file_name in file_names]
+    n = transitions.build_dataset(demo_paths, path, n_actions, shard_size=shard_size)
+    print(f'Wrote {n:d} transitions from {len(demo_paths):d} demos to {path}')
+    return path
+
+
+if __name__ == '__main__':
+    main()
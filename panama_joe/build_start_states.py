@@ -0,0 +1,54 @@
+import argparse
+import os
+import time
+
+from panama_joe.utils import demos, folders, start_states
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Cache emulator states along recorded demos, from which to start training episodes.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    build_start_states(**kwargs)
+
+
+def add_arguments(parser):
+    parser.add_argument('file_names',
+                        nargs='*',
+                        help='Demos to include. By default, every demo in the demos directory.')
+    parser.add_argument('--demo_type',
+                        default='human',
+                        help='Subdirectory of the demos directory.')
+    parser.add_argument('--cache_name',
+                        type=str,
+                        help='Name of the cache. By default, the current timestamp.')
+    parser.add_argument('--stride',
+                        default=10,
+                        type=int,
+                        help='Number of steps between cached states.')
+
+
+def build_start_states(file_names=None, demo_type='human', cache_name=None, stride=10):
+    from panama_joe.utils import montezuma
+
+    demo_dir = folders.demo_dir(demo_type)
+    if not file_names:
+        file_names = demos.list_demos(demo_dir)
+    if cache_name is None:
+        cache_name = f'{int(time.time()):d}'
+    env = montezuma.make_env(render_mode=None)
+
+    path = folders.start_state_dir(cache_name)
+    demo_paths = [os.path.join(demo_dir, file_name) for file_name in file_names]
+    n = start_states.build_start_state_cache(demo_paths, path, env.unwrapped, stride=stride)
+    env.close()
+    print(f'Cached {n:d} start states from {len(demo_paths):d} demos in {path}')
+    return path
+
+
+if __name__ == '__main__':
+    main()
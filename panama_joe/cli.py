@@ -0,0 +1,50 @@
+"""
+Single entry point for every script: `python -m panama_joe <command> ...`.
+
+Only the module of the chosen command is imported, and each module defers heavy imports (PyTorch, Stable-Baselines3,
+Gymnasium, pygame) to the functions which need them, so `--help` and the utility commands start quickly.
+"""
+import argparse
+import importlib
+import sys
+
+PROG = 'panama_joe'
+# Command name: (module, help). Each module has `main(argv, prog)` and `add_arguments(parser)`.
+COMMANDS = {
+    'train_baseline': ('panama_joe.train_baseline', 'Train a baseline with which to compare our methods.'),
+    'sweep': ('panama_joe.sweep', 'Run a grid or random search of baseline training runs in parallel.'),
+    'evaluate': ('panama_joe.evaluate', 'Evaluate a saved model.'),
+    'export_model': ('panama_joe.export_model', 'Export a saved policy as a TorchScript module for fast inference.'),
+    'record_demo': ('panama_joe.record_demo', 'Record demonstrations.'),
+    'binary_feedback': ('panama_joe.binary_feedback', 'Give TAMER-style feedback to a learning algorithm.'),
+    'convert_demos': ('panama_joe.convert_demos', 'Convert demos to the columnar or action-only format.'),
+    'validate_demos': ('panama_joe.validate_demos', 'Replay demos headlessly and check that they are deterministic.'),
+    'build_dataset': ('panama_joe.build_dataset', 'Convert recorded demos to a sharded dataset of transitions.'),
+    'build_start_states': ('panama_joe.build_start_states', 'Cache emulator states along demos to start from.'),
+    'explore': ('panama_joe.explore', 'Explore with Go-Explore.'),
+    'benchmark': ('panama_joe.benchmark', 'Benchmark environment stepping, wrappers, demo I/O and inference.'),
+    'demos': ('panama_joe.inspect_demos', 'List and inspect recorded demos.'),
+    'models': ('panama_joe.inspect_models', 'List and inspect saved models and checkpoints.')
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if len(argv) > 0 and argv[0] in COMMANDS:
+        module = importlib.import_module(COMMANDS[argv[0]][0])
+        return module.main(argv[1:], prog=f'{PROG} {argv[0]}')
+
+    parser = argparse.ArgumentParser(
+        prog=PROG,
+        description='Montezuma\'s Revenge experiments.'
+    )
+    subparsers = parser.add_subparsers(metavar='command')
+    for name, (_, help_) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_, add_help=False)
+    parser.parse_args(argv)  # Prints help or the error for an unknown command, and exits.
+    parser.print_help()
+    sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
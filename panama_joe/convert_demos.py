@@ -0,0 +1,71 @@
+import argparse
+import os
+import shutil
+
+from panama_joe.utils import demos, folders
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Convert pickled demos to the columnar, memory-mappable format, or demos to action-only demos.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    convert_demos(**kwargs)
+
+
+def add_arguments(parser):
+    parser.add_argument('file_names',
+                        nargs='*',
+                        help='Demo files to convert. By default, every pickled demo (or, to action-only demos, every demo'
+                             ' with observations) without a converted copy.')
+    parser.add_argument('--demo_type',
+                        default='human',
+                        help='Subdirectory of the demos directory.')
+    parser.add_argument('--demo_format',
+                        default='columnar',
+                        choices=('columnar', 'actions'),
+                        help='Format to convert to. Action-only demos (actions) leave out observations, which are'
+                             ' regenerated by replaying the actions; validate them with `validate_demos`.')
+    parser.add_argument('--chunk_size',
+                        default=1024,
+                        type=int,
+                        help='Number of steps per write.')
+    parser.add_argument('--remove',
+                        action='store_true',
+                        help='Flag to delete each source demo after it has been converted.')
+
+
+def convert_demos(file_names=None, demo_type='human', demo_format='columnar', chunk_size=1024, remove=False):
+    demo_dir = folders.demo_dir(demo_type)
+    suffix = demos.DEMO_FORMAT_SUFFIXES[demo_format]
+    if not file_names:
+        sources = (demos.LEGACY_SUFFIX,) if demo_format == 'columnar' else (demos.LEGACY_SUFFIX, demos.COLUMNAR_SUFFIX)
+        file_names = [file_name for file_name in demos.list_demos(demo_dir)
+                      if file_name.endswith(sources)
+                      and not os.path.exists(os.path.join(demo_dir, _converted_name(file_name, suffix)))]
+    for file_name in file_names:
+        src_path = os.path.join(demo_dir, file_name)
+        dst_path = os.path.join(demo_dir, _converted_name(file_name, suffix))
+        size = demos.size_on_disk(src_path)
+        if demo_format == 'columnar':
+            demos.convert_legacy_demo(src_path, dst_path, chunk_size=chunk_size)
+        else:
+            from panama_joe.utils.demo_replay import convert_to_action_demo  # Imports the emulator.
+            convert_to_action_demo(src_path, dst_path, chunk_size=chunk_size)
+        print(f'{file_name} ({size:d} bytes) -> {os.path.basename(dst_path)} ({demos.size_on_disk(dst_path):d} bytes)')
+        if remove:
+            if os.path.isdir(src_path):
+                shutil.rmtree(src_path)
+            else:
+                os.remove(src_path)
+
+
+def _converted_name(file_name, suffix):
+    return os.path.splitext(file_name)[0] + suffix
+
+
+if __name__ == '__main__':
+    main()
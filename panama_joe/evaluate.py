@@ -1,21 +1,40 @@
 import argparse
+import csv
+import json
+import multiprocessing
+import multiprocessing.util
 import os
+import time
 
-from stable_baselines3.ppo import PPO
+import numpy as np
 
-from panama_joe.utils import folders, montezuma
+from panama_joe.utils import folders
+from panama_joe.utils.inference import InferenceClient
+from panama_joe.utils.video import VIDEO_KEEP, VideoRecorder, prune_videos
 
+EPISODE_FIELDS = ('episode', 'seed', 'return', 'length', 'lives_lost', 'wall_time', 'video')
+SUMMARY_FIELDS = ('return', 'length', 'lives_lost', 'wall_time')
+Z_95 = 1.959964
 
-def main():
+
+def main(argv=None, prog=None):
     parser = argparse.ArgumentParser(
+        prog=prog,
         description='Evaluate a saved model.'
     )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    evaluate(**kwargs)
+
+
+def add_arguments(parser):
     parser.add_argument('model_name',
                         choices=('ppo',),
                         help='Algorithm name.')
     parser.add_argument('file_name',
                         type=str,
-                        help='Path to saved model.')
+                        help='Path to saved model, or to a policy exported by `export_model` (`.pt`).')
     parser.add_argument('--num_episodes',
                         '-e',
                         default=1,
@@ -23,35 +42,279 @@ def main():
                         help='Number of episodes to evaluate.')
     parser.add_argument('--save_video',
                         action='store_true',
-                        help='Flag to enable saving of a video.')
+                        help='Flag to save a video of each episode to the videos directory, rendering without a'
+                             ' display.')
+    parser.add_argument('--video_keep',
+                        choices=VIDEO_KEEP,
+                        default='all',
+                        help='Which videos to keep: all of them, or those of the best or worst episodes by return.')
+    parser.add_argument('--video_k',
+                        default=5,
+                        type=int,
+                        help='Number of best or worst videos to keep.')
+    parser.add_argument('--headless',
+                        action='store_true',
+                        help='Flag to evaluate without a display and write per-episode records and statistics to the'
+                             ' evaluations directory.')
+    parser.add_argument('--n_workers',
+                        '-w',
+                        default=1,
+                        type=int,
+                        help='Number of processes across which to spread headless episodes.')
+    parser.add_argument('--inference_server',
+                        action='store_true',
+                        help='Flag to run the policy of headless workers in one server process, which batches their'
+                             ' requests, rather than in each worker. Worth it from about 4 workers on runs long enough'
+                             ' to make up for starting the server (a few seconds); with fewer workers, each request\'s'
+                             ' round trip costs more than the batching saves.')
+    parser.add_argument('--max_latency_ms',
+                        default=1.0,
+                        type=float,
+                        help='Longest time the inference server waits for more requests to batch.')
     parser.add_argument('--seed',
                         type=int,
-                        help='Seed to random number generator.')
-    args = parser.parse_args()
-    kwargs = dict(vars(args))
-    evaluate(**kwargs)
+                        help='Seed to random number generator. Headless episode `i` is seeded with `seed + i`.')
 
 
-def evaluate(model_name, file_name, num_episodes=1, save_video=False, seed=None):
-    env = montezuma.make_env(render_mode='human')
-    if model_name == 'ppo':
-        path = os.path.join(folders.model_dir(model_name), file_name)
-        model = PPO.load(path)
-    else:
-        raise ValueError(f'Unknown algorithm name: {model_name}')
+def evaluate(model_name, file_name, num_episodes=1, save_video=False, video_keep='all', video_k=5, headless=False,
+             n_workers=1, inference_server=False, max_latency_ms=1.0, seed=None):
+    video_kwargs = None
+    if save_video:
+        video_kwargs = {'keep': video_keep, 'k': video_k, 'prefix': _video_prefix(file_name)}
+    if headless:
+        server_kwargs = {'max_latency_ms': max_latency_ms} if inference_server else None
+        evaluate_headless(model_name, file_name, num_episodes=num_episodes, n_workers=n_workers, seed=seed,
+                          video_kwargs=video_kwargs, server_kwargs=server_kwargs)
+        return
+
+    from panama_joe.utils import montezuma
+
+    # Rendering to the display would throttle episodes to its speed, so videos are rendered without one.
+    env = montezuma.make_env(render_mode='rgb_array' if save_video else 'human')
+    model = load_model(model_name, file_name)
+    recorder = None
+    if save_video:
+        recorder = VideoRecorder(folders.video_dir(model_name), keep=video_keep, k=video_k)
 
     env.reset(seed=seed)
-    episode = 0
-    while episode < num_episodes:
-        total_reward = 0
-        obs, info = env.reset()
-        terminated, truncated = False, False
-        while not terminated and not truncated:
-            action, _ = model.predict(obs)
-            obs, reward, terminated, truncated, info = env.step(action)
-            total_reward += reward
-        print(f'Total reward: {total_reward:d}')
-        episode += 1
+    for episode in range(num_episodes):
+        video_file_name = None if recorder is None else _video_file_name(video_kwargs['prefix'], episode)
+        record = run_episode(env, model, recorder=recorder, video_file_name=video_file_name)
+        print(f'Total reward: {record["return"]:g}')
+    if recorder is not None:
+        recorder.close()
+        if recorder.n_dropped > 0:
+            print(f'Dropped {recorder.n_dropped:d} frames while the encoder was behind')
+        print(f'Videos: {folders.video_dir(model_name)}')
+
+
+def load_model(model_name, file_name):
+    """
+    :return: Saved model or, for `.pt` files (see `export_model`), exported policy.
+    """
+    if model_name != 'ppo':
+        raise ValueError(f'Unknown algorithm name: {model_name}')
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils.export import EXPORT_SUFFIX, ExportedPolicy
+
+    path = os.path.join(folders.model_dir(model_name), file_name)
+    if file_name.endswith(EXPORT_SUFFIX):
+        return ExportedPolicy(path)
+    return PPO.load(path)
+
+
+def evaluate_headless(model_name, file_name, num_episodes=1, n_workers=1, seed=None, video_kwargs=None,
+                      server_kwargs=None):
+    """
+    Run episodes without a display, optionally across a pool of processes, and write the per-episode records and
+    their summary statistics (as JSON and CSV) to `folders.evaluation_dir(model_name)`.
+
+    :param video_kwargs: To save videos to `folders.video_dir(model_name)`, the videos to keep (`keep` and `k`, see
+        `VideoRecorder`) and the `prefix` of their file names. Each process keeps its own best or worst `k`, then
+        those of all processes are pruned to `k`.
+    :param server_kwargs: To run the policy of every process in one `InferenceServer`, which batches their requests,
+        the server's keyword arguments (e.g., `max_latency_ms`). The server samples actions with its own random number
+        generator, so seeds only apply to the environments.
+    :return: Path to the JSON results, without extension.
+    """
+    if num_episodes < 1:
+        raise ValueError(f'At least one episode is needed to evaluate, not {num_episodes:d}')
+    tasks = [(episode, None if seed is None else seed + episode) for episode in range(num_episodes)]
+    server = None
+    channels = None
+    server_metrics = None
+    if server_kwargs is not None:
+        from panama_joe.utils import montezuma
+        from panama_joe.utils.inference import InferenceServer
+
+        env = montezuma.make_env(render_mode=None)
+        server = InferenceServer(os.path.join(folders.model_dir(model_name), file_name), env.observation_space,
+                                 n_clients=n_workers, **server_kwargs)
+        env.close()
+        channels = server.channels
+    start = time.perf_counter()
+    try:
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers, initializer=_init_worker,
+                                        initargs=(model_name, file_name, 1, video_kwargs, channels))
+            try:
+                records = pool.map(_run_worker_episode, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()  # Workers finish encoding their videos as they exit.
+        else:
+            _init_worker(model_name, file_name, video_kwargs=video_kwargs, channels=channels)
+            records = [_run_worker_episode(task) for task in tasks]
+            if 'recorder' in _worker:
+                _worker.pop('recorder').close()
+    finally:
+        if server is not None:
+            server_metrics = server.close()
+    elapsed = time.perf_counter() - start
+    if video_kwargs is not None:
+        prune_videos(records, keep=video_kwargs['keep'], k=video_kwargs['k'])
+    summary = summarize(records)
+    # Episodes differ in length, so runs are compared by steps per second rather than by wall time.
+    steps_per_sec = sum(record['length'] for record in records) / elapsed
+
+    stamp = int(time.time())
+    path = os.path.join(folders.evaluation_dir(model_name), f'{os.path.splitext(file_name)[0]}_{stamp:d}')
+    with open(path + '.json', 'w') as f:
+        json.dump({
+            'model_name': model_name,
+            'file_name': file_name,
+            'num_episodes': num_episodes,
+            'n_workers': n_workers,
+            'seed': seed,
+            'wall_time': elapsed,
+            'steps_per_sec': steps_per_sec,
+            'inference_server': server_metrics,
+            'summary': summary,
+            'episodes': records
+        }, f, indent=2)
+    with open(path + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EPISODE_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+    stats = summary['return']
+    print(f'Return: {stats["mean"]:.2f} +/- {stats["ci95"]:.2f} (95% CI) over {num_episodes:d} episodes'
+          f' in {elapsed:.1f}s ({steps_per_sec:.0f} steps/sec)')
+    if server_metrics is not None:
+        print(f'Inference server: {server_metrics["requests"]:d} requests in batches of'
+              f' {server_metrics.get("batch_size_mean", 0):.1f} on average, queue latency'
+              f' {server_metrics.get("queue_latency_p50_us", 0):.0f}us (p50)'
+              f' / {server_metrics.get("queue_latency_p99_us", 0):.0f}us (p99)')
+    print(f'Results: {path}.json')
+    if video_kwargs is not None:
+        print(f'Videos: {sum(record["video"] is not None for record in records):d} in'
+              f' {folders.video_dir(model_name)}')
+    return path
+
+
+def run_episode(env, model, seed=None, recorder=None, video_file_name=None):
+    """
+    :param recorder: `VideoRecorder` to which to hand the frames of the episode, rendered by `env` (with
+        `render_mode='rgb_array'`).
+    :param video_file_name: Name of the episode's video file.
+    :return: Record of one episode: its seed, return, length, lives lost, wall time and video path.
+    """
+    start = time.perf_counter()
+    if seed is not None and not isinstance(model, InferenceClient):
+        from stable_baselines3.common.utils import set_random_seed
+
+        set_random_seed(seed)  # Actions are sampled from the policy.
+    obs, info = env.reset(seed=seed)
+    video = None
+    if recorder is not None:
+        video = recorder.start_episode(video_file_name)
+        recorder.add_frame(env.render())
+    lives = info['lives']
+    total_reward, length, lives_lost = 0.0, 0, 0
+    terminated, truncated = False, False
+    while not terminated and not truncated:
+        action, _ = model.predict(obs)
+        obs, reward, terminated, truncated, info = env.step(action)
+        if recorder is not None:
+            recorder.add_frame(env.render())
+        total_reward += float(reward)
+        length += 1
+        lives_lost += max(0, lives - info['lives'])
+        lives = info['lives']
+    if recorder is not None:
+        recorder.end_episode(total_reward)
+    return {
+        'seed': seed,
+        'return': total_reward,
+        'length': length,
+        'lives_lost': lives_lost,
+        'wall_time': time.perf_counter() - start,
+        'video': video
+    }
+
+
+def summarize(records):
+    """
+    :return: Mean, standard deviation, quantiles and a normal-approximation 95% confidence interval half-width of the
+        mean, for each of `SUMMARY_FIELDS`.
+    """
+    if len(records) == 0:
+        raise ValueError('No episodes to summarize')
+    summary = {}
+    for field in SUMMARY_FIELDS:
+        values = np.array([record[field] for record in records], dtype=np.float64)
+        std = float(values.std(ddof=1)) if len(values) > 1 else 0.0
+        summary[field] = {
+            'mean': float(values.mean()),
+            'std': std,
+            'ci95': Z_95 * std / np.sqrt(len(values)),
+            'min': float(values.min()),
+            'median': float(np.median(values)),
+            'max': float(values.max())
+        }
+    return summary
+
+
+_worker = {}
+
+
+def _init_worker(model_name, file_name, n_threads=None, video_kwargs=None, channels=None):
+    from panama_joe.utils import montezuma
+
+    _worker['env'] = montezuma.make_env(render_mode=None if video_kwargs is None else 'rgb_array')
+    if channels is not None:
+        _worker['model'] = channels.connect()  # Requests actions from the inference server.
+    else:
+        import torch
+
+        if n_threads is not None:
+            torch.set_num_threads(n_threads)  # Processes, not threads, provide the parallelism.
+        _worker['model'] = load_model(model_name, file_name)
+    if video_kwargs is not None:
+        _worker['recorder'] = VideoRecorder(folders.video_dir(model_name), keep=video_kwargs['keep'],
+                                            k=video_kwargs['k'])
+        _worker['video_prefix'] = video_kwargs['prefix']
+        if n_threads is not None:  # In a pool process: finish encoding when it exits.
+            multiprocessing.util.Finalize(None, _worker['recorder'].close, exitpriority=10)
+
+
+def _run_worker_episode(task):
+    episode, seed = task
+    recorder = _worker.get('recorder')
+    video_file_name = None if recorder is None else _video_file_name(_worker['video_prefix'], episode)
+    record = run_episode(_worker['env'], _worker['model'], seed=seed, recorder=recorder,
+                         video_file_name=video_file_name)
+    record['episode'] = episode
+    return record
+
+
+def _video_prefix(file_name):
+    return f'{os.path.splitext(os.path.basename(file_name))[0]}_{int(time.time()):d}'
+
+
+def _video_file_name(prefix, episode):
+    return f'{prefix}_{episode:04d}.mp4'
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+import argparse
+import multiprocessing
+import pickle
+import time
+
+import numpy as np
+
+from panama_joe.utils import folders, ram
+from panama_joe.utils.cells import CellArchive
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Explore with Go-Explore: return to a promising cell, then explore from it.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    explore(**kwargs)
+
+
+def add_arguments(parser):
+    parser.add_argument('--archive_name',
+                        type=str,
+                        help='Name of the archive to create or resume. By default, the current timestamp.')
+    parser.add_argument('--iterations',
+                        '-i',
+                        default=100,
+                        type=int,
+                        help='Number of rounds of cell selection and exploration.')
+    parser.add_argument('--cells_per_iteration',
+                        default=16,
+                        type=int,
+                        help='Number of cells to explore from per iteration.')
+    parser.add_argument('--explore_steps',
+                        default=100,
+                        type=int,
+                        help='Maximum number of random steps per exploration run.')
+    parser.add_argument('--repeat_action',
+                        default=0.95,
+                        type=float,
+                        help='Probability of repeating the previous random action.')
+    parser.add_argument('--frameskip',
+                        default=1,
+                        type=int,
+                        help='Frames to skip.')
+    parser.add_argument('--n_workers',
+                        '-w',
+                        default=1,
+                        type=int,
+                        help='Number of exploration processes.')
+    parser.add_argument('--capacity',
+                        default=2**20,
+                        type=int,
+                        help='Maximum number of cells.')
+    parser.add_argument('--max_snapshots',
+                        default=20000,
+                        type=int,
+                        help='Maximum number of emulator snapshots to keep.')
+    parser.add_argument('--max_actions',
+                        default=2**26,
+                        type=int,
+                        help='Maximum number of actions stored in the archive\'s trajectories (one byte each).')
+    parser.add_argument('--checkpoint_every',
+                        default=10,
+                        type=int,
+                        help='Number of iterations between saves of the archive.')
+    parser.add_argument('--seed',
+                        type=int,
+                        help='Seed to random number generator.')
+
+
+def explore(archive_name=None, iterations=100, cells_per_iteration=16, explore_steps=100, repeat_action=0.95,
+            frameskip=1, n_workers=1, capacity=2**20, max_snapshots=20000, max_actions=2**26, checkpoint_every=10,
+            seed=None):
+    if archive_name is None:
+        archive_name = f'{int(time.time()):d}'
+    path = folders.archive_dir(archive_name)
+    rng = np.random.default_rng(seed)
+    env_kwargs = {'frameskip': frameskip}
+    if CellArchive.exists(path):
+        archive = CellArchive.load(path)
+    else:
+        archive = CellArchive(capacity=capacity, max_snapshots=max_snapshots, max_actions=max_actions)
+        env = _make_env(**env_kwargs)
+        obs, info = env.reset(seed=seed)
+        archive.add_root(ram.cell_keys(obs), pickle.dumps(env.clone_state()))
+        env.close()
+
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(env_kwargs,))
+        imap = pool.imap_unordered
+    else:
+        pool = None
+        _init_worker(env_kwargs)
+        imap = map
+    try:
+        for iteration in range(iterations):
+            start = time.perf_counter()
+            cells = archive.select(cells_per_iteration, rng)
+            tasks = [(*archive.task(cell), explore_steps, repeat_action, int(rng.integers(2**31)))
+                     for cell in cells]
+            n_improved, n_steps = 0, 0
+            for result in imap(_explore_from, tasks):
+                n_improved += archive.update(*result)
+                n_steps += len(result[1])
+            best = archive.best_cell()
+            print(f'Iteration {iteration + 1:d}: {len(archive):d} cells ({n_improved:d} new or improved);'
+                  f' best score {archive.scores[best]:g} in room {ram.describe_cell(archive.keys[best])["room"]:d};'
+                  f' {n_steps / (time.perf_counter() - start):.0f} steps/sec')
+            if (iteration + 1) % checkpoint_every == 0:
+                archive.save(path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    archive.save(path)
+    if archive.n_dropped_runs > 0:
+        print(f'Dropped {archive.n_dropped_runs:d} runs whose trajectories did not fit in {archive.max_actions:d}'
+              f' actions')
+    file_name = export_best_demo(archive, folders.demo_dir('explore'), f'{archive_name}.demo', **env_kwargs)
+    if file_name is None:
+        print('No cell scored yet, so no trajectory was exported')
+    else:
+        print(f'Best trajectory: {file_name}')
+    return archive
+
+
+def export_best_demo(archive, demos_dir, file_name, **kwargs):
+    """
+    Replay the archive's best trajectory through `AtariDemo` and save it as a demo.
+
+    :param kwargs: Passed to `montezuma.make_env`.
+    :return: Name of the demo file, or `None` if no cell scored: the best cell is then the starting one.
+    """
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.wrappers import AtariDemo
+
+    best = archive.best_cell()
+    if archive.scores[best] <= 0:
+        return None
+    env = AtariDemo(montezuma.make_env(**kwargs), demos_dir=demos_dir)
+    env.reset()
+    for action in archive.trajectory(best):
+        env.step(int(action))
+    env.save_to_file(file_name)
+    env.close()
+    return file_name
+
+
+def _make_env(frameskip=1):
+    from panama_joe.utils import montezuma
+
+    # Rewards are the raw game score; losing a life ends an exploration run instead.
+    return montezuma.make_env(obs_type='ram', frameskip=frameskip, render_mode=None, death_cost=0).unwrapped
+
+
+_worker = {}
+
+
+def _init_worker(env_kwargs):
+    _worker['env'] = _make_env(**env_kwargs)
+
+
+def _explore_from(task):
+    """
+    Restore a cell, then take random (mostly repeated) actions until `explore_steps`, the end of the episode, or a
+    lost life. Only the first visit to each cell during the run is reported, with a snapshot from that moment.
+    """
+    cell, score, snapshot, trajectory, explore_steps, repeat_action, seed = task
+    env = _worker['env']
+    rng = np.random.default_rng(seed)
+    if snapshot is not None:
+        env.restore_state(pickle.loads(snapshot))
+    else:
+        env.reset()
+        for action in trajectory:
+            env.step(int(action))
+    lives = env.ale.lives()
+    n_actions = env.action_space.n
+
+    actions = np.zeros(explore_steps, dtype=np.uint8)
+    visited = set()
+    keys, scores, steps, snapshots = [], [], [], []
+    action = 0
+    n = 0
+    while n < explore_steps:
+        if n == 0 or rng.random() >= repeat_action:
+            action = rng.integers(n_actions)
+        obs, reward, terminated, truncated, info = env.step(action)
+        actions[n] = action
+        score += reward
+        if terminated or truncated or env.ale.lives() < lives:
+            break
+        key = int(ram.cell_keys(obs))
+        if key not in visited:
+            visited.add(key)
+            keys.append(key)
+            scores.append(score)
+            steps.append(n)
+            snapshots.append(pickle.dumps(env.clone_state()))
+        n += 1
+    return cell, actions[:n], keys, scores, steps, snapshots
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from panama_joe.utils import folders
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Export the policy of a saved model as a standalone TorchScript module for fast CPU inference.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    _, metrics = export_model(**kwargs)
+    if metrics['agreement'] < args.min_agreement:
+        sys.exit(1)
+
+
+def add_arguments(parser):
+    parser.add_argument('model_name',
+                        choices=('ppo',),
+                        help='Algorithm name.')
+    parser.add_argument('file_name',
+                        type=str,
+                        help='Saved model, relative to the models directory. The exported policy is saved next to it'
+                             ' with a `.pt` extension, which `evaluate` runs directly.')
+    parser.add_argument('--quantize',
+                        action='store_true',
+                        help='Flag to quantize linear layers to 8-bit integers (saved with an `_int8` suffix).')
+    parser.add_argument('--parity_steps',
+                        default=1000,
+                        type=int,
+                        help='Number of observations on which to compare the actions of the exported policy and of'
+                             ' the model, and to time them.')
+    parser.add_argument('--min_agreement',
+                        default=0.99,
+                        type=float,
+                        help='Least fraction of observations on which the exported policy must select the model\'s'
+                             ' action. The command fails otherwise.')
+    parser.add_argument('--seed',
+                        default=0,
+                        type=int,
+                        help='Seed of the random play generating observations.')
+
+
+def export_model(model_name, file_name, quantize=False, parity_steps=1000, min_agreement=0.99, seed=0):
+    """
+    Export the policy of a saved model (see `utils.export`), check that it selects the model's deterministic actions
+    on observations of random play, and compare their latency on single observations.
+
+    :return: Path to the exported policy, and the parity and latency metrics.
+    """
+    from panama_joe.utils.export import EXPORT_SUFFIX, ExportedPolicy, check_parity, export_policy
+
+    model_dir = folders.model_dir(model_name)
+    stem = os.path.splitext(file_name)[0]
+    path = os.path.join(model_dir, stem + ('_int8' if quantize else '') + EXPORT_SUFFIX)
+    model = export_policy(os.path.join(model_dir, file_name), path, quantize=quantize)
+    exported = ExportedPolicy(path)
+    print(f'Exported {path} ({os.path.getsize(path) / 2**10:.1f}KiB)')
+
+    observations = _observations(tuple(exported.meta['observation_shape']), model.observation_space, parity_steps,
+                                 np.random.default_rng(seed))
+    metrics = check_parity(model, exported, observations)
+    print(f'Parity: {metrics["agreement"]:.2%} of actions agree, largest logit error {metrics["max_logit_error"]:.2e}')
+    if metrics['agreement'] < min_agreement:
+        print(f'Agreement is below {min_agreement:.2%}')
+
+    latencies = {'model': np.zeros(min(len(observations), 1000)), 'exported': np.zeros(min(len(observations), 1000))}
+    model.predict(observations[0], deterministic=True)  # Warm up.
+    exported.predict(observations[0], deterministic=True)
+    for i in range(len(latencies['model'])):
+        # Alternated, so that noise affects both alike.
+        for name, policy in (('model', model), ('exported', exported)):
+            start = time.perf_counter()
+            policy.predict(observations[i], deterministic=True)
+            latencies[name][i] = time.perf_counter() - start
+    for name, latency in latencies.items():
+        metrics[f'{name}_p50_us'] = 1e6 * float(np.percentile(latency, 50))
+        metrics[f'{name}_p99_us'] = 1e6 * float(np.percentile(latency, 99))
+        print(f'Latency ({name}): {metrics[f"{name}_p50_us"]:.0f}us (p50) / {metrics[f"{name}_p99_us"]:.0f}us (p99)')
+    return path, metrics
+
+
+def _observations(obs_shape, observation_space, n, rng):
+    # Observations of random play, from the environment the model was trained on when its observations tell which.
+    from panama_joe.utils import montezuma, ram
+
+    env_kwargs = {
+        (128,): {'obs_type': 'ram'},
+        (ram.N_FEATURES,): {'obs_type': 'ram', 'ram_features': True},
+        (210, 160, 3): {'obs_type': 'rgb'},
+        (84, 84, 4): {'obs_type': 'rgb', 'preprocess': True, 'frameskip': 4}
+    }.get(obs_shape)
+    if env_kwargs is None:
+        observations = np.stack([observation_space.sample() for _ in range(n)])
+        # Images are sampled as the model sees them, channels first.
+        return observations if observations.shape[1:] == obs_shape else np.moveaxis(observations, 1, -1)
+    env = montezuma.make_env(render_mode=None, **env_kwargs)
+    obs, _ = env.reset(seed=int(rng.integers(2**31)))
+    observations = []
+    for a in rng.integers(0, env.action_space.n, size=n):
+        observations.append(np.array(obs))
+        obs, _, terminated, truncated, _ = env.step(int(a))
+        if terminated or truncated:
+            obs, _ = env.reset()
+    env.close()
+    return np.stack(observations)
+
+
+if __name__ == '__main__':
+    main()
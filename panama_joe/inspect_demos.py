@@ -0,0 +1,153 @@
+import argparse
+import os
+
+import numpy as np
+
+from panama_joe.utils import demo_catalog, demos, folders
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='List and inspect recorded demos.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    command = kwargs.pop('command')
+    if command == 'list':
+        list_demos(**kwargs)
+    elif command == 'index':
+        index_demos(**kwargs)
+    elif command == 'query':
+        query_demos(**kwargs)
+    else:
+        demo_info(**kwargs)
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    list_parser = subparsers.add_parser('list',
+                                        help='List demos with their format, length and size.')
+    list_parser.add_argument('--demo_type',
+                             type=str,
+                             help='Subdirectory of the demos directory. By default, all of them.')
+    info_parser = subparsers.add_parser('info',
+                                        help='Show the length, return, columns and checkpoints of a demo.')
+    info_parser.add_argument('file_name',
+                             type=str,
+                             help='Demo file, in any format.')
+    info_parser.add_argument('--demo_type',
+                             default='human',
+                             help='Subdirectory of the demos directory.')
+    index_parser = subparsers.add_parser('index',
+                                         help='Add the demos which are missing from the catalog of a demos directory.')
+    index_parser.add_argument('--demo_type',
+                              type=str,
+                              help='Subdirectory of the demos directory. By default, all of them.')
+    query_parser = subparsers.add_parser('query',
+                                         help='Select demos from the catalog, e.g., those reaching a room with a least'
+                                              ' score.')
+    query_parser.add_argument('--demo_type',
+                              type=str,
+                              help='Subdirectory of the demos directory. By default, all of them.')
+    query_parser.add_argument('--room',
+                              type=int,
+                              help='Room which the demos must visit.')
+    query_parser.add_argument('--min_score',
+                              type=float,
+                              help='Least game score: by the time the demos first enter --room, if given, or else in'
+                                   ' total.')
+    query_parser.add_argument('--min_length',
+                              type=int,
+                              help='Least number of steps.')
+    query_parser.add_argument('--max_length',
+                              type=int,
+                              help='Most number of steps.')
+    query_parser.add_argument('--obs_type',
+                              choices=('ram', 'rgb', 'grayscale'),
+                              help='Observation type the demos were recorded with.')
+    query_parser.add_argument('--demo_format',
+                              choices=tuple(demos.DEMO_FORMAT_SUFFIXES.keys()),
+                              help='Format of the demos.')
+    query_parser.add_argument('--paths',
+                              action='store_true',
+                              help='Only print the paths of the demos, e.g., to pass them to other commands.')
+
+
+def list_demos(demo_type=None):
+    """
+    Print one line per demo. The length of pickled demos is only known once they are loaded (see `demo_info`).
+    """
+    demo_types = folders.demo_types() if demo_type is None else [demo_type]
+    for demo_type_ in demo_types:
+        demo_dir = folders.demo_dir(demo_type_)
+        for file_name in demos.list_demos(demo_dir):
+            path = os.path.join(demo_dir, file_name)
+            demo_format = demos.demo_format(path)
+            length = '?' if demo_format == 'pickle' else f'{len(demos.ColumnarDemo(path)):d}'
+            print(f'{demo_type_}/{file_name}\t{demo_format}\t{length} steps\t{_format_size(demos.size_on_disk(path))}')
+
+
+def index_demos(demo_type=None):
+    """
+    Bring the catalogs up to date with the demos saved without them (e.g., by older versions) or since removed.
+    """
+    demo_types = folders.demo_types() if demo_type is None else [demo_type]
+    for demo_type_ in demo_types:
+        n_added, n_removed = demo_catalog.index_demos(folders.demo_dir(demo_type_), verbose=1)
+        print(f'{demo_type_}: {n_added:d} demos cataloged, {n_removed:d} removed')
+
+
+def query_demos(demo_type=None, paths=False, **kwargs):
+    """
+    Print one line per demo matching the query (see `demo_catalog.query`), best score first.
+    """
+    demo_types = folders.demo_types() if demo_type is None else [demo_type]
+    for demo_type_ in demo_types:
+        demo_dir = folders.demo_dir(demo_type_)
+        for row in demo_catalog.query(demo_dir, **kwargs):
+            if paths:
+                print(os.path.join(demo_dir, row['file_name']))
+                continue
+            print(f'{demo_type_}/{row["file_name"]}\t{row["format"]}\t{row["obs_type"]}\t{row["length"]:d} steps'
+                  f'\tscore {row["score"]:g}\t{row["lives_lost"]:d} lives lost'
+                  f'\trooms {",".join(str(room) for room in row["rooms"])}\t{_format_size(row["size_bytes"])}')
+
+
+def demo_info(file_name, demo_type='human'):
+    path = os.path.join(folders.demo_dir(demo_type), file_name)
+    if demos.is_columnar(path):
+        demo = demos.ColumnarDemo(path)
+        columns = {name: (str(column.dtype), column.shape) for name, column in demo.columns.items()}
+        rewards, lives = demo.rewards, demo.lives
+        checkpoints, _ = demo.load_checkpoints()
+        print(f'Format: {demos.demo_format(path)} (version {demo.meta["version"]:d})')
+        for name, value in demo.attributes.items():
+            print(f'{name.capitalize().replace("_", " ")}: {value}')
+    else:
+        dat = demos.read_legacy_demo(path)
+        columns = {name: (type(dat[name]).__name__, (len(dat[name]),))
+                   for name in ('actions', 'rewards', 'lives', 'obs')}
+        rewards, lives = dat['rewards'], dat['lives']
+        checkpoints = dat['checkpoints']
+        print('Format: pickle')
+    print(f'Steps: {columns["actions"][1][0]:d}')
+    print(f'Return: {float(np.sum(rewards, dtype=np.float64)):g}')
+    print(f'Lives lost: {int(np.maximum(0, -np.diff(np.asarray(lives, dtype=np.int64))).sum()):d}')
+    print(f'Checkpoints: {len(checkpoints):d}')
+    print(f'Size: {_format_size(demos.size_on_disk(path))}')
+    for name, (dtype, shape) in columns.items():
+        print(f'  {name}: {dtype} {shape}')
+
+
+def _format_size(n_bytes):
+    for unit in ('B', 'KiB', 'MiB'):
+        if n_bytes < 1024:
+            return f'{n_bytes:.0f}{unit}' if unit == 'B' else f'{n_bytes:.1f}{unit}'
+        n_bytes /= 1024
+    return f'{n_bytes:.1f}GiB'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import glob
+import json
+import os
+import time
+import zipfile
+
+from panama_joe.utils import folders
+
+# Files written by `model.save`, readable without Stable-Baselines3.
+_DATA_FILE = 'data'
+_VERSION_FILE = '_stable_baselines3_version'
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='List and inspect saved models and checkpoints.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    command = kwargs.pop('command')
+    if command == 'list':
+        list_models(**kwargs)
+    else:
+        model_info(**kwargs)
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    list_parser = subparsers.add_parser('list',
+                                        help='List saved models and checkpoints with their timesteps and size.')
+    list_parser.add_argument('--model_name',
+                             type=str,
+                             help='Subdirectory of the models directory. By default, all of them.')
+    info_parser = subparsers.add_parser('info',
+                                        help='Show the saved attributes of a model.')
+    info_parser.add_argument('model_name',
+                             type=str,
+                             help='Subdirectory of the models directory.')
+    info_parser.add_argument('file_name',
+                             type=str,
+                             help='Saved model, relative to its directory (e.g., `checkpoints/<run>_<steps>.zip`).')
+
+
+def list_models(model_name=None):
+    model_names = folders.model_names() if model_name is None else [model_name]
+    for model_name_ in model_names:
+        model_dir = folders.model_dir(model_name_)
+        paths = glob.glob(os.path.join(model_dir, '*.zip')) + glob.glob(os.path.join(model_dir, '*', '*.zip'))
+        for path in sorted(paths, key=os.path.getmtime):
+            data = read_model_data(path)
+            modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(os.path.getmtime(path)))
+            print(f'{model_name_}/{os.path.relpath(path, model_dir)}\t{data.get("num_timesteps", 0):d} timesteps'
+                  f'\t{os.path.getsize(path) / 2**20:.1f}MiB\t{modified}')
+
+
+def model_info(model_name, file_name):
+    path = os.path.join(folders.model_dir(model_name), file_name)
+    if not path.endswith('.zip'):
+        path += '.zip'
+    with zipfile.ZipFile(path) as archive:
+        print(f'Stable-Baselines3: {archive.read(_VERSION_FILE).decode().strip()}')
+        print(f'Files: {", ".join(archive.namelist())}')
+    for key, value in read_model_data(path).items():
+        if key.startswith('_'):
+            continue
+        if isinstance(value, dict) and ':type:' in value:
+            # Serialized objects are only described, not unpickled.
+            details = [f'{name}={value[name]}' for name in ('_shape', 'n') if name in value]
+            value = ' '.join([value[':type:']] + details)
+        print(f'{key}: {value}')
+
+
+def read_model_data(path):
+    """
+    :return: Attributes saved by `model.save`, with objects left serialized.
+    """
+    with zipfile.ZipFile(path) as archive:
+        return json.loads(archive.read(_DATA_FILE))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,64 @@
 import argparse
-import pickle
-from typing import Callable, Dict, List, Optional, Tuple, Union
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
 
-import gymnasium as gym
 import numpy as np
-import pygame
-from gymnasium import Env
-from gymnasium.core import ActType
-from gymnasium.utils import play
-from shimmy.atari_env import AtariEnv
 
-from panama_joe.utils import folders, montezuma
-from panama_joe.utils.wrappers import AtariDemo, DeathCostWrapper
+from panama_joe.utils import folders
+from panama_joe.utils.demos import DEMO_FORMAT_SUFFIXES
+
+if TYPE_CHECKING:
+    from gymnasium import Env
+    from gymnasium.core import ActType
 
 MEANING_SAVE = 'SAVE'
 MEANING_TIME_TRAVEL = 'TIMETRAVEL'
+# Keys are `pygame.key.name`s.
 KEY_TO_MEANING = {
     tuple(): 'NOOP',
-    (pygame.K_SPACE,): 'FIRE',
-    (pygame.K_UP,): 'UP',
-    (pygame.K_RIGHT,): 'RIGHT',
-    (pygame.K_LEFT,): 'LEFT',
-    (pygame.K_DOWN,): 'DOWN',
-    (pygame.K_UP, pygame.K_RIGHT): 'UPRIGHT',
-    (pygame.K_UP, pygame.K_LEFT): 'UPLEFT',
-    (pygame.K_DOWN, pygame.K_RIGHT): 'DOWNRIGHT',
-    (pygame.K_DOWN, pygame.K_LEFT): 'DOWNLEFT',
-    (pygame.K_UP, pygame.K_SPACE): 'UPFIRE',
-    (pygame.K_RIGHT, pygame.K_SPACE): 'RIGHTFIRE',
-    (pygame.K_LEFT, pygame.K_SPACE): 'LEFTFIRE',
-    (pygame.K_DOWN, pygame.K_SPACE): 'DOWNFIRE',
-    (pygame.K_UP, pygame.K_RIGHT, pygame.K_SPACE): 'UPRIGHTFIRE',
-    (pygame.K_UP, pygame.K_LEFT, pygame.K_SPACE): 'UPLEFTFIRE',
-    (pygame.K_DOWN, pygame.K_RIGHT, pygame.K_SPACE): 'DOWNRIGHTFIRE',
-    (pygame.K_DOWN, pygame.K_LEFT, pygame.K_SPACE): 'DOWNLEFTFIRE',
-    (pygame.K_s,): MEANING_SAVE,
-    (pygame.K_t,): MEANING_TIME_TRAVEL
+    ('space',): 'FIRE',
+    ('up',): 'UP',
+    ('right',): 'RIGHT',
+    ('left',): 'LEFT',
+    ('down',): 'DOWN',
+    ('up', 'right'): 'UPRIGHT',
+    ('up', 'left'): 'UPLEFT',
+    ('down', 'right'): 'DOWNRIGHT',
+    ('down', 'left'): 'DOWNLEFT',
+    ('up', 'space'): 'UPFIRE',
+    ('right', 'space'): 'RIGHTFIRE',
+    ('left', 'space'): 'LEFTFIRE',
+    ('down', 'space'): 'DOWNFIRE',
+    ('up', 'right', 'space'): 'UPRIGHTFIRE',
+    ('up', 'left', 'space'): 'UPLEFTFIRE',
+    ('down', 'right', 'space'): 'DOWNRIGHTFIRE',
+    ('down', 'left', 'space'): 'DOWNLEFTFIRE',
+    ('s',): MEANING_SAVE,
+    ('t',): MEANING_TIME_TRAVEL
 }
 
 
-def main():
+def main(argv=None, prog=None):
     parser = argparse.ArgumentParser(
+        prog=prog,
         description='Record demonstrations.'
     )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    record_demo(**kwargs)
+
+
+def add_arguments(parser):
     parser.add_argument('--fps',
                         default=30,
                         type=int,
-                        help='Frames per second.')
+                        help='Emulated frames per second (game speed).')
+    parser.add_argument('--display_fps',
+                        default=60,
+                        type=int,
+                        help='Displayed frames per second, independent of the game speed.')
     parser.add_argument('--zoom',
                         default=3.0,
                         type=float,
@@ -63,17 +75,25 @@ def main():
                         default=0.0,
                         type=float,
                         help='Stickiness.')
+    parser.add_argument('--demo_format',
+                        default='pickle',
+                        choices=tuple(DEMO_FORMAT_SUFFIXES.keys()),
+                        help='File format in which to save demos. Action-only demos (actions) leave out observations,'
+                             ' which are regenerated by replaying the actions.')
     parser.add_argument('--demo_file_name',
                         '-d',
                         type=str,
                         help='Load demo from file.')
 
-    args = parser.parse_args()
-    kwargs = dict(vars(args))
-    record_demo(**kwargs)
 
+def record_demo(fps=30, display_fps=60, zoom=3.0, obs_type='ram', frameskip=1, repeat_action_probability=0.0,
+                demo_format='pickle', demo_file_name=None):
+    import pygame
+    from shimmy.atari_env import AtariEnv
+
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.wrappers import AtariDemo
 
-def record_demo(fps=30, zoom=3.0, obs_type='ram', frameskip=1, repeat_action_probability=0.0, demo_file_name=None):
     pygame.init()
     pygame.display.set_caption(f'Recording demonstration for {montezuma.ENV_ID}')
 
@@ -87,29 +107,144 @@ def record_demo(fps=30, zoom=3.0, obs_type='ram', frameskip=1, repeat_action_pro
                              frameskip=frameskip,
                              repeat_action_probability=repeat_action_probability,
                              render_mode='rgb_array')  # The "real" environment.
-    env = AtariDemo(env, demos_dir=folders.demo_dir('human'))  # Enable saving, time traveling.
+    # Enable saving, time traveling. Demos are saved in the background, so that the game goes on meanwhile.
+    env = AtariDemo(env, demos_dir=folders.demo_dir('human'), demo_format=demo_format, save_in_background=True)
     atari_env = env.unwrapped
     assert isinstance(atari_env, AtariEnv)
     meanings = atari_env.get_action_meanings() + [MEANING_SAVE, MEANING_TIME_TRAVEL]
     meaning_to_index = {meaning: i for i, meaning in enumerate(meanings)}
-    key_to_index = {key: meaning_to_index[meaning] for key, meaning in KEY_TO_MEANING.items()}
-    play_game(env, fps=fps, zoom=zoom, callback=callback, keys_to_action=key_to_index, noop=meaning_to_index['NOOP'], demo_file_name=demo_file_name)
+    key_to_index = {tuple(pygame.key.key_code(name) for name in key): meaning_to_index[meaning]
+                    for key, meaning in KEY_TO_MEANING.items()}
+    return play_game(env, fps=fps, zoom=zoom, callback=callback, keys_to_action=key_to_index,
+                     noop=meaning_to_index['NOOP'], demo_file_name=demo_file_name, display_fps=display_fps)
+
+
+class EmulationLoop(threading.Thread):
+    """
+    Steps the environment at a steady `fps`, on its own thread, with the last action set by `set_input`, and renders
+    each frame into the back one of two buffers, which are then swapped. The display reads the front buffer with
+    `take_frame`, at its own rate, so that neither slow rendering nor slow steps (e.g., saving a demo) pace the other.
+    """
+
+    def __init__(self, env, fps, callback=None, seed=None, noop=0, demo_file_name=None):
+        super(EmulationLoop, self).__init__(name='emulation', daemon=True)
+        self.env = env
+        self.fps = fps
+        self.callback = callback
+        self.seed = seed
+        self.demo_file_name = demo_file_name
+        self.running = True
+        self.error = None
+        self.lock = threading.Lock()
+        self.input = (noop, None)  # Action, and when it was input.
+        self.front = self.back = None
+        self.frame_nr = 0  # Of the front buffer.
+        self.input_time = None  # Earliest input whose frame was not taken yet.
+        self.step_times = []
+        self.n_late = 0  # Ticks started more than a period late, after which the schedule is reset.
+
+    def set_input(self, action, input_time):
+        self.input = (action, input_time)
+
+    def take_frame(self, frame_nr, copy):
+        """
+        :param frame_nr: Number of the last frame taken.
+        :param copy: Called with the front buffer, when a frame was rendered since `frame_nr`, to copy it before the
+            buffers are swapped again.
+        :return: Number of the front buffer, and when the earliest input it is the first frame of was input (if any).
+        """
+        with self.lock:
+            if self.frame_nr == frame_nr:
+                return frame_nr, None
+            copy(self.front)
+            input_time, self.input_time = self.input_time, None
+            return self.frame_nr, input_time
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+    def run(self):
+        try:
+            self._run()
+        except BaseException as e:
+            self.error = e
+            self.running = False
+
+    def _run(self):
+        period = 1.0 / self.fps
+        done, obs, last_input_time = True, None, None
+        deadline = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+            elif now - deadline > period:
+                self.n_late += 1
+                deadline = now  # Resume at the steady rate instead of catching up with a burst of steps.
+            deadline += period
+
+            start = time.perf_counter()
+            action, input_time = self.input
+            if done:
+                done = False
+                if self.demo_file_name is not None:
+                    obs = self.env.load_from_file(self.demo_file_name)
+                else:
+                    obs = self.env.reset(seed=self.seed)
+            else:
+                prev_obs = obs
+                obs, rew, terminated, truncated, info = self.env.step(action)
+                done = terminated or truncated
+                if self.callback is not None:
+                    self.callback(prev_obs, obs, action, rew, terminated, truncated, info)
+            self._render()
+            with self.lock:
+                self.front, self.back = self.back, self.front
+                self.frame_nr += 1
+                if input_time != last_input_time and self.input_time is None:
+                    self.input_time = input_time
+            last_input_time = input_time
+            self.step_times.append(time.perf_counter() - start)
+
+    def _render(self):
+        ale = getattr(self.env.unwrapped, 'ale', None)
+        if ale is not None and self.back is not None:
+            ale.getScreenRGB(self.back)
+            return
+        rendered = self.env.render()
+        if isinstance(rendered, List):
+            rendered = rendered[-1]
+        assert rendered is not None and isinstance(rendered, np.ndarray)
+        if self.back is None or self.back.shape != rendered.shape:
+            self.back = np.empty_like(rendered)
+        np.copyto(self.back, rendered)
 
 
 def play_game(
-        env: Env,
+        env: 'Env',
         transpose: Optional[bool] = True,
         fps: Optional[int] = None,
         zoom: Optional[float] = None,
         callback: Optional[Callable] = None,
-        keys_to_action: Optional[Dict[Union[Tuple[Union[str, int]], str], ActType]] = None,
+        keys_to_action: Optional[Dict[Union[Tuple[Union[str, int]], str], 'ActType']] = None,
         seed: Optional[int] = None,
-        noop: ActType = 0,
-        demo_file_name: Optional[str] = None
+        noop: 'ActType' = 0,
+        demo_file_name: Optional[str] = None,
+        display_fps: int = 60
 ):
     """
-    Copied from `play.play()` except for usage of `demo_file_name` on reset.
+    Adapted from `play.play()`: the environment is stepped at `fps` by an `EmulationLoop` on another thread (reset or
+    loaded from `demo_file_name` when done), while this thread handles input and displays frames at `display_fps`.
+    Frames are blitted into cached surfaces instead of new ones.
+
+    :return: Latency from input to the display of its frame, time between displayed frames, and emulation step times
+        (all in milliseconds), also printed when the game is closed.
     """
+    import pygame
+    from gymnasium.utils import play
+    from gymnasium.utils.play import MissingKeysToAction
+
     env.reset(seed=seed)
 
     if keys_to_action is None:
@@ -137,39 +272,90 @@ def play_game(
     if fps is None:
         fps = env.metadata.get("render_fps", 30)
 
-    done, obs = True, None
+    loop = EmulationLoop(env, fps, callback=callback, seed=seed, noop=noop, demo_file_name=demo_file_name)
+    loop.start()
     clock = pygame.time.Clock()
+    frame_surface, frame_nr, input_time, action = None, 0, None, noop
+    latencies, frame_times, last_flip = [], [], None
 
-    while game.running:
-        if done:
-            done = False
-            if demo_file_name is not None:
-                obs = env.load_from_file(demo_file_name)
-            else:
-                obs = env.reset(seed=seed)
-        else:
-            action = key_code_to_action.get(tuple(sorted(game.pressed_keys)), noop)
-            prev_obs = obs
-            obs, rew, terminated, truncated, info = env.step(action)
-            done = terminated or truncated
-            if callback is not None:
-                callback(prev_obs, obs, action, rew, terminated, truncated, info)
-        if obs is not None:
-            rendered = env.render()
-            if isinstance(rendered, List):
-                rendered = rendered[-1]
-            assert rendered is not None and isinstance(rendered, np.ndarray)
-            play.display_arr(
-                game.screen, rendered, transpose=transpose, video_size=game.video_size
-            )
+    def copy_frame(frame):
+        nonlocal frame_surface
+        frame = frame.swapaxes(0, 1) if transpose else frame
+        if frame_surface is None or frame_surface.get_size() != frame.shape[:2]:
+            frame_surface = pygame.Surface(frame.shape[:2])
+        pygame.surfarray.blit_array(frame_surface, frame)
+
+    try:
+        while game.running and loop.running:
+            for event in pygame.event.get():
+                game.process_event(event)
+            new_action = key_code_to_action.get(tuple(sorted(game.pressed_keys)), noop)
+            if new_action != action:
+                action = new_action
+                loop.set_input(action, time.perf_counter())
+
+            last_frame_nr = frame_nr
+            frame_nr, frame_input_time = loop.take_frame(frame_nr, copy_frame)
+            if frame_nr != last_frame_nr:
+                pygame.transform.scale(frame_surface, game.video_size, game.screen)
+            if frame_input_time is not None:
+                input_time = frame_input_time
+            pygame.display.flip()
+
+            now = time.perf_counter()
+            if input_time is not None:
+                latencies.append(now - input_time)
+                input_time = None
+            if last_flip is not None:
+                frame_times.append(now - last_flip)
+            last_flip = now
+            clock.tick(display_fps)
+    finally:
+        loop.stop()
+        env.close()  # Waits for demos being saved.
+        pygame.quit()
+    if loop.error is not None:
+        raise loop.error
+
+    metrics = {
+        'latency': latency_stats(latencies),
+        'frame_time': latency_stats(frame_times),
+        'step_time': latency_stats(loop.step_times),
+        'n_late_steps': loop.n_late
+    }
+    _print_metrics(metrics, frame_times, 1.0 / display_fps)
+    return metrics
+
+
+# Edges of the frame time histogram, in display periods.
+FRAME_TIME_BINS = (0, 0.9, 1.1, 1.5, 2.5, 4, np.inf)
+
+
+def latency_stats(seconds):
+    """
+    :return: Number, mean and percentiles (50, 95, 99 and max) of durations, in milliseconds.
+    """
+    ms = 1e3 * np.asarray(seconds, dtype=np.float64)
+    if len(ms) == 0:
+        return {'n': 0}
+    stats = {'n': len(ms), 'mean': float(ms.mean())}
+    for q in (50, 95, 99, 100):
+        stats[f'p{q}' if q < 100 else 'max'] = float(np.percentile(ms, q))
+    return stats
 
-        # process pygame events
-        for event in pygame.event.get():
-            game.process_event(event)
 
-        pygame.display.flip()
-        clock.tick(fps)
-    pygame.quit()
+def _print_metrics(metrics, frame_times, period):
+    for name, label in (('latency', 'Input latency'), ('frame_time', 'Frame time'), ('step_time', 'Step time')):
+        stats = metrics[name]
+        if stats['n'] > 0:
+            print(f'{label}: {stats["p50"]:.1f}ms (p50) / {stats["p95"]:.1f}ms (p95) / {stats["p99"]:.1f}ms (p99)'
+                  f' / {stats["max"]:.1f}ms (max), over {stats["n"]:d}')
+    print(f'Late emulation steps: {metrics["n_late_steps"]:d}')
+    if len(frame_times) > 0:
+        counts, edges = np.histogram(np.asarray(frame_times) / period, bins=FRAME_TIME_BINS)
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            high_ms = f'{1e3 * high * period:.1f}ms' if np.isfinite(high) else 'inf'
+            print(f'  [{1e3 * low * period:.1f}ms, {high_ms}): {count:d} ({count / len(frame_times):.1%})')
 
 
 if __name__ == '__main__':
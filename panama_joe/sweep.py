@@ -0,0 +1,129 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import os
+import time
+import traceback
+
+from panama_joe.utils import folders, sweeps
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Run a grid or random search of baseline training runs across a pool of processes.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    sweep(**kwargs)
+
+
+def add_arguments(parser):
+    parser.add_argument('spec',
+                        type=str,
+                        help='JSON file describing the sweep (see `utils.sweeps`).')
+    parser.add_argument('--model_name',
+                        choices=('ppo',),
+                        default='ppo',
+                        help='Algorithm name.')
+    parser.add_argument('--sweep_name',
+                        type=str,
+                        help='Name of the sweep. Runs already in its index are skipped. By default, the name of the'
+                             ' spec file.')
+    parser.add_argument('--cpu_budget',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of cores to keep busy. Runs execute in parallel as long as their threads and'
+                             ' environment processes fit.')
+    parser.add_argument('--threads_per_run',
+                        default=1,
+                        type=int,
+                        help='Number of PyTorch (and OpenMP) threads of each run.')
+    parser.add_argument('--seed',
+                        default=0,
+                        type=int,
+                        help='Seed of the random search. Its runs are named after it, so another seed samples and runs'
+                             ' new configurations in the same sweep.')
+
+
+def sweep(spec, model_name='ppo', sweep_name=None, cpu_budget=1, threads_per_run=1, seed=0):
+    """
+    Run every configuration of a sweep spec which is not yet in the sweep's index, each in a process of a pool sized
+    to fit `cpu_budget`. Each run's output goes to its own log file in the sweep directory.
+
+    :return: Path to the index of the sweep.
+    """
+    with open(spec) as f:
+        spec_dict = json.load(f)
+    if sweep_name is None:
+        sweep_name = os.path.splitext(os.path.basename(spec))[0]
+    sweep_dir = folders.sweep_dir(sweep_name)
+    index_path = os.path.join(sweep_dir, sweeps.INDEX_FILE)
+    with open(os.path.join(sweep_dir, 'spec.json'), 'w') as f:
+        json.dump(spec_dict, f, indent=2)
+
+    runs = sweeps.sweep_runs(spec_dict, sweep_name, seed=seed)
+    done = {record['run_name'] for record in sweeps.read_index(index_path) if record['status'] == 'ok'}
+    todo = [run for run in runs if run['run_name'] not in done]
+    cores = sweeps.cores_per_run(spec_dict.get('train', {}), threads_per_run=threads_per_run)
+    n_workers = max(1, min(len(todo), cpu_budget // cores))
+    print(f'Sweep {sweep_name}: {len(todo):d} of {len(runs):d} runs to do, {n_workers:d} at a time'
+          f' ({cores:d} cores each)')
+
+    start = time.perf_counter()
+    n_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                                initargs=(threads_per_run,)) as executor:
+        futures = [executor.submit(_run, model_name, run, sweep_dir) for run in todo]
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            record = future.result()
+            sweeps.append_to_index(index_path, record)  # Only this process writes the index.
+            if record['status'] == 'ok':
+                status = f'ep_rew_mean={record["metrics"]["ep_rew_mean"]}'
+            else:
+                n_failed += 1
+                status = f'FAILED: {record["error"]} (see {record["log"]})'
+            print(f'[{i + 1:d}/{len(todo):d}] {record["run_name"]}: {status}')
+    print(f'{len(todo) - n_failed:d} runs done, {n_failed:d} failed in {time.perf_counter() - start:.1f}s')
+    print(f'Index: {index_path}')
+    return index_path
+
+
+def _init_worker(threads_per_run):
+    # Set before PyTorch is first imported, so its thread pools (and those of subprocesses) are sized accordingly.
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads_per_run)
+    import torch
+
+    torch.set_num_threads(threads_per_run)
+
+
+def _run(model_name, run, sweep_dir):
+    from panama_joe.train_baseline import train_baseline
+
+    log_path = os.path.join(sweep_dir, run['run_name'] + '.log')
+    record = {**run, 'status': 'ok', 'error': None, 'model_path': None, 'metrics': None, 'log': log_path,
+              'pid': os.getpid()}
+    start = time.time()
+    with open(log_path, 'w') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+        try:
+            train_kwargs = {'save_freq': 0, **run['train_kwargs']}
+            record['model_path'], record['metrics'] = train_baseline(model_name,
+                                                                     run_name=run['run_name'],
+                                                                     seed=run['seed'],
+                                                                     env_kwargs=run['env_kwargs'],
+                                                                     ppo_kwargs=run['ppo_kwargs'],
+                                                                     **train_kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            record['status'] = 'error'
+            record['error'] = repr(e)
+    record['started'] = start
+    record['finished'] = time.time()
+    return record
+
+
+if __name__ == '__main__':
+    main()
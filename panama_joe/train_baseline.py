@@ -1,16 +1,25 @@
 import argparse
+import functools
 import os
 import time
 
-from stable_baselines3.ppo import PPO
+import numpy as np
 
-from panama_joe.utils import folders, montezuma
+from panama_joe.utils import folders
 
 
-def main():
+def main(argv=None, prog=None):
     parser = argparse.ArgumentParser(
+        prog=prog,
         description='Train a baseline with which to compare our methods.'
     )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    train_baseline(**kwargs)
+
+
+def add_arguments(parser):
     parser.add_argument('model_name',
                         choices=('ppo',),
                         help='Algorithm name.')
@@ -23,28 +32,164 @@ def main():
                         choices=('rgb_array', 'rgb_array_list', 'human'),
                         default='rgb_array',
                         help='Render mode.')
+    parser.add_argument('--n_envs',
+                        '-n',
+                        default=1,
+                        type=int,
+                        help='Number of environments to step in parallel.')
+    parser.add_argument('--vec_env',
+                        # `montezuma.VEC_ENV_TYPES`, which is not imported here so that `--help` skips Gymnasium.
+                        choices=('dummy', 'subproc', 'async'),
+                        default='dummy',
+                        help='How to step parallel environments: in-process (dummy), in subprocesses (subproc), or in'
+                             ' subprocesses with shared memory (async).')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Flag to time each stage of training, to a CSV file and TensorBoard in the logs directory.')
+    parser.add_argument('--start_states',
+                        type=str,
+                        help='Name of a start state cache (see `build_start_states`) from which to start episodes,'
+                             ' moving back along the demos as the agent succeeds.')
+    parser.add_argument('--vec_shaping',
+                        action='store_true',
+                        help='Flag to apply reward shaping (the death cost) and RAM features to whole batches of'
+                             ' environments at once, instead of with a wrapper in each environment.')
+    parser.add_argument('--ram_features',
+                        action='store_true',
+                        help='Flag to observe the game state decoded from RAM (room, position, lives, level, inventory'
+                             ' and room objects) instead of the raw 128 bytes.')
+    parser.add_argument('--count_bonus',
+                        default=0.0,
+                        type=float,
+                        help='Scale of a count-based exploration bonus added to rewards (and to the logged returns),'
+                             ' `count_bonus / sqrt(visits)` of each state reached. Zero to disable.')
+    parser.add_argument('--count_keys',
+                        choices=('cells', 'simhash'),
+                        default='cells',
+                        help='How states are counted for the exploration bonus: by Go-Explore cell of the RAM (cells)'
+                             ' or by SimHash of the observations (simhash). Counts are shared by all environments.')
+    parser.add_argument('--save_freq',
+                        default=100000,
+                        type=int,
+                        help='Number of timesteps between checkpoints, which are written in the background. Zero to'
+                             ' disable.')
+    parser.add_argument('--keep_checkpoints',
+                        default=3,
+                        type=int,
+                        help='Number of most recent checkpoints to keep (at least 1).')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Flag to resume from the newest checkpoint, training until `total_timesteps` in all.')
     parser.add_argument('--seed',
                         type=int,
                         help='Seed to random number generator.')
-    args = parser.parse_args()
-    kwargs = dict(vars(args))
-    train_baseline(**kwargs)
 
 
-def train_baseline(model_name, total_timesteps=2048, render_mode='rgb_array', seed=None):
-    env = montezuma.make_env(render_mode=render_mode)
-    # env = montezuma.make_env(obs_type='rgb', render_mode=render_mode)
-    if model_name == 'ppo':
-        model = PPO('MlpPolicy', env, seed=seed)
-        # model = PPO('CnnPolicy', env, seed=seed)
-    else:
+def train_baseline(model_name, total_timesteps=2048, render_mode='rgb_array', n_envs=1, vec_env='dummy', profile=False,
+                   start_states=None, vec_shaping=False, ram_features=False, count_bonus=0.0,
+                   count_keys='cells', save_freq=100000, keep_checkpoints=3, resume=False, seed=None, run_name=None,
+                   env_kwargs=None, ppo_kwargs=None):
+    """
+    :param run_name: Name of the run, of its checkpoints and of the saved model. By default, the current timestamp.
+    :param env_kwargs: Passed to `make_env` (e.g., `obs_type`, `frameskip` or `death_cost`).
+    :param ppo_kwargs: Passed to `PPO` (e.g., `learning_rate` or `n_steps`).
+    :return: Path to the saved model, and metrics of the run: its timesteps, wall time, throughput, and the mean
+        return and length of its last (up to 100) episodes, `None` if none ended.
+    """
+    from stable_baselines3.common.logger import SummaryWriter
+    from stable_baselines3.common.vec_env import VecNormalize
+    from stable_baselines3.ppo import PPO
+
+    from panama_joe.utils import montezuma
+    from panama_joe.utils.checkpoints import VEC_NORMALIZE_SUFFIX, AsyncCheckpointCallback, latest_checkpoint
+    from panama_joe.utils.counts import CountTable
+    from panama_joe.utils.instrumentation import TimingCallback
+    from panama_joe.utils.lives_buffer import LivesBuffer
+    from panama_joe.utils.vec_wrappers import VecDeathCost, VecRamFeatures
+
+    stamp = int(time.time())
+    if run_name is None:
+        run_name = f'{stamp:d}'
+    env_kwargs = {'render_mode': render_mode, 'timing': profile, **(env_kwargs or {})}
+    if start_states is not None:
+        env_kwargs['start_states'] = folders.start_state_dir(start_states)
+    if count_bonus:
+        env_kwargs['count_bonus'] = count_bonus
+        env_kwargs['count_keys'] = count_keys
+    count_table = None
+    if env_kwargs.get('count_bonus') and env_kwargs.get('count_table') is None:
+        # In shared memory, for every environment's worker to update the same counts.
+        count_table = CountTable(shared=vec_env != 'dummy')
+        env_kwargs['count_table'] = count_table
+    vec_wrappers = []
+    lives_buffer = None
+    if vec_shaping:
+        # Written by each environment's worker, and read by `VecDeathCost` for all of them at once.
+        lives_buffer = LivesBuffer(n_envs, shared=vec_env != 'dummy')
+        vec_wrappers.append(functools.partial(VecDeathCost, death_cost=env_kwargs.get('death_cost', -10),
+                                              lives_buffer=lives_buffer))
+        env_kwargs['death_cost'] = 0
+        env_kwargs['lives_buffer'] = lives_buffer
+        if ram_features:
+            vec_wrappers.append(VecRamFeatures)
+    elif ram_features:
+        env_kwargs['ram_features'] = True
+    env = montezuma.make_vec_env(n_envs=n_envs, vec_env=vec_env, seed=seed, vec_wrappers=vec_wrappers, **env_kwargs)
+    tensorboard_log = None
+    callbacks = []
+    if profile:
+        log_dir = folders.log_dir(model_name)
+        if SummaryWriter is not None:  # TensorBoard is installed.
+            tensorboard_log = log_dir
+        callbacks.append(TimingCallback(os.path.join(log_dir, f'{stamp:d}_timing.csv'), verbose=1))
+    if model_name != 'ppo':
         raise ValueError(f'Unknown algorithm name: {model_name}')
+    checkpoint_path = None
+    if resume:
+        checkpoint_path, run_name = latest_checkpoint(folders.checkpoint_dir(model_name))
+        if checkpoint_path is None:
+            print('No checkpoint to resume from; starting a new run')
+            run_name = f'{stamp:d}'
+    if checkpoint_path is not None:
+        vec_normalize_path = checkpoint_path[:-len('.zip')] + VEC_NORMALIZE_SUFFIX
+        if os.path.exists(vec_normalize_path):
+            env = VecNormalize.load(vec_normalize_path, env)
+        model = PPO.load(checkpoint_path, env=env, tensorboard_log=tensorboard_log)
+        print(f'Resuming from {checkpoint_path} at {model.num_timesteps:d} timesteps')
+    else:
+        policy = 'CnnPolicy' if len(env.observation_space.shape) == 3 else 'MlpPolicy'  # Pixels or RAM.
+        model = PPO(policy, env, tensorboard_log=tensorboard_log, seed=seed, **(ppo_kwargs or {}))
+    if save_freq > 0:
+        callbacks.append(AsyncCheckpointCallback(folders.checkpoint_dir(model_name), run_name, save_freq=save_freq,
+                                                 keep=keep_checkpoints, verbose=1))
+
+    start = time.perf_counter()
+    start_timesteps = model.num_timesteps
+    model.learn(total_timesteps=max(0, total_timesteps - start_timesteps), callback=callbacks, log_interval=16,
+                tb_log_name=run_name, reset_num_timesteps=checkpoint_path is None)
+    elapsed = time.perf_counter() - start
+    env.close()
+    if count_table is not None:
+        print(f'Exploration bonus: {len(count_table):d} states visited')
+        count_table.close()
+    if lives_buffer is not None:
+        lives_buffer.close()
+    steps_per_sec = (model.num_timesteps - start_timesteps) / elapsed
+    print(f'Throughput ({n_envs:d} x {vec_env}): {steps_per_sec:.1f} steps/sec')
 
-    model.learn(total_timesteps=total_timesteps, log_interval=16)
     model_dir = folders.model_dir(model_name)
-    stamp = int(time.time())
-    path = os.path.join(model_dir, f'{stamp:d}')
+    path = os.path.join(model_dir, run_name)
     model.save(path)
+    episodes = list(model.ep_info_buffer)
+    metrics = {
+        'timesteps': model.num_timesteps,
+        'wall_time_s': elapsed,
+        'steps_per_sec': steps_per_sec,
+        'episodes': len(episodes),
+        'ep_rew_mean': float(np.mean([episode['r'] for episode in episodes])) if len(episodes) > 0 else None,
+        'ep_len_mean': float(np.mean([episode['l'] for episode in episodes])) if len(episodes) > 0 else None
+    }
+    return path + '.zip', metrics
 
 
 if __name__ == '__main__':
@@ -0,0 +1,317 @@
+"""
+Go-Explore cell archive.
+
+Each cell (see `ram.cell_keys`) keeps its best known score, the length and actions of the trajectory reaching it, how
+often it was seen and chosen, and, within a budget, an emulator snapshot from which exploration can resume. Cells are
+rows of flat arrays, found through an open-addressing hash table. Trajectories are stored as a tree of immutable action
+segments (one per exploration run), so cells reached from the same start share their prefix. Segments (and parts of
+segments) which no cell's trajectory uses any more are compacted away once the tree reaches its size limits; runs which
+would still exceed them are dropped.
+"""
+import os
+import pickle
+
+import numpy as np
+
+_EMPTY = -1
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_ARRAYS_FILE = 'archive.npz'
+_SNAPSHOTS_FILE = 'snapshots.pkl'
+
+
+class CellArchive:
+
+    def __init__(self, capacity=2**20, max_snapshots=20000, max_actions=2**26):
+        """
+        :param capacity: Maximum number of cells. Newly discovered cells are dropped once it is reached. Also the
+            maximum number of trajectory segments.
+        :param max_snapshots: Maximum number of emulator snapshots. Cells without one are restored by replaying their
+            trajectory.
+        :param max_actions: Maximum number of actions stored in trajectory segments (one byte each).
+        """
+        self.capacity = capacity
+        self.max_snapshots = max_snapshots
+        self.max_actions = max_actions
+        self.table_bits = int(np.ceil(np.log2(2 * capacity)))  # Load factor of at most one half.
+        self.table = np.full(2**self.table_bits, _EMPTY, dtype=np.int64)
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.scores = np.zeros(capacity, dtype=np.float64)
+        self.lengths = np.zeros(capacity, dtype=np.int64)
+        self.seen = np.zeros(capacity, dtype=np.uint32)
+        self.chosen = np.zeros(capacity, dtype=np.uint32)
+        self.cell_segments = np.full(capacity, _EMPTY, dtype=np.int64)
+        self.cell_prefixes = np.zeros(capacity, dtype=np.int64)
+        self.n = 0
+        self.n_dropped = 0
+        self.n_dropped_runs = 0  # Improving runs whose trajectories did not fit.
+        self.snapshots = {}
+        # Trajectory tree: segment `s` continues the first `segment_parent_prefixes[s]` actions of segment
+        # `segment_parents[s]` with `segment_lengths[s]` actions stored from `segment_starts[s]` in `actions`.
+        self.segment_parents = np.zeros(min(1024, capacity), dtype=np.int64)
+        self.segment_parent_prefixes = np.zeros(min(1024, capacity), dtype=np.int64)
+        self.segment_starts = np.zeros(min(1024, capacity), dtype=np.int64)
+        self.segment_lengths = np.zeros(min(1024, capacity), dtype=np.int64)
+        self.n_segments = 0
+        self.actions = np.zeros(min(65536, max_actions), dtype=np.uint8)
+        self.n_actions = 0
+
+    def __len__(self):
+        return self.n
+
+    def find(self, keys):
+        """
+        :param keys: Cell keys.
+        :return: Index of each cell, or -1 where it is not in the archive.
+        """
+        keys = np.atleast_1d(np.asarray(keys, dtype=np.uint64))
+        slots = self._hash(keys)
+        cells = self.table[slots]
+        pending = np.flatnonzero((cells != _EMPTY) & (self.keys[cells] != keys))
+        while len(pending) > 0:
+            slots[pending] = (slots[pending] + 1) & (len(self.table) - 1)
+            cells[pending] = self.table[slots[pending]]
+            pending = pending[(cells[pending] != _EMPTY) & (self.keys[cells[pending]] != keys[pending])]
+        return cells
+
+    def add_root(self, key, snapshot):
+        """
+        Add the starting cell, reached by the empty trajectory.
+        """
+        cell = self._insert(key)
+        self.seen[cell] += 1
+        self._store_snapshot(cell, snapshot)
+        return cell
+
+    def select(self, n, rng):
+        """
+        Choose `n` cells to explore from, favoring those which have been chosen and seen less often.
+        """
+        weights = 1 / np.sqrt(self.chosen[:self.n] + 1.0) + 1 / np.sqrt(self.seen[:self.n] + 1.0)
+        cells = rng.choice(self.n, size=n, p=weights / weights.sum())
+        np.add.at(self.chosen, cells, 1)
+        return cells
+
+    def task(self, cell):
+        """
+        :return: Where to start exploring from `cell`: its index, score and either its snapshot or its trajectory.
+        """
+        snapshot = self.snapshots.get(int(cell))
+        trajectory = self.trajectory(cell) if snapshot is None else None
+        return int(cell), float(self.scores[cell]), snapshot, trajectory
+
+    def update(self, start_cell, actions, keys, scores, steps, snapshots):
+        """
+        Merge the result of one exploration run.
+
+        :param start_cell: Cell from which the run started.
+        :param actions: Actions taken during the run.
+        :param keys: Distinct cells reached during the run.
+        :param scores: Score (including the start cell's) on first reaching each cell.
+        :param steps: Index into `actions` of the step first reaching each cell.
+        :param snapshots: Emulator snapshot on first reaching each cell.
+        :return: Number of cells which were discovered or improved.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        steps = np.asarray(steps, dtype=np.int64)
+        if len(keys) == 0:
+            return 0
+        cells = self.find(keys)
+        new = np.flatnonzero(cells == _EMPTY)
+        for i in new:
+            cells[i] = self._insert(keys[i])
+        lengths = self.lengths[start_cell] + steps + 1
+        scores = np.asarray(scores, dtype=np.float64)
+        known = cells != _EMPTY
+        improved = np.zeros(len(keys), dtype=bool)
+        improved[new] = True
+        improved[known] |= ((scores[known] > self.scores[cells[known]])
+                            | ((scores[known] == self.scores[cells[known]])
+                               & (lengths[known] < self.lengths[cells[known]])))
+        improved &= known
+        np.add.at(self.seen, cells[known], 1)
+        if not improved.any():
+            return 0
+
+        segment = self._add_segment(start_cell, actions)
+        if segment == _EMPTY:
+            self.n_dropped_runs += 1
+            return 0
+        for i in np.flatnonzero(improved):
+            cell = cells[i]
+            self.scores[cell] = scores[i]
+            self.lengths[cell] = lengths[i]
+            self.cell_segments[cell] = segment
+            self.cell_prefixes[cell] = steps[i] + 1
+            self._store_snapshot(cell, snapshots[i])
+        return int(improved.sum())
+
+    def trajectory(self, cell):
+        """
+        :return: Actions of the best known trajectory to `cell`.
+        """
+        parts = []
+        segment, prefix = self.cell_segments[cell], self.cell_prefixes[cell]
+        while segment != _EMPTY:
+            start = self.segment_starts[segment]
+            parts.append(self.actions[start:start + prefix])
+            segment, prefix = self.segment_parents[segment], self.segment_parent_prefixes[segment]
+        if len(parts) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.concatenate(parts[::-1])
+
+    def best_cell(self):
+        """
+        :return: Cell with the highest score, breaking ties by the shortest trajectory.
+        """
+        order = np.lexsort((self.lengths[:self.n], -self.scores[:self.n]))
+        return int(order[0])
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        tmp_file = os.path.join(path, 'tmp_' + _ARRAYS_FILE)
+        np.savez(tmp_file,
+                 capacity=self.capacity,
+                 max_snapshots=self.max_snapshots,
+                 max_actions=self.max_actions,
+                 n_dropped=self.n_dropped,
+                 n_dropped_runs=self.n_dropped_runs,
+                 keys=self.keys[:self.n],
+                 scores=self.scores[:self.n],
+                 lengths=self.lengths[:self.n],
+                 seen=self.seen[:self.n],
+                 chosen=self.chosen[:self.n],
+                 cell_segments=self.cell_segments[:self.n],
+                 cell_prefixes=self.cell_prefixes[:self.n],
+                 segment_parents=self.segment_parents[:self.n_segments],
+                 segment_parent_prefixes=self.segment_parent_prefixes[:self.n_segments],
+                 segment_starts=self.segment_starts[:self.n_segments],
+                 segment_lengths=self.segment_lengths[:self.n_segments],
+                 actions=self.actions[:self.n_actions])
+        with open(os.path.join(path, 'tmp_' + _SNAPSHOTS_FILE), 'wb') as f:
+            pickle.dump(self.snapshots, f)
+        os.replace(tmp_file, os.path.join(path, _ARRAYS_FILE))
+        os.replace(os.path.join(path, 'tmp_' + _SNAPSHOTS_FILE), os.path.join(path, _SNAPSHOTS_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(os.path.join(path, _ARRAYS_FILE)) as dat:
+            # Archives saved before the trajectory tree was bounded have no `max_actions`.
+            max_actions = int(dat['max_actions']) if 'max_actions' in dat else max(2**26, len(dat['actions']))
+            archive = cls(capacity=int(dat['capacity']), max_snapshots=int(dat['max_snapshots']),
+                          max_actions=max_actions)
+            archive.n_dropped = int(dat['n_dropped'])
+            archive.n_dropped_runs = int(dat['n_dropped_runs']) if 'n_dropped_runs' in dat else 0
+            n = len(dat['keys'])
+            for name in ('keys', 'scores', 'lengths', 'seen', 'chosen', 'cell_segments', 'cell_prefixes'):
+                getattr(archive, name)[:n] = dat[name]
+            archive.n = n
+            archive.n_segments = len(dat['segment_starts'])
+            for name in ('segment_parents', 'segment_parent_prefixes', 'segment_starts', 'segment_lengths'):
+                setattr(archive, name, _grown(dat[name], archive.n_segments))
+            archive.n_actions = len(dat['actions'])
+            archive.actions = _grown(dat['actions'], archive.n_actions)
+        archive.table[archive._free_slots(archive.keys[:n])] = np.arange(n)
+        with open(os.path.join(path, _SNAPSHOTS_FILE), 'rb') as f:
+            archive.snapshots = pickle.load(f)
+        return archive
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path, _ARRAYS_FILE))
+
+    def _hash(self, keys):
+        return ((keys * _HASH_MULTIPLIER) >> np.uint64(64 - self.table_bits)).astype(np.int64)
+
+    def _free_slots(self, keys):
+        # Slots for distinct keys which are not yet in the table, filled one probe at a time.
+        slots = self._hash(keys)
+        for i in range(len(slots)):
+            while self.table[slots[i]] != _EMPTY:
+                slots[i] = (slots[i] + 1) & (len(self.table) - 1)
+            self.table[slots[i]] = i  # Reserve; overwritten by the caller.
+        return slots
+
+    def _insert(self, key):
+        if self.n == self.capacity:
+            self.n_dropped += 1
+            return _EMPTY
+        cell = self.n
+        self.keys[cell] = key
+        self.table[self._free_slots(np.array([key], dtype=np.uint64))[0]] = cell
+        self.n += 1
+        return cell
+
+    def _add_segment(self, start_cell, actions):
+        """
+        :return: New segment continuing the trajectory of `start_cell` with `actions`, or -1 if it does not fit.
+        """
+        if (self.n_segments == self.capacity or self.n_actions + len(actions) > self.max_actions) \
+                and not self._compact(len(actions)):
+            return _EMPTY
+        if self.n_segments == len(self.segment_starts):
+            for name in ('segment_parents', 'segment_parent_prefixes', 'segment_starts', 'segment_lengths'):
+                setattr(self, name, _grown(getattr(self, name), min(2 * self.n_segments, self.capacity)))
+        if self.n_actions + len(actions) > len(self.actions):
+            self.actions = _grown(self.actions[:self.n_actions],
+                                  min(2 * (self.n_actions + len(actions)), self.max_actions))
+        segment = self.n_segments
+        self.segment_parents[segment] = self.cell_segments[start_cell]
+        self.segment_parent_prefixes[segment] = self.cell_prefixes[start_cell]
+        self.segment_starts[segment] = self.n_actions
+        self.segment_lengths[segment] = len(actions)
+        self.actions[self.n_actions:self.n_actions + len(actions)] = actions
+        self.n_actions += len(actions)
+        self.n_segments += 1
+        return segment
+
+    def _compact(self, n_new_actions):
+        """
+        Drop the segments which no cell's trajectory goes through, and the actions at the end of segments which no
+        trajectory reaches, keeping segments in order (parents before their children).
+
+        :return: Whether a segment of `n_new_actions` actions then fits.
+        """
+        n_segments = self.n_segments
+        # Number of actions of each segment which trajectories use, propagated from children to parents.
+        used = np.zeros(n_segments, dtype=np.int64)
+        cells = np.flatnonzero(self.cell_segments[:self.n] != _EMPTY)
+        np.maximum.at(used, self.cell_segments[cells], self.cell_prefixes[cells])
+        parents = self.segment_parents[:n_segments]
+        parent_prefixes = self.segment_parent_prefixes[:n_segments]
+        for segment in range(n_segments - 1, -1, -1):  # Children come after their parents.
+            parent = parents[segment]
+            if used[segment] > 0 and parent != _EMPTY and parent_prefixes[segment] > used[parent]:
+                used[parent] = parent_prefixes[segment]
+        kept = np.flatnonzero(used > 0)
+        new_index = np.full(n_segments, _EMPTY, dtype=np.int64)
+        new_index[kept] = np.arange(len(kept))
+        lengths = used[kept]
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        actions = np.zeros(len(self.actions), dtype=np.uint8)
+        for start, old_start, length in zip(starts, self.segment_starts[kept], lengths):
+            actions[start:start + length] = self.actions[old_start:old_start + length]
+        kept_parents = parents[kept]
+        self.segment_parents[:len(kept)] = np.where(kept_parents == _EMPTY, _EMPTY, new_index[kept_parents])
+        self.segment_parent_prefixes[:len(kept)] = parent_prefixes[kept]
+        self.segment_starts[:len(kept)] = starts
+        self.segment_lengths[:len(kept)] = lengths
+        self.n_segments = len(kept)
+        self.actions = actions
+        self.n_actions = int(lengths.sum())
+        self.cell_segments[cells] = new_index[self.cell_segments[cells]]
+        return self.n_segments < self.capacity and self.n_actions + n_new_actions <= self.max_actions
+
+    def _store_snapshot(self, cell, snapshot):
+        if snapshot is None:
+            return
+        if int(cell) not in self.snapshots and len(self.snapshots) >= self.max_snapshots:
+            # Evict the snapshot of the most frequently seen cell, which is the cheapest to find again.
+            cells = np.fromiter(self.snapshots.keys(), dtype=np.int64, count=len(self.snapshots))
+            del self.snapshots[int(cells[np.argmax(self.seen[cells])])]
+        self.snapshots[int(cell)] = snapshot
+
+
+def _grown(values, size):
+    grown = np.zeros(max(size, len(values), 1), dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
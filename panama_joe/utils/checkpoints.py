@@ -0,0 +1,161 @@
+"""
+Periodic checkpoints of a model during `learn`, written in the background.
+
+Checkpoints are `<run>_<timesteps>.zip` files (as written by `model.save`, so they load with `PPO.load`), with a
+`<run>_<timesteps>_vecnormalize.pkl` alongside when the environment is normalized.
+"""
+import copy
+import glob
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import save_to_zip_file
+
+VEC_NORMALIZE_SUFFIX = '_vecnormalize.pkl'
+# Rollout state tied to the running environments, which are reset on resuming.
+_EXCLUDED_PARAMS = ('_last_obs', '_last_episode_starts', '_last_original_obs')
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """
+    Every `save_freq` timesteps, at the start of a rollout (when the previous update is complete), copies the model's
+    parameters, optimizer state, step counter and other saved attributes, and hands the copy to a background thread,
+    which serializes and writes it. A last checkpoint is written when training ends, so that resuming starts from
+    where it stopped. Only the newest `keep` checkpoints of the run are kept.
+    """
+
+    def __init__(self, checkpoint_dir, run_name, save_freq=100000, keep=3, verbose=0):
+        """
+        :param checkpoint_dir: Directory in which to write checkpoints.
+        :param run_name: Prefix of the checkpoints' file names.
+        :param save_freq: Minimum number of timesteps between checkpoints.
+        :param keep: Number of checkpoints to keep, at least 1.
+        """
+        if keep < 1:
+            raise ValueError(f'At least one checkpoint must be kept, not {keep:d}')
+        super(AsyncCheckpointCallback, self).__init__(verbose=verbose)
+        self.checkpoint_dir = checkpoint_dir
+        self.run_name = run_name
+        self.save_freq = save_freq
+        self.keep = keep
+        self.last_save = None
+        self.executor = None
+        self.pending = None
+
+    def _on_training_start(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.last_save = self.num_timesteps
+
+    def _on_rollout_start(self):
+        if self.num_timesteps - self.last_save >= self.save_freq:
+            self.checkpoint()
+
+    def _on_step(self):
+        return True
+
+    def _on_training_end(self):
+        if self.num_timesteps > self.last_save:
+            self.checkpoint()
+        self.wait()
+        self.executor.shutdown()
+
+    def checkpoint(self):
+        """
+        Copy the model's state and start writing it in the background.
+
+        :return: Path of the checkpoint.
+        """
+        # Only one checkpoint is written at a time, which bounds the memory held by copies.
+        self.wait()
+        data, params, pytorch_variables = snapshot_model(self.model)
+        vec_normalize = self.model.get_vec_normalize_env()
+        vec_normalize = None if vec_normalize is None else pickle.dumps(vec_normalize)
+        path = os.path.join(self.checkpoint_dir, f'{self.run_name}_{self.num_timesteps:d}.zip')
+        self.pending = self.executor.submit(self._write, path, data, params, pytorch_variables, vec_normalize)
+        self.last_save = self.num_timesteps
+        return path
+
+    def wait(self):
+        """
+        Wait for the checkpoint being written, if any, and raise its error, if any.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def _write(self, path, data, params, pytorch_variables, vec_normalize):
+        if vec_normalize is not None:
+            vec_normalize_path = path[:-len('.zip')] + VEC_NORMALIZE_SUFFIX
+            with open(vec_normalize_path + '.tmp', 'wb') as f:
+                f.write(vec_normalize)
+            os.replace(vec_normalize_path + '.tmp', vec_normalize_path)
+        with open(path + '.tmp', 'wb') as f:
+            save_to_zip_file(f, data=data, params=params, pytorch_variables=pytorch_variables)
+        os.replace(path + '.tmp', path)  # Complete checkpoints only, even if the process dies while writing.
+        for old_path in list_checkpoints(self.checkpoint_dir, self.run_name)[:-self.keep]:
+            os.remove(old_path)
+            if os.path.exists(old_path[:-len('.zip')] + VEC_NORMALIZE_SUFFIX):
+                os.remove(old_path[:-len('.zip')] + VEC_NORMALIZE_SUFFIX)
+        if self.verbose > 0:
+            print(f'Checkpoint: {path}')
+
+
+def snapshot_model(model):
+    """
+    Copy what `model.save` would write, so that it can be written while training continues.
+
+    :return: Saved attributes, state dicts (on the CPU) and other PyTorch variables of `model`.
+    """
+    exclude = set(model._excluded_save_params()).union(_EXCLUDED_PARAMS)
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for name in state_dicts_names + torch_variable_names:
+        exclude.add(name.split('.')[0])
+    data = copy.deepcopy({key: value for key, value in model.__dict__.items() if key not in exclude})
+    params = {name: _copy_to_cpu(state_dict) for name, state_dict in model.get_parameters().items()}
+    pytorch_variables = {}
+    for name in torch_variable_names:
+        obj = model
+        for attr in name.split('.'):
+            obj = getattr(obj, attr)
+        pytorch_variables[name] = obj.detach().clone()
+    return data, params, pytorch_variables
+
+
+def list_checkpoints(checkpoint_dir, run_name=None):
+    """
+    :return: Paths of the checkpoints of run `run_name` (or of every run), oldest first.
+    """
+    pattern = '*.zip' if run_name is None else f'{glob.escape(run_name)}_*.zip'
+    checkpoints = []
+    for path in glob.glob(os.path.join(checkpoint_dir, pattern)):
+        # Other runs' names may start with this one's (e.g., `x_1` with `x`), and other files may end in `.zip`.
+        name, _, timesteps = os.path.basename(path)[:-len('.zip')].rpartition('_')
+        if timesteps.isdecimal() and (run_name is None or name == run_name):
+            checkpoints.append(path)
+    if run_name is not None:
+        return sorted(checkpoints, key=lambda path: int(path[:-len('.zip')].rsplit('_', 1)[1]))
+    return sorted(checkpoints, key=os.path.getmtime)
+
+
+def latest_checkpoint(checkpoint_dir):
+    """
+    :return: Path of the newest checkpoint, and its run's name, or `(None, None)` if there are none.
+    """
+    paths = list_checkpoints(checkpoint_dir)
+    if len(paths) == 0:
+        return None, None
+    return paths[-1], os.path.basename(paths[-1]).rsplit('_', 1)[0]
+
+
+def _copy_to_cpu(value):
+    # Copies tensors (including an optimizer's nested state), so that later updates do not change the checkpoint.
+    if isinstance(value, torch.Tensor):
+        return value.detach().to('cpu', copy=True)
+    if isinstance(value, dict):
+        return {key: _copy_to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy_to_cpu(item) for item in value)
+    return copy.deepcopy(value)
@@ -0,0 +1,155 @@
+"""
+Visit counts of discretized states, for count-based exploration bonuses.
+
+`CountTable` is an open-addressing hash table of 64-bit state keys with a fixed number of slots, optionally in shared
+memory so that environments stepped in other processes update the same counts. Keys come from `ram.cell_key` (the
+Go-Explore cell of the emulator's RAM) or from a `SimHash` of observations.
+
+Updates are not locked: when two processes update the same slot at once, an increment may be lost, or two keys may
+share a slot. Both only perturb the bonus slightly, and a lock would cost more than the update itself.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK64 = 2**64 - 1
+_MAX_COUNT = 2**32 - 1
+
+
+class CountTable:
+
+    def __init__(self, table_bits=20, max_probes=16, shared=False):
+        """
+        :param table_bits: Base 2 logarithm of the number of slots. Each slot takes 12 bytes.
+        :param max_probes: Most slots probed for a key. Once they are all taken by other keys, the key is counted with
+            the key in its first slot.
+        :param shared: Whether the table is in shared memory. Copies pickled to other processes (e.g., with environment
+            arguments) then update the same counts, until the table is closed by the process which created it.
+        """
+        self.table_bits = table_bits
+        self.max_probes = max_probes
+        self.n_overflows = 0  # In this process.
+        size = 2**table_bits
+        self.shm = shared_memory.SharedMemory(create=True, size=12 * size) if shared else None
+        self._owner = shared
+        self._attach(bytearray(12 * size) if self.shm is None else self.shm.buf)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('keys', 'counts', '_keys', '_counts'):
+            del state[name]
+        state['_owner'] = False
+        if self.shm is None:
+            state['buffer'] = bytes(self._buffer)
+        del state['_buffer']
+        return state
+
+    def __setstate__(self, state):
+        buffer = state.pop('buffer', None)
+        self.__dict__.update(state)
+        self._attach(bytearray(buffer) if self.shm is None else self.shm.buf)
+
+    def _attach(self, buffer):
+        size = 2**self.table_bits
+        self._buffer = buffer
+        self.keys = np.frombuffer(buffer, dtype=np.uint64, count=size)
+        self.counts = np.frombuffer(buffer, dtype=np.uint32, count=size, offset=8 * size)
+        # Memoryviews are read and written with plain integers, much faster than numpy scalars one at a time.
+        self._keys = memoryview(buffer)[:8 * size].cast('Q')
+        self._counts = memoryview(buffer)[8 * size:].cast('I')
+
+    def __len__(self):
+        """
+        :return: Number of distinct keys counted.
+        """
+        return int(np.count_nonzero(self.counts))
+
+    def increment(self, key):
+        """
+        :param key: State key, an integer in [0, 2**64).
+        :return: Number of visits of the state, including this one.
+        """
+        mask = (1 << self.table_bits) - 1
+        home = slot = ((key * _HASH_MULTIPLIER) & _MASK64) >> (64 - self.table_bits)
+        keys, counts = self._keys, self._counts
+        for _ in range(self.max_probes):
+            count = counts[slot]
+            if count == 0:  # Free slot.
+                keys[slot] = key
+                counts[slot] = 1
+                return 1
+            if keys[slot] == key:
+                break
+            slot = (slot + 1) & mask
+        else:
+            self.n_overflows += 1
+            slot = home
+            count = counts[slot]
+        count = min(count + 1, _MAX_COUNT)
+        counts[slot] = count
+        return count
+
+    def count(self, key):
+        """
+        :return: Number of visits of the state with `key` so far.
+        """
+        mask = (1 << self.table_bits) - 1
+        home = slot = ((key * _HASH_MULTIPLIER) & _MASK64) >> (64 - self.table_bits)
+        for _ in range(self.max_probes):
+            if self._counts[slot] == 0:
+                return 0
+            if self._keys[slot] == key:
+                return self._counts[slot]
+            slot = (slot + 1) & mask
+        return self._counts[home]
+
+    def close(self):
+        """
+        Release the shared memory; the process which created the table also frees it.
+        """
+        if self.shm is None:
+            return
+        self._keys.release()
+        self._counts.release()
+        self.keys = self.counts = self._keys = self._counts = self._buffer = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+class SimHash:
+    """
+    Locality-sensitive hash of observations (Charikar's SimHash, as in Tang et al., 2017): the signs of `n_bits` random
+    projections of the observation, downsampled to at most `max_inputs` values. Observations which are close map to
+    keys which differ in few bits, and identical keys when close enough.
+    """
+
+    def __init__(self, obs_shape, n_bits=64, max_inputs=256, seed=0):
+        """
+        :param obs_shape: Shape of the observations. Images, of shape `(height, width, channels)`, are downsampled by
+            taking pixels on a regular grid; other observations by taking evenly spaced values.
+        :param seed: Seed of the projections. Processes hashing with the same seed agree on keys.
+        """
+        if n_bits > 64:
+            raise ValueError(f'Keys have at most 64 bits, not {n_bits:d}')
+        indices = np.arange(int(np.prod(obs_shape))).reshape(obs_shape)
+        if len(obs_shape) == 3:
+            stride = int(np.ceil(np.sqrt(np.prod(obs_shape) / max_inputs)))
+            indices = indices[::stride, ::stride]
+        indices = indices.reshape(-1)[::int(np.ceil(indices.size / max_inputs))]
+        # Indexed by position on each axis, as observations may be views which are not contiguous (frame stacks).
+        self.index = np.unravel_index(indices, obs_shape)
+        rng = np.random.default_rng(seed)
+        projections = rng.standard_normal((n_bits, len(indices)))
+        # Rows summing to zero ignore the mean of the values (e.g., the brightness of a frame), without computing it.
+        self.projections = projections - projections.mean(axis=1, keepdims=True)
+        self.weights = np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64))
+
+    def __call__(self, obs):
+        """
+        :return: Key of an observation, an integer in [0, 2**n_bits).
+        """
+        # Projected as float64, which casts integer observations on the fly, faster than float32 after a cast.
+        return int(self.weights @ (self.projections @ np.asarray(obs)[self.index] > 0))
@@ -0,0 +1,200 @@
+"""
+SQLite catalog of the demos in a demos directory, to select demos without loading them.
+
+The catalog (`CATALOG_FILE`, in the demos directory) has one row per demo in `demos` (its format, length, return,
+game score, lives lost, checkpoints, observation type, frameskip and size) and one row per room a demo visits in
+`demo_rooms` (the step at which it first entered the room, and its game score by then). `AtariDemo.save_to_file`
+updates it; `index_demos` adds the demos saved without it.
+"""
+import os
+import sqlite3
+
+import numpy as np
+
+from panama_joe.utils import demos, ram
+
+CATALOG_FILE = 'catalog.sqlite'
+DEMO_FIELDS = ('file_name', 'format', 'length', 'total_reward', 'score', 'lives_lost', 'checkpoints', 'obs_type',
+               'frameskip', 'size_bytes', 'modified')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS demos (
+    file_name TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    total_reward REAL NOT NULL,
+    score REAL NOT NULL,
+    lives_lost INTEGER NOT NULL,
+    checkpoints INTEGER NOT NULL,
+    obs_type TEXT,
+    frameskip INTEGER,
+    size_bytes INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS demo_rooms (
+    file_name TEXT NOT NULL REFERENCES demos (file_name) ON DELETE CASCADE,
+    room INTEGER NOT NULL,
+    first_step INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (file_name, room)
+);
+CREATE INDEX IF NOT EXISTS demo_rooms_room ON demo_rooms (room, score);
+"""
+
+
+def connect(demo_dir):
+    """
+    :return: Connection to the catalog of `demo_dir`, created if needed. Rows are `sqlite3.Row`s.
+    """
+    connection = sqlite3.connect(os.path.join(demo_dir, CATALOG_FILE))
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def demo_record(path, actions, rewards, lives, rooms, n_checkpoints, obs_type=None, frameskip=None):
+    """
+    Summarize a demo for the catalog.
+
+    :param path: Demo, already saved.
+    :param actions: Actions taken.
+    :param rewards: Rewards received (with the death cost).
+    :param lives: Lives before each step.
+    :param rooms: Room after each step.
+    :param n_checkpoints: Number of emulator checkpoints.
+    :return: Row of `demos` (a dictionary keyed by `DEMO_FIELDS`), and the `(room, first step, score)` of each room
+        visited.
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    scores = np.cumsum(np.maximum(rewards, 0))  # Game score only, as the death cost is included in the rewards.
+    rooms = np.asarray(rooms, dtype=np.int64)
+    visited, first_steps = np.unique(rooms, return_index=True)
+    record = {
+        'file_name': os.path.basename(path),
+        'format': demos.demo_format(path),
+        'length': len(actions),
+        'total_reward': float(rewards.sum()),
+        'score': float(scores[-1]) if len(scores) > 0 else 0.0,
+        'lives_lost': int(np.maximum(0, -np.diff(np.asarray(lives, dtype=np.int64))).sum()),
+        'checkpoints': n_checkpoints,
+        'obs_type': obs_type,
+        'frameskip': frameskip,
+        'size_bytes': demos.size_on_disk(path),
+        'modified': os.path.getmtime(path)
+    }
+    room_rows = [(int(room), int(step), float(scores[step])) for room, step in zip(visited, first_steps)]
+    return record, room_rows
+
+
+def read_rooms(path, dat=None, checkpoints=None):
+    """
+    :param dat: Demo at `path` (from `demos.read_demo`), if already read.
+    :param checkpoints: Checkpoints of the demo and the number of actions taken at each, if already read.
+    :return: Room after each action of a demo, read from its RAM observations or else by replaying it.
+    """
+    from panama_joe.utils.demo_replay import replay_actions_ram  # Imports the emulator.
+
+    if dat is None:
+        dat = demos.read_demo(path)
+    obs = dat['obs']
+    if demos.demo_format(path) != 'actions' and obs.shape[1:] == (128,):
+        return np.asarray(obs[1:len(dat['actions']) + 1])[:, ram.ROOM]
+    if checkpoints is None:
+        checkpoints = demos.read_checkpoints(path)
+    return replay_actions_ram(dat['actions'], *checkpoints, frameskip=dat['frameskip'])[:, ram.ROOM]
+
+
+def read_demo_record(path):
+    """
+    Summarize a demo from its file, for the catalog (see `demo_record`).
+    """
+    dat = demos.read_demo(path)
+    obs = dat['obs']
+    obs_type = getattr(obs, 'obs_type', None) or ('ram' if obs.shape[1:] == (128,) else 'rgb')
+    checkpoints = demos.read_checkpoints(path)
+    return demo_record(path, dat['actions'], dat['rewards'], dat['lives'],
+                       read_rooms(path, dat=dat, checkpoints=checkpoints), len(checkpoints[0]), obs_type=obs_type,
+                       frameskip=dat['frameskip'])
+
+
+def update(demo_dir, record, room_rows):
+    """
+    Add or replace a demo in the catalog of `demo_dir`.
+
+    :param record: Row of `demos`, from `demo_record`.
+    :param room_rows: Rooms visited, from `demo_record`.
+    """
+    connection = connect(demo_dir)
+    try:
+        with connection:
+            connection.execute('DELETE FROM demos WHERE file_name = ?', (record['file_name'],))
+            connection.execute(f'INSERT INTO demos ({", ".join(DEMO_FIELDS)})'
+                               f' VALUES ({", ".join("?" * len(DEMO_FIELDS))})',
+                               [record[field] for field in DEMO_FIELDS])
+            connection.executemany('INSERT INTO demo_rooms (file_name, room, first_step, score) VALUES (?, ?, ?, ?)',
+                                   [(record['file_name'], *row) for row in room_rows])
+    finally:
+        connection.close()
+
+
+def index_demos(demo_dir, verbose=0):
+    """
+    Bring the catalog of `demo_dir` up to date: add the demos which are missing or were modified since they were
+    cataloged, and remove those which no longer exist.
+
+    :return: Numbers of demos added (or updated) and removed.
+    """
+    connection = connect(demo_dir)
+    try:
+        cataloged = {row['file_name']: row['modified']
+                     for row in connection.execute('SELECT file_name, modified FROM demos')}
+        file_names = demos.list_demos(demo_dir)
+        removed = [(file_name,) for file_name in cataloged.keys() if file_name not in set(file_names)]
+        with connection:
+            connection.executemany('DELETE FROM demos WHERE file_name = ?', removed)
+    finally:
+        connection.close()
+    n_added = 0
+    for file_name in file_names:
+        path = os.path.join(demo_dir, file_name)
+        if cataloged.get(file_name) == os.path.getmtime(path):
+            continue
+        update(demo_dir, *read_demo_record(path))
+        n_added += 1
+        if verbose > 0:
+            print(f'Cataloged {file_name}')
+    return n_added, len(removed)
+
+
+def query(demo_dir, room=None, min_score=None, min_length=None, max_length=None, obs_type=None, demo_format=None):
+    """
+    Select demos from the catalog of `demo_dir`, e.g., those reaching room 1 with a game score of at least 400 by then.
+
+    :param room: Room which the demos must visit.
+    :param min_score: Least game score: by the time the demos first enter `room`, if given, or else in total.
+    :return: Rows of `demos` (dictionaries keyed by `DEMO_FIELDS`), plus the demos' `rooms`, best score first.
+    """
+    conditions, params = [], []
+    if room is not None:
+        conditions.append('file_name IN (SELECT file_name FROM demo_rooms WHERE room = ? AND score >= ?)')
+        params += [room, -np.inf if min_score is None else min_score]
+    elif min_score is not None:
+        conditions.append('score >= ?')
+        params.append(min_score)
+    for condition, value in (('length >= ?', min_length), ('length <= ?', max_length), ('obs_type = ?', obs_type),
+                             ('format = ?', demo_format)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    where = f' WHERE {" AND ".join(conditions)}' if len(conditions) > 0 else ''
+    connection = connect(demo_dir)
+    try:
+        rows = [dict(row) for row in connection.execute(f'SELECT * FROM demos{where} ORDER BY score DESC, file_name',
+                                                        params)]
+        for row in rows:
+            row['rooms'] = [room_row['room'] for room_row in connection.execute(
+                'SELECT room FROM demo_rooms WHERE file_name = ? ORDER BY first_step', (row['file_name'],))]
+    finally:
+        connection.close()
+    return rows
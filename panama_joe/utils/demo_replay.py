@@ -0,0 +1,331 @@
+"""
+Replaying recorded demos on the emulator: regenerating the observations of action-only demos, and checking that
+demos replay deterministically.
+
+Each action of a demo is `frameskip` calls to `ale.act` (one for action-only demos, and for demos saved before their
+frameskip was), and without sticky actions the emulator is deterministic, so the actions taken from a checkpoint always
+lead to the same observations.
+"""
+import collections
+import time
+
+import numpy as np
+
+from panama_joe.utils import demos
+
+
+def make_replay_env(obs_type='ram'):
+    """
+    :return: Unwrapped `AtariEnv` on which to replay demos recorded with observations of type `obs_type`.
+    """
+    import gymnasium as gym
+
+    from panama_joe.utils import montezuma
+
+    env = gym.make(montezuma.ENV_ID, obs_type=obs_type, frameskip=1, repeat_action_probability=0.0, render_mode=None)
+    return env.unwrapped
+
+
+class DemoObservations:
+    """
+    Observations of an action-only demo, indexed like an array (by an integer, a slice or an array of integers) and
+    regenerated on demand. Observation `i` (after `i` actions) is read from the segment of observations between the
+    checkpoints around it, which is regenerated by restoring the checkpoint before it and replaying the actions up to
+    the next one. The `cache_segments` most recently used segments are kept.
+    """
+
+    def __init__(self, demo, atari_env=None, cache_segments=32):
+        """
+        :param demo: Action-only `ColumnarDemo`.
+        :param atari_env: Environment on which to replay the demo, whose state is overwritten. By default, one is
+            created when an observation is first regenerated.
+        """
+        self.actions = np.asarray(demo.actions, dtype=np.int64)
+        self.checkpoints, checkpoint_action_nr = demo.load_checkpoints()
+        self.starts = np.asarray(checkpoint_action_nr, dtype=np.int64)
+        self.ends = np.append(self.starts[1:], len(self.actions))
+        self.first_obs = np.array(demo.columns['first_obs'][0])
+        self.obs_type = demo.attributes['obs_type']
+        self.atari_env = atari_env
+        self.cache_segments = cache_segments
+        self.segments = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.actions) + 1
+
+    @property
+    def shape(self):
+        return (len(self), *self.first_obs.shape)
+
+    @property
+    def dtype(self):
+        return self.first_obs.dtype
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            i = int(key) + len(self) if key < 0 else int(key)
+            if not 0 <= i < len(self):
+                raise IndexError(f'Observation {key} out of range for a demo of {len(self.actions):d} actions')
+            if i == 0:
+                return self.first_obs
+            k = self._segment_index(i)
+            return self._segment(k)[i - self.starts[k] - 1]
+        indices = np.arange(len(self))[key] if isinstance(key, slice) else np.asarray(key, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError(f'Observations out of range for a demo of {len(self.actions):d} actions')
+        obs = np.empty((len(indices), *self.first_obs.shape), dtype=self.first_obs.dtype)
+        obs[indices == 0] = self.first_obs
+        later = np.flatnonzero(indices > 0)
+        segment_indices = self._segment_index(indices[later])
+        for k in np.unique(segment_indices):
+            rows = later[segment_indices == k]
+            obs[rows] = self._segment(k)[indices[rows] - self.starts[k] - 1]
+        return obs
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None):
+        obs = self[:]
+        return obs if dtype is None else obs.astype(dtype)
+
+    def _segment_index(self, i):
+        # Observation `i` follows action `i - 1`.
+        return np.searchsorted(self.starts, np.asarray(i) - 1, side='right') - 1
+
+    def _segment(self, k):
+        """
+        :return: Observations after each action from checkpoint `k` up to the next one.
+        """
+        k = int(k)
+        segment = self.segments.get(k)
+        if segment is not None:
+            self.segments.move_to_end(k)
+            return segment
+        if self.atari_env is None:
+            self.atari_env = make_replay_env(self.obs_type)
+        atari_env = self.atari_env
+        atari_env.restore_state(self.checkpoints[k])
+        actions = self.actions[self.starts[k]:self.ends[k]]
+        segment = np.empty((len(actions), *self.first_obs.shape), dtype=self.first_obs.dtype)
+        for j, a in enumerate(actions):
+            atari_env.ale.act(atari_env._action_set[a])
+            segment[j] = atari_env._get_obs()
+        self.segments[k] = segment
+        if len(self.segments) > self.cache_segments:
+            self.segments.popitem(last=False)
+        return segment
+
+
+class ObservationList:
+    """
+    The list of observations of `AtariDemo` once it loaded an action-only demo: the demo's observations (regenerated
+    when they are read, e.g., after time travel), followed by those appended since.
+    """
+
+    def __init__(self, observations):
+        """
+        :param observations: `DemoObservations` of the demo.
+        """
+        self.observations = observations
+        self.n = len(observations)
+        self.appended = []
+
+    def __len__(self):
+        return self.n + len(self.appended)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < self.n:
+            return self.observations[i]
+        return self.appended[i - self.n]
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self.observations[i]
+        yield from self.appended
+
+    def append(self, obs):
+        self.appended.append(obs)
+
+    def pop(self):
+        if len(self.appended) > 0:
+            return self.appended.pop()
+        self.n -= 1
+        return self.observations[self.n]
+
+
+class RoomList:
+    """
+    The list of rooms of `AtariDemo` once it loaded a demo without RAM observations: the demo's rooms, found by
+    replaying it when they are first read (e.g., when the demo is saved again, but not on time travel), followed by
+    those appended since.
+    """
+
+    def __init__(self, replay, n):
+        """
+        :param replay: Function returning the room after each action of the demo.
+        :param n: Number of actions of the demo.
+        """
+        self.replay = replay
+        self.rooms = None
+        self.n = n
+        self.appended = []
+
+    def __len__(self):
+        return self.n + len(self.appended)
+
+    def __iter__(self):
+        if self.n > 0 and self.rooms is None:
+            self.rooms = self.replay()
+        for i in range(self.n):
+            yield int(self.rooms[i])
+        yield from self.appended
+
+    def append(self, room):
+        self.appended.append(room)
+
+    def pop(self):
+        """
+        Drop the last room, without replaying the demo.
+        """
+        if len(self.appended) > 0:
+            self.appended.pop()
+        else:
+            self.n -= 1
+
+
+def validate_demo(path, atari_env=None):
+    """
+    Replay a demo's actions from the start, without restoring its checkpoints, and check that the lives, rewards and
+    (where stored) observations along the way, and the emulator RAM at each checkpoint, match the recording.
+
+    Rewards are only compared on steps without a life lost, since recorded rewards include the death cost.
+
+    :param path: Demo, in any format.
+    :param atari_env: Environment on which to replay the demo. By default, one is created.
+    :return: Number of steps replayed, steps per second, number of mismatches of each kind (`lives`, `rewards`, `obs`
+        and `checkpoints`) and the first step which mismatched (or `None`).
+    """
+    demo_format = demos.demo_format(path)
+    dat = demos.read_demo(path)
+    actions = np.asarray(dat['actions'], dtype=np.int64)
+    rewards = np.asarray(dat['rewards'], dtype=np.float32)
+    lives = np.asarray(dat['lives'], dtype=np.int64)
+    obs = None if demo_format == 'actions' else dat['obs']  # Regenerated observations would match trivially.
+    checkpoints, checkpoint_action_nr = demos.read_checkpoints(path)
+    if atari_env is None:
+        if demo_format == 'actions':
+            obs_type = dat['obs'].obs_type
+        else:
+            obs_type = 'ram' if obs.shape[1:] == (128,) else 'rgb'
+        atari_env = make_replay_env(obs_type)
+    checkpoint_at = dict(zip(checkpoint_action_nr, checkpoints))
+
+    mismatches = {'lives': 0, 'rewards': 0, 'obs': 0, 'checkpoints': 0}
+    first_mismatch = None
+    start = time.perf_counter()
+    if 0 in checkpoint_at:
+        atari_env.restore_state(checkpoint_at[0])
+    else:
+        atari_env.reset()
+    ale = atari_env.ale
+    n = min(len(actions), len(rewards), len(lives))
+    for t in range(n + 1):
+        mismatched = []
+        if t > 0 and t in checkpoint_at:
+            ram = ale.getRAM()
+            state = atari_env.clone_state()
+            atari_env.restore_state(checkpoint_at[t])
+            if not np.array_equal(ram, ale.getRAM()):
+                mismatched.append('checkpoints')
+            atari_env.restore_state(state)
+        if t < n:
+            lives_before = ale.lives()
+            if lives_before != lives[t]:
+                mismatched.append('lives')
+            reward = 0
+            for _ in range(dat['frameskip']):
+                reward += ale.act(atari_env._action_set[actions[t]])
+            if ale.lives() >= lives_before and reward != rewards[t]:
+                mismatched.append('rewards')
+            if obs is not None and t + 1 < len(obs) and not np.array_equal(atari_env._get_obs(), obs[t + 1]):
+                mismatched.append('obs')
+        for kind in mismatched:
+            mismatches[kind] += 1
+        if len(mismatched) > 0 and first_mismatch is None:
+            first_mismatch = t
+    elapsed = time.perf_counter() - start
+    return {
+        'steps': n,
+        'steps_per_sec': n / elapsed if elapsed > 0 else 0.0,
+        **mismatches,
+        'first_mismatch': first_mismatch
+    }
+
+
+def convert_to_action_demo(src_path, dst_path, atari_env=None, chunk_size=1024):
+    """
+    Convert a demo with observations (in either format) to an action-only demo. Such demos were recorded from a reset
+    without checkpoint, so the state after reset is recreated by resetting `atari_env`.
+
+    :param atari_env: Environment with the demo's observation type. By default, one is created.
+    """
+    dat = demos.read_demo(src_path)
+    if dat['frameskip'] != 1:
+        raise ValueError(f'Action-only demos are replayed without frameskip, not {dat["frameskip"]:d}')
+    obs = dat['obs']
+    obs_type = 'ram' if obs.shape[1:] == (128,) else 'rgb'
+    if atari_env is None:
+        atari_env = make_replay_env(obs_type)
+    atari_env.reset()
+    checkpoints, checkpoint_action_nr = demos.read_checkpoints(src_path)
+    if len(checkpoint_action_nr) == 0 or checkpoint_action_nr[0] != 0:
+        checkpoints, checkpoint_action_nr = [atari_env.clone_state()] + checkpoints, [0] + checkpoint_action_nr
+    demos.write_action_demo(dst_path,
+                            dat['actions'],
+                            dat['rewards'],
+                            dat['lives'],
+                            obs[0],
+                            obs_type,
+                            checkpoints,
+                            checkpoint_action_nr,
+                            chunk_size=chunk_size)
+
+
+def replay_ram(path, atari_env=None):
+    """
+    Replay a demo's actions from the start, restoring its checkpoints along the way.
+
+    :param path: Demo, in any format.
+    :param atari_env: Environment on which to replay the demo. By default, one is created.
+    :return: Emulator RAM after each action, shape=(actions, 128).
+    """
+    dat = demos.read_demo(path)
+    checkpoints, checkpoint_action_nr = demos.read_checkpoints(path)
+    return replay_actions_ram(dat['actions'], checkpoints, checkpoint_action_nr, frameskip=dat['frameskip'],
+                              atari_env=atari_env)
+
+
+def replay_actions_ram(actions, checkpoints, checkpoint_action_nr, frameskip=1, atari_env=None):
+    """
+    `replay_ram` of a demo already read.
+
+    :param frameskip: Frames emulated per action.
+    """
+    actions = np.asarray(actions, dtype=np.int64)
+    checkpoint_at = dict(zip(checkpoint_action_nr, checkpoints))
+    if atari_env is None:
+        atari_env = make_replay_env('ram')
+    atari_env.reset()
+    ram = np.empty((len(actions), 128), dtype=np.uint8)
+    for t, a in enumerate(actions):
+        if t in checkpoint_at:
+            atari_env.restore_state(checkpoint_at[t])
+        for _ in range(frameskip):
+            atari_env.ale.act(atari_env._action_set[a])
+        ram[t] = atari_env.ale.getRAM()
+    return ram
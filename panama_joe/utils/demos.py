@@ -0,0 +1,354 @@
+"""
+Columnar demo format.
+
+A demo is a directory ending in `COLUMNAR_SUFFIX` which holds one flat binary file per column (`actions.bin`,
+`rewards.bin`, `lives.bin`, `obs.bin`), a pickle of the emulator checkpoints, and a `meta.json` describing the
+dtype, per-row shape and length of each column. Columns are opened with `np.memmap`, so reading step `k` only touches
+the pages around row `k`.
+
+Demos are written whole, when they are saved, each column in chunks of rows appended to its file; they are not streamed
+to disk while recording. `AtariDemo` keeps the demo being recorded in memory, since time travel rewrites its end and
+each save writes a new demo of everything recorded so far.
+
+Action-only demos (ending in `ACTIONS_SUFFIX`) are columnar demos without `obs.bin`: only the first observation is
+kept (`first_obs.bin`), along with a checkpoint of the state after reset and the observation type. Since the emulator is
+deterministic (without sticky actions), the other observations are regenerated on demand by replaying the actions from
+the nearest checkpoint (see `demo_replay.DemoObservations`).
+"""
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+LEGACY_SUFFIX = '.demo'
+COLUMNAR_SUFFIX = '.cdemo'
+ACTIONS_SUFFIX = '.ademo'
+DEMO_FORMAT_SUFFIXES = {
+    'pickle': LEGACY_SUFFIX,
+    'columnar': COLUMNAR_SUFFIX,
+    'actions': ACTIONS_SUFFIX
+}
+FORMAT_VERSION = 1
+
+_META_FILE = 'meta.json'
+_CHECKPOINTS_FILE = 'checkpoints.pkl'
+_COLUMN_DTYPES = {
+    'actions': np.uint8,
+    'rewards': np.float32,
+    'lives': np.uint8,
+}
+
+
+class ColumnarDemoWriter:
+    """
+    Appends rows to the columns of a demo, flushing each column to disk every `chunk_size` rows. Columns are only
+    described in the metadata, which makes the demo readable, on `close`.
+    """
+
+    def __init__(self, path, chunk_size=1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.columns = {}
+        self.checkpoints = []
+        self.checkpoint_action_nr = []
+        self.attributes = {}
+
+    def declare(self, name, dtype, shape=()):
+        """
+        Create an empty column. Columns are otherwise created from the dtype and shape of their first value.
+        """
+        column = _ColumnWriter(os.path.join(self.path, name + '.bin'), dtype, shape, self.chunk_size)
+        self.columns[name] = column
+        return column
+
+    def append(self, name, value):
+        column = self.columns.get(name)
+        if column is None:
+            value = np.asarray(value, dtype=_COLUMN_DTYPES.get(name))
+            column = self.declare(name, value.dtype, value.shape)
+        column.append(value)
+
+    def extend(self, name, values):
+        for value in values:
+            self.append(name, value)
+
+    def set_checkpoints(self, checkpoints, checkpoint_action_nr):
+        self.checkpoints = checkpoints
+        self.checkpoint_action_nr = checkpoint_action_nr
+
+    def close(self):
+        meta = {
+            'version': FORMAT_VERSION,
+            'columns': {name: column.close() for name, column in self.columns.items()},
+            'checkpoints': len(self.checkpoints)
+        }
+        if len(self.attributes) > 0:
+            meta['attributes'] = self.attributes
+        with open(os.path.join(self.path, _CHECKPOINTS_FILE), 'wb') as f:
+            pickle.dump({
+                'checkpoints': self.checkpoints,
+                'checkpoint_action_nr': self.checkpoint_action_nr
+            }, f)
+        # Written last: a directory without metadata is an incomplete demo.
+        with open(os.path.join(self.path, _META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+class _ColumnWriter:
+
+    def __init__(self, path, dtype, shape, chunk_size):
+        self.dtype = dtype
+        self.shape = shape
+        self.chunk = np.empty((chunk_size, *shape), dtype=dtype)
+        self.n_buffered = 0
+        self.n_written = 0
+        self.f = open(path, 'wb')
+
+    def append(self, value):
+        self.chunk[self.n_buffered] = value
+        self.n_buffered += 1
+        if self.n_buffered == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered > 0:
+            self.f.write(self.chunk[:self.n_buffered].data)
+            self.n_written += self.n_buffered
+            self.n_buffered = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        return {
+            'dtype': np.dtype(self.dtype).str,
+            'shape': list(self.shape),
+            'length': self.n_written
+        }
+
+
+class ColumnarDemo:
+    """
+    Read-only, memory-mapped view of a columnar demo.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, _META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'Unsupported demo format version: {self.meta["version"]}')
+        self.columns = {name: _open_column(os.path.join(path, name + '.bin'), spec)
+                        for name, spec in self.meta['columns'].items()}
+
+    @property
+    def actions(self):
+        return self.columns.get('actions')
+
+    @property
+    def rewards(self):
+        return self.columns.get('rewards')
+
+    @property
+    def lives(self):
+        return self.columns.get('lives')
+
+    @property
+    def obs(self):
+        return self.columns.get('obs')
+
+    @property
+    def attributes(self):
+        return self.meta.get('attributes', {})
+
+    @property
+    def actions_only(self):
+        return 'first_obs' in self.columns
+
+    def __len__(self):
+        return len(self.actions)
+
+    def load_checkpoints(self):
+        with open(os.path.join(self.path, _CHECKPOINTS_FILE), 'rb') as f:
+            dat = pickle.load(f)
+        return dat['checkpoints'], dat['checkpoint_action_nr']
+
+
+def _open_column(path, spec):
+    shape = (spec['length'], *spec['shape'])
+    if spec['length'] == 0:
+        return np.empty(shape, dtype=spec['dtype'])  # Empty files cannot be memory-mapped.
+    return np.memmap(path, dtype=spec['dtype'], mode='r', shape=shape)
+
+
+def is_columnar(path):
+    return os.path.isfile(os.path.join(path, _META_FILE))
+
+
+def write_demo(path, actions, rewards, lives, obs, checkpoints, checkpoint_action_nr, chunk_size=1024,
+               frameskip=None):
+    """
+    Write a whole demo in the columnar format, replacing any demo already at `path`.
+
+    :param path: Demo directory.
+    :param actions: Actions taken.
+    :param rewards: Rewards received.
+    :param lives: Lives before each step.
+    :param obs: Observations, starting with the one from `reset`. May be `None` to leave out the observations.
+    :param checkpoints: Emulator states from `clone_state`.
+    :param checkpoint_action_nr: Number of actions taken at each checkpoint.
+    :param chunk_size: Rows per write.
+    :param frameskip: Frames emulated per action, if known.
+    """
+    columns = {} if obs is None else {'obs': (_unwrap_reset_obs(o) for o in obs)}
+    attributes = {} if frameskip is None else {'frameskip': frameskip}
+    _write_columns(path, actions, rewards, lives, checkpoints, checkpoint_action_nr, chunk_size, columns=columns,
+                   attributes=attributes)
+
+
+def write_action_demo(path, actions, rewards, lives, first_obs, obs_type, checkpoints, checkpoint_action_nr,
+                      chunk_size=1024):
+    """
+    Write a whole demo without its observations, replacing any demo already at `path`.
+
+    :param first_obs: Observation from `reset`.
+    :param obs_type: Observation type of the environment, with which to regenerate the other observations.
+    :param checkpoints: Emulator states from `clone_state`, starting with the state after reset.
+    :param checkpoint_action_nr: Number of actions taken at each checkpoint, starting with 0.
+    """
+    if len(checkpoint_action_nr) == 0 or checkpoint_action_nr[0] != 0:
+        raise ValueError('Action-only demos need a checkpoint of the state after reset')
+    _write_columns(path, actions, rewards, lives, checkpoints, checkpoint_action_nr, chunk_size,
+                   columns={'first_obs': [_unwrap_reset_obs(first_obs)]},
+                   attributes={'obs_type': obs_type, 'frameskip': 1})
+
+
+def _write_columns(path, actions, rewards, lives, checkpoints, checkpoint_action_nr, chunk_size, columns,
+                   attributes=None):
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    writer = ColumnarDemoWriter(tmp_path, chunk_size=chunk_size)
+    for name, dtype in _COLUMN_DTYPES.items():
+        writer.declare(name, dtype)
+    writer.extend('actions', actions)
+    writer.extend('rewards', rewards)
+    writer.extend('lives', lives)
+    for name, values in columns.items():
+        writer.extend(name, values)
+    writer.attributes.update(attributes or {})
+    writer.set_checkpoints(checkpoints, checkpoint_action_nr)
+    writer.close()
+    # Swap in the finished directory; readers which still map the old files keep their (unlinked) copies.
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def read_legacy_demo(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_legacy_demo(src_path, dst_path, chunk_size=1024):
+    """
+    Convert a pickled `.demo` file (from `AtariDemo.save_to_file`) to the columnar format.
+    """
+    dat = read_legacy_demo(src_path)
+    write_demo(dst_path,
+               dat['actions'],
+               dat['rewards'],
+               dat['lives'],
+               dat['obs'],
+               dat['checkpoints'],
+               dat['checkpoint_action_nr'],
+               chunk_size=chunk_size,
+               frameskip=demo_frameskip(dat))
+
+
+def read_demo(path):
+    """
+    Read the actions, rewards and observations of a demo in any format. Columnar demos are returned as memory maps;
+    pickled demos are loaded whole. The observations of action-only demos are a `DemoObservations`, indexed like an
+    array, which replays the demo to regenerate the observations which are read.
+
+    :return: Dictionary with 'actions', 'rewards', 'lives' and 'obs' arrays, and the 'frameskip' (see `demo_frameskip`).
+    """
+    if is_columnar(path):
+        demo = ColumnarDemo(path)
+        if demo.actions_only:
+            from panama_joe.utils.demo_replay import DemoObservations  # Imports the emulator.
+            obs = DemoObservations(demo)
+        else:
+            obs = demo.obs
+        return {
+            'actions': demo.actions,
+            'rewards': demo.rewards,
+            'lives': demo.lives,
+            'obs': obs,
+            'frameskip': demo_frameskip(demo.attributes)
+        }
+    dat = read_legacy_demo(path)
+    return {
+        'actions': np.asarray(dat['actions'], dtype=_COLUMN_DTYPES['actions']),
+        'rewards': np.asarray(dat['rewards'], dtype=_COLUMN_DTYPES['rewards']),
+        'lives': np.asarray(dat['lives'], dtype=_COLUMN_DTYPES['lives']),
+        'obs': np.stack([_unwrap_reset_obs(o) for o in dat['obs']]),
+        'frameskip': demo_frameskip(dat)
+    }
+
+
+def demo_frameskip(attributes):
+    """
+    :param attributes: Pickled demo, or attributes of a columnar demo.
+    :return: Frames emulated per action of the demo. Demos saved without it were recorded with `record_demo`'s default
+        of 1.
+    """
+    return attributes.get('frameskip', 1)
+
+
+def read_checkpoints(path):
+    """
+    :return: Emulator checkpoints of a demo in any format, and the number of actions taken at each.
+    """
+    if is_columnar(path):
+        return ColumnarDemo(path).load_checkpoints()
+    dat = read_legacy_demo(path)
+    return dat['checkpoints'], dat['checkpoint_action_nr']
+
+
+def list_demos(demo_dir):
+    """
+    :return: Sorted names of the demos (of any format) in `demo_dir`.
+    """
+    return sorted(file_name for file_name in os.listdir(demo_dir)
+                  if file_name.endswith(LEGACY_SUFFIX)
+                  or (file_name.endswith((COLUMNAR_SUFFIX, ACTIONS_SUFFIX))
+                      and is_columnar(os.path.join(demo_dir, file_name))))
+
+
+def demo_format(path):
+    """
+    :return: Format of a demo, a key of `DEMO_FORMAT_SUFFIXES`.
+    """
+    if not is_columnar(path):
+        return 'pickle'
+    return 'actions' if ColumnarDemo(path).actions_only else 'columnar'
+
+
+def size_on_disk(path):
+    """
+    :return: Number of bytes of a demo in any format.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _unwrap_reset_obs(obs):
+    # `AtariDemo.reset` stores the whole `(obs, info)` tuple from `env.reset` as the first observation.
+    if isinstance(obs, tuple):
+        return obs[0]
+    return obs
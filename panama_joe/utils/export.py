@@ -0,0 +1,129 @@
+"""
+Saved PPO policies exported as standalone TorchScript modules, for fast action selection on the CPU.
+
+The exported module maps a batch of raw observations to action logits: it includes the policy's observation
+preprocessing (casting, and scaling of images), features extractor, actor network and action head, but neither the
+value head nor Stable-Baselines3's checks and conversions. Its linear layers may be dynamically quantized to 8-bit
+integers. `ExportedPolicy` loads it without Stable-Baselines3 and stands in for the model in rollout loops.
+"""
+import json
+
+import numpy as np
+import torch
+
+EXPORT_SUFFIX = '.pt'
+_META_FILE = 'meta.json'
+
+
+class PolicyLogits(torch.nn.Module):
+    """
+    Actor of a Stable-Baselines3 `ActorCriticPolicy` with a discrete action space, from observations to logits. Images
+    are taken as the environment returns them, channels last, and transposed as by `VecTransposeImage`.
+    """
+
+    def __init__(self, policy):
+        super(PolicyLogits, self).__init__()
+        self.images = len(policy.observation_space.shape) == 3
+        self.scale_images = self.images and policy.normalize_images
+        self.features_extractor = policy.pi_features_extractor
+        self.policy_net = policy.mlp_extractor.policy_net
+        self.action_net = policy.action_net
+
+    def forward(self, obs):
+        obs = obs.float()
+        if self.images:
+            obs = obs.permute(0, 3, 1, 2)
+        if self.scale_images:
+            obs = obs / 255.0
+        return self.action_net(self.policy_net(self.features_extractor(obs)))
+
+
+def export_policy(model_path, path, quantize=False):
+    """
+    Trace the policy of a saved PPO model and save it as a TorchScript module.
+
+    :param model_path: Saved model.
+    :param path: Exported module (see `EXPORT_SUFFIX`).
+    :param quantize: Whether to quantize the weights and activations of linear layers to 8-bit integers (dynamic
+        quantization). Convolutions are kept in floating point.
+    :return: The PPO model, loaded on the CPU.
+    """
+    from stable_baselines3.ppo import PPO
+
+    model = PPO.load(model_path, device='cpu')
+    module = PolicyLogits(model.policy).eval()
+    if quantize:
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    example = torch.as_tensor(np.stack([model.observation_space.sample() for _ in range(2)]))
+    if module.images:
+        example = example.permute(0, 2, 3, 1).contiguous()
+    with torch.inference_mode():
+        traced = torch.jit.freeze(torch.jit.trace(module, example))
+    meta = {
+        'source': model_path,
+        'num_timesteps': model.num_timesteps,
+        'observation_shape': list(example.shape[1:]),
+        'observation_dtype': str(model.observation_space.dtype),
+        'n_actions': int(model.action_space.n),
+        'quantized': quantize
+    }
+    torch.jit.save(traced, path, _extra_files={_META_FILE: json.dumps(meta)})
+    return model
+
+
+class ExportedPolicy:
+    """
+    Exported policy, with the `predict` signature of Stable-Baselines3 models.
+    """
+
+    def __init__(self, path):
+        extra_files = {_META_FILE: ''}
+        self.module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        self.meta = json.loads(extra_files[_META_FILE])
+        self.obs_ndim = len(self.meta['observation_shape'])
+
+    def logits(self, observation):
+        """
+        :param observation: Batch of observations.
+        :return: Action logits, as a tensor.
+        """
+        with torch.inference_mode():
+            return self.module(torch.from_numpy(np.ascontiguousarray(observation)))
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        """
+        Same signature as `model.predict`, for an observation or a batch of them. Actions are sampled with PyTorch's
+        random number generator.
+        """
+        observation = np.asarray(observation)
+        batched = observation.ndim > self.obs_ndim
+        logits = self.logits(observation if batched else observation[None])
+        if deterministic:
+            actions = logits.argmax(dim=1)
+        else:
+            actions = torch.multinomial(torch.softmax(logits, dim=1), 1)[:, 0]
+        actions = actions.numpy()
+        return (actions if batched else actions[0]), None
+
+
+def check_parity(model, exported, observations):
+    """
+    Compare an exported policy with the model it was exported from.
+
+    :param model: PPO model.
+    :param exported: `ExportedPolicy`.
+    :param observations: Batch of observations.
+    :return: Fraction of observations for which the exported policy's most likely action is `model.predict`'s
+        deterministic action, and largest absolute difference between their action logits.
+    """
+    expected, _ = model.predict(observations, deterministic=True)
+    actions, _ = exported.predict(observations, deterministic=True)
+    with torch.inference_mode():
+        obs_tensor, _ = model.policy.obs_to_tensor(observations)
+        reference = model.policy.get_distribution(obs_tensor).distribution.logits
+        # Categorical distributions normalize logits to log-probabilities, so the exported ones are too.
+        logits = torch.log_softmax(exported.logits(observations), dim=1)
+    return {
+        'agreement': float(np.mean(actions == expected)),
+        'max_logit_error': float((logits - reference).abs().max())
+    }
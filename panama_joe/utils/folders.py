@@ -1,19 +1,67 @@
 import os
 
 _OUTPUT_DIR = 'output'
+_ARCHIVES_DIR = os.path.join(_OUTPUT_DIR, 'archives')
+_BENCHMARKS_DIR = os.path.join(_OUTPUT_DIR, 'benchmarks')
+_DATASETS_DIR = os.path.join(_OUTPUT_DIR, 'datasets')
 _DEMOS_DIR = os.path.join(_OUTPUT_DIR, 'demos')
+_EVALUATIONS_DIR = os.path.join(_OUTPUT_DIR, 'evaluations')
+_LOGS_DIR = os.path.join(_OUTPUT_DIR, 'logs')
 _MODELS_DIR = os.path.join(_OUTPUT_DIR, 'models')
+_START_STATES_DIR = os.path.join(_OUTPUT_DIR, 'start_states')
+_SWEEPS_DIR = os.path.join(_OUTPUT_DIR, 'sweeps')
 _VIDEOS_DIR = os.path.join(_OUTPUT_DIR, 'videos')
 
 
+def archive_dir(archive_name):
+    return _child_dir(_ARCHIVES_DIR, archive_name)
+
+
+def benchmark_dir():
+    os.makedirs(_BENCHMARKS_DIR, exist_ok=True)
+    return _BENCHMARKS_DIR
+
+
+def checkpoint_dir(model_name):
+    return _child_dir(model_dir(model_name), 'checkpoints')
+
+
+def dataset_dir(dataset_name):
+    return _child_dir(_DATASETS_DIR, dataset_name)
+
+
 def demo_dir(model_name):
     return _child_dir(_DEMOS_DIR, model_name)
 
 
+def demo_types():
+    return _child_names(_DEMOS_DIR)
+
+
+def evaluation_dir(model_name):
+    return _child_dir(_EVALUATIONS_DIR, model_name)
+
+
+def log_dir(model_name):
+    return _child_dir(_LOGS_DIR, model_name)
+
+
 def model_dir(model_name):
     return _child_dir(_MODELS_DIR, model_name)
 
 
+def model_names():
+    return _child_names(_MODELS_DIR)
+
+
+def start_state_dir(cache_name):
+    return _child_dir(_START_STATES_DIR, cache_name)
+
+
+def sweep_dir(sweep_name):
+    return _child_dir(_SWEEPS_DIR, sweep_name)
+
+
 def video_dir(model_name):
     return _child_dir(_VIDEOS_DIR, model_name)
 
@@ -22,3 +70,10 @@ def _child_dir(parent_dir, model_name):
     child_dir = os.path.join(parent_dir, model_name)
     os.makedirs(child_dir, exist_ok=True)
     return child_dir
+
+
+def _child_names(parent_dir):
+    # Without creating `parent_dir`.
+    if not os.path.isdir(parent_dir):
+        return []
+    return sorted(name for name in os.listdir(parent_dir) if os.path.isdir(os.path.join(parent_dir, name)))
@@ -0,0 +1,216 @@
+"""
+Batched policy inference for many rollout workers, in the style of SEED RL: one process holds the policy, and workers
+send it observations instead of each running the policy on its own.
+
+Each client has a slot in shared memory for its observation and its action. To request an action, a client writes its
+observation, puts its id in the request queue and waits on its semaphore. The server takes the first pending request,
+gathers more until `max_batch_size` requests or `max_latency_ms` after the first, runs the policy once on the whole
+batch, writes the actions and releases the clients' semaphores. Clients and `InferenceServer.close` wait in slices of
+`_POLL_INTERVAL`, between which they check that the server is still running, and raise if it is not.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+_POLL_INTERVAL = 1.0  # Seconds.
+
+
+class InferenceChannels:
+    """
+    Shared memory, request queue and semaphores between an `InferenceServer` and its clients. Passed to processes when
+    they are created (e.g., in a pool's `initargs`), which then `connect`.
+    """
+
+    def __init__(self, ctx, obs_shape, obs_dtype, n_clients):
+        self.obs_shape = tuple(obs_shape)
+        self.obs_dtype = np.dtype(obs_dtype)
+        self.n_clients = n_clients
+        self.obs = ctx.RawArray('b', n_clients * int(np.prod(obs_shape)) * self.obs_dtype.itemsize)
+        self.actions = ctx.RawArray('q', n_clients)
+        self.stamps = ctx.RawArray('d', n_clients)  # When each client's pending request was sent.
+        self.requests = ctx.Queue()
+        self.replies = [ctx.Semaphore(0) for _ in range(n_clients)]
+        self.free_ids = ctx.Queue()
+        for i in range(n_clients):
+            self.free_ids.put(i)
+        self.stopped = ctx.RawValue('b', 0)  # Set once the server process has exited, for whatever reason.
+        self._views = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_views'] = None
+        return state
+
+    def views(self):
+        """
+        :return: Arrays over the shared memory: observations, actions and request times, one row per client.
+        """
+        if self._views is None:
+            self._views = (
+                np.frombuffer(self.obs, dtype=self.obs_dtype).reshape((self.n_clients, *self.obs_shape)),
+                np.frombuffer(self.actions, dtype=np.int64),
+                np.frombuffer(self.stamps, dtype=np.float64)
+            )
+        return self._views
+
+    def connect(self):
+        """
+        :return: Client with the next free slot. Raises `queue.Empty` if every slot is taken.
+        """
+        return InferenceClient(self, self.free_ids.get(timeout=1.0))
+
+
+class InferenceClient:
+    """
+    Stands in for a model in rollout loops: `predict` sends the observation to the server and waits for its action.
+    """
+
+    def __init__(self, channels, client_id):
+        self.channels = channels
+        self.client_id = client_id
+        obs, actions, stamps = channels.views()
+        self.obs = obs[client_id]
+        self.actions = actions
+        self.stamps = stamps
+        self.reply = channels.replies[client_id]
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        """
+        Same signature as `model.predict`, for a single observation. Whether actions are deterministic is set by the
+        server.
+        """
+        self.obs[...] = observation
+        self.stamps[self.client_id] = time.perf_counter()  # Monotonic clock, shared by processes.
+        self.channels.requests.put(self.client_id)
+        while not self.reply.acquire(timeout=_POLL_INTERVAL):
+            if self.channels.stopped.value:
+                raise RuntimeError('The inference server stopped without serving the request')
+        return self.actions[self.client_id], None
+
+
+class InferenceServer:
+    """
+    Process holding a saved PPO policy (or an exported one, see `export.ExportedPolicy`) on the CPU which serves batched
+    requests from up to `n_clients` clients.
+    """
+
+    def __init__(self, path, observation_space, n_clients, max_batch_size=64, max_latency_ms=1.0, deterministic=False,
+                 n_threads=None):
+        """
+        :param path: Saved model, or exported policy.
+        :param observation_space: Observation space of the clients' environments.
+        :param max_batch_size: Most requests per batch (at most `n_clients`, since each client waits for its action).
+        :param max_latency_ms: Longest wait for more requests after the first of a batch.
+        :param deterministic: Whether to take the most likely actions rather than sample them.
+        :param n_threads: Number of PyTorch threads of the server. By default, PyTorch's.
+        """
+        # PyTorch is only imported by the server, in a fresh process.
+        ctx = multiprocessing.get_context('spawn')
+        self.channels = InferenceChannels(ctx, observation_space.shape, observation_space.dtype, n_clients)
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_serve,
+            args=(path, self.channels, min(max_batch_size, n_clients), max_latency_ms / 1e3, deterministic,
+                  n_threads, self.results),
+            daemon=True
+        )
+        self.process.start()
+        # Waits for the server to exit (even if killed), so that clients waiting for it stop waiting.
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+        self.watcher.start()
+
+    def _watch(self):
+        self.process.join()
+        self.channels.stopped.value = 1
+
+    def close(self):
+        """
+        Stop the server once it has served pending requests.
+
+        :return: Metrics: requests and batches served, batch sizes, queue latency (from a request to the start of its
+            batch), inference time per batch and actions per second while serving.
+        """
+        self.channels.requests.put(None)
+        while True:
+            alive = self.process.is_alive()
+            try:
+                metrics = self.results.get(timeout=_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if not alive:  # Its results would have been received.
+                    raise RuntimeError(f'The inference server exited with code {self.process.exitcode}')
+        self.process.join()
+        return metrics
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.process.is_alive():
+            self.close()
+
+
+def _serve(path, channels, max_batch_size, max_latency, deterministic, n_threads, results):
+    import torch
+
+    from panama_joe.utils.export import EXPORT_SUFFIX, ExportedPolicy
+
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    if path.endswith(EXPORT_SUFFIX):
+        policy = ExportedPolicy(path)
+    else:
+        from stable_baselines3.ppo import PPO
+
+        policy = PPO.load(path, device='cpu').policy
+    obs, actions, stamps = channels.views()
+    batch_sizes, latencies, inference_times = [], [], []
+    start = None
+    running = True
+    while running:
+        client_id = channels.requests.get()
+        if client_id is None:
+            break
+        if start is None:
+            start = time.perf_counter()
+        batch = [client_id]
+        deadline = time.perf_counter() + max_latency
+        while len(batch) < max_batch_size:
+            try:
+                client_id = channels.requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if client_id is None:
+                running = False
+                break
+            batch.append(client_id)
+        batch = np.array(batch)
+        batch_start = time.perf_counter()
+        latencies.extend(batch_start - stamps[batch])
+        actions[batch] = policy.predict(obs[batch], deterministic=deterministic)[0]
+        inference_times.append(time.perf_counter() - batch_start)
+        batch_sizes.append(len(batch))
+        for client_id in batch:
+            channels.replies[client_id].release()
+    elapsed = 0.0 if start is None else time.perf_counter() - start
+    results.put(_summarize(np.array(batch_sizes, dtype=np.int64), np.array(latencies), np.array(inference_times),
+                           elapsed))
+
+
+def _summarize(batch_sizes, latencies, inference_times, elapsed):
+    if len(batch_sizes) == 0:
+        return {'requests': 0, 'batches': 0}
+    return {
+        'requests': int(batch_sizes.sum()),
+        'batches': len(batch_sizes),
+        'batch_size_mean': float(batch_sizes.mean()),
+        'batch_size_max': int(batch_sizes.max()),
+        'batch_size_counts': np.bincount(batch_sizes).tolist(),
+        'queue_latency_p50_us': 1e6 * float(np.percentile(latencies, 50)),
+        'queue_latency_p99_us': 1e6 * float(np.percentile(latencies, 99)),
+        'inference_p50_us': 1e6 * float(np.percentile(inference_times, 50)),
+        'actions_per_sec': float(batch_sizes.sum()) / elapsed if elapsed > 0 else 0.0
+    }
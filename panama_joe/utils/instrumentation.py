@@ -0,0 +1,133 @@
+"""
+Timing of the stages of training: environment stepping (per wrapper, see `wrappers.TimingWrapper`), vectorized
+environment stepping, policy inference and the learner's update.
+"""
+import csv
+import time
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+PERCENTILES = (50, 99)
+
+
+class TimingCallback(BaseCallback):
+    """
+    Records, per rollout/update iteration, the time spent collecting the rollout and updating the policy, steps per
+    second, and latency percentiles of policy inference (`policy.forward`), of `VecEnv.step` and of each stage of the
+    environments' wrapper chains (when made with `make_env(timing=True)`). Rows are appended to a CSV file and recorded
+    under `timing/` in the model's logger (e.g., to TensorBoard). When a row has columns which earlier rows lacked, the
+    file is rewritten with them (one row per iteration, so this is cheap).
+    """
+
+    def __init__(self, path, verbose=0):
+        """
+        :param path: CSV file to write.
+        """
+        super(TimingCallback, self).__init__(verbose=verbose)
+        self.path = path
+        self.file = None
+        self.writer = None
+        self.rows = []
+        self.iteration = 0
+        self.row = None
+        self.rollout_start = None
+        self.rollout_end = None
+        self.rollout_timesteps = 0
+        self.inference = []
+        self.vec_step = []
+        self.original_forward = None
+        self.original_step = None
+
+    def _on_training_start(self):
+        policy = self.model.policy
+        self.original_forward = policy.forward
+        self.original_step = self.training_env.step
+        # Patch the instances, not their classes, so that nothing else is slowed down.
+        policy.forward = _timed(self.original_forward, self.inference)
+        self.training_env.step = _timed(self.original_step, self.vec_step)
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+        self._write_row(now)
+        self.rollout_start = now
+        self.rollout_timesteps = self.num_timesteps
+        self.inference.clear()
+        self.vec_step.clear()
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        self.rollout_end = time.perf_counter()
+        rollout_s = self.rollout_end - self.rollout_start
+        steps = self.num_timesteps - self.rollout_timesteps
+        self.iteration += 1
+        self.row = {
+            'iteration': self.iteration,
+            'timesteps': self.num_timesteps,
+            'rollout_s': rollout_s,
+            'steps_per_sec': steps / rollout_s,
+            **_percentiles('inference', self.inference),
+            **_percentiles('vec_step', self.vec_step)
+        }
+        try:
+            timings = self.training_env.env_method('drain_timings')
+        except AttributeError:
+            timings = []
+        for name in (timings[0].keys() if len(timings) > 0 else ()):
+            self.row.update(_percentiles(f'env_{name}', np.concatenate([t[name] for t in timings])))
+
+    def _on_training_end(self):
+        self._write_row(time.perf_counter())
+        self.model.policy.forward = self.original_forward
+        self.training_env.step = self.original_step
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write_row(self, now):
+        # The update following a rollout ends when the next rollout (or the end of training) starts.
+        if self.row is None:
+            return
+        row, self.row = self.row, None
+        row['update_s'] = now - self.rollout_end
+        row['iteration_steps_per_sec'] = (row['steps_per_sec'] * row['rollout_s']) / (now - self.rollout_start)
+        self.rows.append(row)
+        if self.writer is None or not set(row.keys()).issubset(self.writer.fieldnames):
+            fieldnames = [] if self.writer is None else list(self.writer.fieldnames)
+            fieldnames += [key for key in row.keys() if key not in fieldnames]
+            if self.file is not None:
+                self.file.close()
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.writer.writeheader()
+            self.writer.writerows(self.rows)
+        else:
+            self.writer.writerow(row)
+        self.file.flush()
+        for key, value in row.items():
+            if key not in ('iteration', 'timesteps'):
+                self.logger.record(f'timing/{key}', value)
+        if self.verbose > 0:
+            print(f'Iteration {row["iteration"]:d}: rollout {row["rollout_s"]:.2f}s, update {row["update_s"]:.2f}s,'
+                  f' {row["steps_per_sec"]:.1f} steps/sec, inference p50 {row.get("inference_p50_us", 0):.0f}us')
+
+
+def _timed(func, durations):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+        return result
+    return timed
+
+
+def _percentiles(name, durations):
+    """
+    :return: Dictionary of the given percentiles of `durations` (in seconds), in microseconds.
+    """
+    if len(durations) == 0:
+        return {}
+    values = np.percentile(np.asarray(durations), PERCENTILES)
+    return {f'{name}_p{p:d}_us': 1e6 * float(v) for p, v in zip(PERCENTILES, values)}
@@ -0,0 +1,56 @@
+"""
+Lives of each environment of a vectorized environment, written by the environments (see `wrappers.LivesWrapper`) into
+one array, so that batched reward shaping reads them all at once instead of from each environment's info.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+STEP = 0  # Row of the lives after each environment's last step.
+RESET = 1  # Row of the lives after each environment's last reset.
+
+
+class LivesBuffer:
+
+    def __init__(self, n_envs, shared=False):
+        """
+        :param n_envs: Number of environments.
+        :param shared: Whether the array is in shared memory. Copies pickled to other processes (e.g., with environment
+            arguments) then write to the same array, until it is closed by the process which created it.
+        """
+        self.n_envs = n_envs
+        size = 2 * n_envs * np.dtype(np.float64).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if shared else None
+        self._owner = shared
+        self._attach(bytearray(size) if self.shm is None else self.shm.buf)
+        self.lives[...] = np.nan  # Unknown until written.
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lives']
+        state['_owner'] = False
+        if self.shm is None:
+            state['buffer'] = bytes(self._buffer)
+        del state['_buffer']
+        return state
+
+    def __setstate__(self, state):
+        buffer = state.pop('buffer', None)
+        self.__dict__.update(state)
+        self._attach(bytearray(buffer) if self.shm is None else self.shm.buf)
+
+    def _attach(self, buffer):
+        self._buffer = buffer
+        self.lives = np.frombuffer(buffer, dtype=np.float64).reshape((2, self.n_envs))
+
+    def close(self):
+        """
+        Release the shared memory; the process which created the buffer also frees it.
+        """
+        if self.shm is None:
+            return
+        self.lives = self._buffer = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+        self.shm = None
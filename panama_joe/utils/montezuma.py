@@ -1,11 +1,19 @@
+import functools
+
 import gymnasium as gym
 
-from panama_joe.utils.wrappers import DeathCostWrapper
+from panama_joe.utils.counts import CountTable
+from panama_joe.utils.start_states import StartStateCache
+from panama_joe.utils.wrappers import CountBonusWrapper, DeathCostWrapper, DemoStartWrapper, FrameStackWrapper, \
+    LivesWrapper, MaxAndSkipWrapper, PreprocessFrameWrapper, RamFeatureWrapper, TimingWrapper
 
 ENV_ID = 'ALE/MontezumaRevenge-v5'
+VEC_ENV_TYPES = ('dummy', 'subproc', 'async')
 
 
-def make_env(obs_type='ram', frameskip=1, repeat_action_probability=0.0, render_mode='rgb_array', death_cost=-10):
+def make_env(obs_type='ram', frameskip=1, repeat_action_probability=0.0, render_mode='rgb_array', death_cost=-10,
+             preprocess=False, screen_size=84, grayscale=True, frame_stack=4, ram_features=False, count_bonus=0,
+             count_keys='cells', count_table=None, timing=False, start_states=None, lives_buffer=None, lives_index=0):
     """
     The 'ram', 'NoFrameskip', and 'Deterministic' variant of Montezuma's Revenge.
     https://gymnasium.farama.org/environments/atari/montezuma_revenge/
@@ -14,13 +22,103 @@ def make_env(obs_type='ram', frameskip=1, repeat_action_probability=0.0, render_
     :param frameskip: Number of frames to skip.
     :param repeat_action_probability: "Stickiness" of actions.
     :param render_mode: 'rgb_array' to visualize.
-    :param death_cost: Cost for losing a life.
+    :param death_cost: Cost for losing a life. When 0 or `None`, no `DeathCostWrapper` is added (e.g., for the death
+        cost to be applied to the whole vectorized environment by `VecDeathCost` instead).
+    :param preprocess: Whether to preprocess 'rgb' frames: max-pool over the last two skipped frames, resize, convert to
+        grayscale and stack. Observations are then views of reused buffers, shape=(screen_size, screen_size, channels).
+    :param screen_size: Width and height of preprocessed frames.
+    :param grayscale: Whether preprocessed frames are converted to grayscale.
+    :param frame_stack: Number of preprocessed frames to stack.
+    :param ram_features: Whether to decode 'ram' observations into Montezuma's Revenge state features (room, position,
+        lives, level, inventory and room objects; see `ram.ram_features`), shape=(44,).
+    :param count_bonus: Scale of the count-based exploration bonus, `count_bonus / sqrt(visits)` of the state reached
+        (see `CountBonusWrapper`). When 0 or `None`, no bonus is added.
+    :param count_keys: How states are counted: by Go-Explore cell ('cells') or by SimHash of the observations
+        ('simhash').
+    :param count_table: `CountTable` in which to count visits, shared (in shared memory) by vectorized environments'
+        workers. By default, each environment counts its own visits.
+    :param timing: Whether to time each stage of the wrapper chain with a `TimingWrapper`. Each stage's time includes
+        the stages beneath it; the outermost stage is 'total'. Read (and reset) with `env.drain_timings()`.
+    :param start_states: Path of a start state cache (see `build_start_states`) from which to start episodes, with a
+        backward curriculum (see `DemoStartWrapper`). Each process maps the cache itself, so only the path is copied to
+        vectorized environments' workers.
+    :param lives_buffer: `LivesBuffer` in which to write the lives after each step and reset, in column `lives_index`,
+        for `VecDeathCost` to read those of all environments at once (see `make_vec_env`).
     :return: Environment.
     """
+    if preprocess and obs_type != 'rgb':
+        raise ValueError(f'Preprocessing requires `obs_type=\'rgb\'`, not `{obs_type}`')
     env = gym.make(ENV_ID,
                    obs_type=obs_type,
-                   frameskip=frameskip,
+                   frameskip=1 if preprocess else frameskip,
                    repeat_action_probability=repeat_action_probability,
                    render_mode=render_mode)
-    env = DeathCostWrapper(env, death_cost=death_cost)
+    if start_states is not None:
+        env = DemoStartWrapper(env, StartStateCache(start_states))
+    if timing:
+        env = TimingWrapper(env, 'ale')
+    if preprocess:
+        if frameskip > 1:
+            env = MaxAndSkipWrapper(env, skip=frameskip)
+            if timing:
+                env = TimingWrapper(env, 'max_and_skip')
+        env = PreprocessFrameWrapper(env, screen_size=screen_size, grayscale=grayscale)
+        if frame_stack > 1:
+            env = FrameStackWrapper(env, n_frames=frame_stack)
+        if timing:
+            env = TimingWrapper(env, 'preprocess')
+    if ram_features:
+        env = RamFeatureWrapper(env)
+        if timing:
+            env = TimingWrapper(env, 'ram_features')
+    if count_bonus:
+        env = CountBonusWrapper(env, CountTable() if count_table is None else count_table, bonus=count_bonus,
+                                keys=count_keys)
+        if timing:
+            env = TimingWrapper(env, 'count_bonus')
+    if death_cost:
+        env = DeathCostWrapper(env, death_cost=death_cost)
+    if lives_buffer is not None:
+        env = LivesWrapper(env, lives_buffer, lives_index)
+    if timing:
+        env = TimingWrapper(env, 'total')
     return env
+
+
+def make_vec_env(n_envs=1, vec_env='dummy', seed=None, vec_wrappers=None, **kwargs):
+    """
+    Copies of `make_env` which are stepped together.
+
+    :param n_envs: Number of copies.
+    :param vec_env: 'dummy' (in-process, stepped one after another), 'subproc' (one process per copy, pipes),
+        or 'async' (one process per copy, observations passed through shared memory).
+    :param seed: Seed of the first copy; copy `i` is seeded with `seed + i`. When `None`, each copy gets a random seed.
+    :param vec_wrappers: Callables wrapping the vectorized environment, innermost first, beneath the `VecMonitor`
+        (e.g., `functools.partial(VecDeathCost, death_cost=-10)`, with `death_cost=0` passed to `make_env`, or
+        `VecRamFeatures`).
+    :param kwargs: Passed to `make_env`. With a `lives_buffer`, copy `i` writes to its column `i`.
+    :return: Vectorized environment.
+    """
+    # Stable-Baselines3 (and PyTorch) are only imported by those who need vectorized environments.
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecMonitor
+
+    from panama_joe.utils.vec_env import GymnasiumVecEnv, worker_env_fn
+
+    if kwargs.get('lives_buffer') is not None:
+        env_fns = [functools.partial(make_env, lives_index=i, **kwargs) for i in range(n_envs)]
+    else:
+        env_fns = [functools.partial(make_env, **kwargs) for _ in range(n_envs)]
+    if vec_env == 'dummy':
+        venv = DummyVecEnv(env_fns)
+    elif vec_env == 'subproc':
+        venv = SubprocVecEnv(env_fns)
+    elif vec_env == 'async':
+        venv = GymnasiumVecEnv(gym.vector.AsyncVectorEnv([worker_env_fn(env_fn) for env_fn in env_fns],
+                                                          shared_memory=True))
+    else:
+        raise ValueError(f'Unknown vectorized environment type: {vec_env} (one of {", ".join(VEC_ENV_TYPES)})')
+    venv.seed(seed)
+    for vec_wrapper in vec_wrappers or ():
+        venv = vec_wrapper(venv)
+    venv = VecMonitor(venv)
+    return venv
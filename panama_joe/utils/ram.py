@@ -0,0 +1,79 @@
+"""
+Locations of Montezuma's Revenge game state in the Atari's 128 bytes of RAM (i.e., observations with `obs_type='ram'`).
+"""
+import numpy as np
+
+ROOM = 3
+X = 42
+Y = 43
+LEVEL = 57
+LIVES = 58
+INVENTORY = 65
+ROOM_OBJECTS = 66
+
+N_ROOMS = 24  # Rooms of a level.
+_SCALAR_ADDRESSES = np.array([X, Y, LIVES, LEVEL])
+_SCALAR_RANGES = np.array([255, 255, 5, 8], dtype=np.float32)  # Lives and levels beyond these are clipped.
+_BIT_ADDRESSES = np.array([INVENTORY, ROOM_OBJECTS])
+FEATURE_NAMES = (tuple(f'room_{i:d}' for i in range(N_ROOMS)) + ('x', 'y', 'lives', 'level')
+                 + tuple(f'inventory_{i:d}' for i in range(8)) + tuple(f'room_objects_{i:d}' for i in range(8)))
+N_FEATURES = len(FEATURE_NAMES)
+
+
+def cell_keys(ram, cell_size=(16, 16)):
+    """
+    Map RAM observations to Go-Explore cells: the level, room, inventory and coarse player position, packed into one
+    integer each.
+
+    :param ram: RAM observation(s), of shape `(..., 128)`.
+    :param cell_size: Width and height of the position bins, in pixels.
+    :return: Cell key(s), of shape `ram.shape[:-1]`.
+    """
+    ram = np.asarray(ram).astype(np.uint64)
+    return ((ram[..., LEVEL] << np.uint64(32))
+            | (ram[..., ROOM] << np.uint64(24))
+            | (ram[..., INVENTORY] << np.uint64(16))
+            | ((ram[..., X] // np.uint64(cell_size[0])) << np.uint64(8))
+            | (ram[..., Y] // np.uint64(cell_size[1])))
+
+
+def cell_key(ram, cell_size=(16, 16)):
+    """
+    `cell_keys` of a single RAM observation, computed with plain integers, which is several times faster than numpy
+    for one observation (e.g., on every environment step).
+    """
+    level, room, inventory, x, y = ram[[LEVEL, ROOM, INVENTORY, X, Y]].tolist()
+    return (level << 32) | (room << 24) | (inventory << 16) | ((x // cell_size[0]) << 8) | (y // cell_size[1])
+
+
+def describe_cell(key):
+    """
+    :return: Dictionary of the fields packed into a cell key.
+    """
+    key = int(key)
+    return {
+        'level': (key >> 32) & 0xFF,
+        'room': (key >> 24) & 0xFF,
+        'inventory': (key >> 16) & 0xFF,
+        'x': (key >> 8) & 0xFF,
+        'y': key & 0xFF
+    }
+
+
+def ram_features(ram, out=None):
+    """
+    Decode RAM observations into features in [0, 1]: the room (one-hot), the player's position, lives and level
+    (scaled), and the bits of the inventory and of the room's objects (most significant first). See `FEATURE_NAMES`.
+
+    :param ram: RAM observation(s), of shape `(..., 128)`.
+    :param out: Array in which to write the features, of shape `(..., N_FEATURES)` and dtype `float32`.
+    :return: Features, of shape `ram.shape[:-1] + (N_FEATURES,)`.
+    """
+    ram = np.asarray(ram)
+    if out is None:
+        out = np.empty((*ram.shape[:-1], N_FEATURES), dtype=np.float32)
+    np.equal(ram[..., ROOM, None], np.arange(N_ROOMS), out=out[..., :N_ROOMS])
+    np.minimum(ram[..., _SCALAR_ADDRESSES], _SCALAR_RANGES, out=out[..., N_ROOMS:N_ROOMS + 4])
+    out[..., N_ROOMS:N_ROOMS + 4] /= _SCALAR_RANGES
+    out[..., N_ROOMS + 4:] = np.unpackbits(ram[..., _BIT_ADDRESSES], axis=-1)
+    return out
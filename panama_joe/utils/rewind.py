@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class SnapshotBuffer:
+    """
+    Serialized emulator snapshots, keyed by the number of actions taken, held within a fixed byte budget.
+
+    Snapshots are kept dense near the present and sparse further back: whenever the budget (or the slot capacity) is
+    exceeded, the snapshot whose removal opens the smallest gap relative to its age is dropped. Restoring to step `t`
+    then costs at most the gap around `t` in replayed actions, which grows with the distance rewound rather than with
+    the length of the episode.
+    """
+
+    def __init__(self, budget_bytes=64 * 2**20, capacity=4096):
+        self.budget_bytes = budget_bytes
+        self.capacity = capacity
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.sizes = np.zeros(capacity, dtype=np.int64)
+        self.states = [None] * capacity
+        self.n = 0
+        self.n_bytes = 0
+
+    def __len__(self):
+        return self.n
+
+    def clear(self):
+        self.states[:self.n] = [None] * self.n
+        self.n = 0
+        self.n_bytes = 0
+
+    def push(self, step, state):
+        """
+        :param step: Number of actions taken when `state` was cloned. Must be newer than every stored snapshot.
+        :param state: Serialized emulator state.
+        """
+        if self.n > 0 and step <= self.steps[self.n - 1]:
+            return
+        while self.n > 0 and (self.n == self.capacity or self.n_bytes + len(state) > self.budget_bytes):
+            self._evict()
+        self.steps[self.n] = step
+        self.sizes[self.n] = len(state)
+        self.states[self.n] = state
+        self.n += 1
+        self.n_bytes += len(state)
+
+    def nearest(self, step):
+        """
+        :return: The `(step, state)` of the newest snapshot at or before `step`, or `None`.
+        """
+        i = np.searchsorted(self.steps[:self.n], step, side='right') - 1
+        if i < 0:
+            return None
+        return int(self.steps[i]), self.states[i]
+
+    def truncate(self, step):
+        """
+        Forget every snapshot taken after `step`.
+        """
+        k = int(np.searchsorted(self.steps[:self.n], step, side='right'))
+        self.n_bytes -= int(self.sizes[k:self.n].sum())
+        self.states[k:self.n] = [None] * (self.n - k)
+        self.n = k
+
+    def _evict(self):
+        if self.n <= 2:
+            i = 0
+        else:
+            # Keep the oldest snapshot (the furthest reach) and the newest one (the cheapest restore).
+            steps = self.steps[:self.n]
+            gaps = steps[2:] - steps[:-2]
+            ages = steps[-1] - steps[1:-1]
+            i = 1 + int(np.argmin(gaps / ages))
+        self.n_bytes -= int(self.sizes[i])
+        self.steps[i:self.n - 1] = self.steps[i + 1:self.n]
+        self.sizes[i:self.n - 1] = self.sizes[i + 1:self.n]
+        del self.states[i]
+        self.states.append(None)
+        self.n -= 1
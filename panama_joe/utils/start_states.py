@@ -0,0 +1,108 @@
+"""
+Caches of emulator states along recorded demos, from which to start episodes.
+
+A cache is a directory holding `states.bin` (pickled ALE states, back to back), `index.npy` (one row per state: its
+byte range in `states.bin`, its demo and step, its position along the demo and the game score the demo went on to
+collect from it) and `meta.json`. Both files are opened as memory maps, so every environment process reading the same
+cache shares its pages, and restoring a state never replays demo actions.
+"""
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from panama_joe.utils import demos
+
+FORMAT_VERSION = 1
+INDEX_DTYPE = np.dtype([
+    ('offset', np.int64),
+    ('size', np.int32),
+    ('demo', np.int32),
+    ('step', np.int64),
+    ('position', np.float32),
+    ('score_to_go', np.float32)
+])
+
+_STATES_FILE = 'states.bin'
+_INDEX_FILE = 'index.npy'
+_META_FILE = 'meta.json'
+
+
+def build_start_state_cache(demo_paths, path, atari_env, stride=10):
+    """
+    Replay each demo from its checkpoints and keep every `stride`-th state, up to the demo's last reward (from later
+    states, the demo scores nothing more, so there is nothing to learn to match).
+
+    :param demo_paths: Demos, in either format.
+    :param path: Cache directory, replaced if it exists.
+    :param atari_env: Unwrapped `AtariEnv` with `frameskip=1` on which to replay the demos. Each action is emulated for
+        the demo's own frameskip (see `demos.demo_frameskip`), as when it was recorded.
+    :param stride: Number of steps between cached states.
+    :return: Number of states cached.
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    rows = []
+    offset = 0
+    with open(os.path.join(tmp_path, _STATES_FILE), 'wb') as f:
+        for d, demo_path in enumerate(demo_paths):
+            dat = demos.read_demo(demo_path)
+            actions = np.asarray(dat['actions'], dtype=np.int64)
+            frameskip = dat['frameskip']
+            # Game score only: demos are recorded with the death cost included in their rewards.
+            scores = np.maximum(np.asarray(dat['rewards'], dtype=np.float64), 0)
+            score_to_go = np.cumsum(scores[::-1])[::-1]
+            checkpoints, checkpoint_action_nr = demos.read_checkpoints(demo_path)
+            checkpoint_at = dict(zip(checkpoint_action_nr, checkpoints))
+            atari_env.reset()
+            for step in range(int(np.count_nonzero(score_to_go > 0))):
+                if step in checkpoint_at:
+                    atari_env.restore_state(checkpoint_at[step])  # Avoids drift from replaying.
+                if step % stride == 0:
+                    state = pickle.dumps(atari_env.clone_state())
+                    f.write(state)
+                    rows.append((offset, len(state), d, step, step / len(actions), score_to_go[step]))
+                    offset += len(state)
+                for _ in range(frameskip):
+                    atari_env.ale.act(atari_env._action_set[actions[step]])
+    np.save(os.path.join(tmp_path, _INDEX_FILE), np.array(rows, dtype=INDEX_DTYPE))
+    with open(os.path.join(tmp_path, _META_FILE), 'w') as f:
+        json.dump({
+            'version': FORMAT_VERSION,
+            'stride': stride,
+            'demos': [os.path.basename(demo_path) for demo_path in demo_paths]
+        }, f, indent=2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return len(rows)
+
+
+class StartStateCache:
+    """
+    Read-only, memory-mapped view of a cache written by `build_start_state_cache`.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, _META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'Unsupported start state cache version: {self.meta["version"]}')
+        self.index = np.load(os.path.join(path, _INDEX_FILE), mmap_mode='r')
+        if len(self.index) == 0:
+            raise ValueError(f'Empty start state cache: {path}')
+        self.states = np.memmap(os.path.join(path, _STATES_FILE), dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def state(self, i):
+        """
+        :return: State `i`, to pass to `restore_state`.
+        """
+        row = self.index[i]
+        return pickle.loads(self.states[row['offset']:row['offset'] + row['size']].tobytes())
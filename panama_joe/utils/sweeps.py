@@ -0,0 +1,107 @@
+"""
+Sweeps of `train_baseline` runs over PPO hyperparameters, `make_env` options and seeds.
+
+A sweep is described by a JSON spec, e.g.:
+
+    {
+        "method": "random",
+        "n_samples": 8,
+        "seeds": [0, 1, 2],
+        "train": {"total_timesteps": 20000, "n_envs": 2},
+        "env": {"obs_type": ["ram"], "frameskip": [1, 4], "death_cost": [-10, 0]},
+        "ppo": {"learning_rate": {"low": 1e-5, "high": 1e-3, "log": true}, "n_steps": [128, 256]}
+    }
+
+`train` holds fixed arguments of `train_baseline`. Each value of `env` (passed to `make_env`) and `ppo` (passed to
+`PPO`) is a list of choices or, for random search, a range to sample from (log-uniformly if `log`, as integers if
+both bounds are). Grid search runs every combination of choices; random search draws `n_samples` configurations. Every
+configuration is run with every seed.
+
+Results are appended to the sweep directory's `INDEX_FILE`, one JSON line per run, with its configuration, status,
+metrics and model path.
+"""
+import itertools
+import json
+import os
+
+import numpy as np
+
+SEARCH_METHODS = ('grid', 'random')
+INDEX_FILE = 'index.jsonl'
+_GROUPS = ('env', 'ppo')
+
+
+def sweep_runs(spec, sweep_name, seed=0):
+    """
+    :param spec: Sweep spec (see the module docstring).
+    :param sweep_name: Prefix of the run names.
+    :param seed: Seed of the random search, which is part of its run names, so that searches with other seeds are not
+        mistaken for runs already done.
+    :return: Runs, as dictionaries with the `run_name`, `seed`, `env_kwargs`, `ppo_kwargs` and `train_kwargs` of each.
+    """
+    method = spec.get('method', 'grid')
+    prefix = sweep_name
+    params = [(group, key, value) for group in _GROUPS for key, value in spec.get(group, {}).items()]
+    if method == 'grid':
+        for group, key, value in params:
+            if not isinstance(value, list):
+                raise ValueError(f'Grid search needs a list of values for {group}.{key}, not {value!r}')
+        configs = list(itertools.product(*(value for _, _, value in params)))
+    elif method == 'random':
+        rng = np.random.default_rng(seed)
+        prefix = f'{sweep_name}_r{seed:d}'
+        configs = [tuple(_sample(value, rng) for _, _, value in params) for _ in range(spec.get('n_samples', 10))]
+    else:
+        raise ValueError(f'Unknown search method: {method}')
+
+    runs = []
+    for i, config in enumerate(configs):
+        kwargs = {group: {} for group in _GROUPS}
+        for (group, key, _), value in zip(params, config):
+            kwargs[group][key] = value
+        for run_seed in spec.get('seeds', [0]):
+            runs.append({
+                'run_name': f'{prefix}_{i:03d}_s{run_seed:d}',
+                'seed': run_seed,
+                'env_kwargs': kwargs['env'],
+                'ppo_kwargs': kwargs['ppo'],
+                'train_kwargs': dict(spec.get('train', {}))
+            })
+    return runs
+
+
+def cores_per_run(train_kwargs, threads_per_run=1):
+    """
+    :return: Number of cores a run keeps busy: its PyTorch threads, plus one per environment stepped in a subprocess.
+    """
+    if train_kwargs.get('vec_env', 'dummy') == 'dummy':
+        return threads_per_run
+    return threads_per_run + train_kwargs.get('n_envs', 1)
+
+
+def read_index(path):
+    """
+    :return: Records of the runs in the index at `path`, oldest first.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_to_index(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def _sample(value, rng):
+    if isinstance(value, list):
+        return value[int(rng.integers(len(value)))]
+    if isinstance(value, dict):
+        low, high = value['low'], value['high']
+        if value.get('log', False):
+            return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        if isinstance(low, int) and isinstance(high, int):
+            return int(rng.integers(low, high + 1))
+        return float(rng.uniform(low, high))
+    raise ValueError(f'Expected a list of values or a range, not {value!r}')
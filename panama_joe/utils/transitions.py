@@ -0,0 +1,165 @@
+"""
+Sharded transition datasets built from recorded demos.
+
+A dataset is a directory with an `index.json` and one subdirectory per shard. Each shard holds `.npy` files for the
+columns in `KEYS`, which are opened as memory maps, so batches only read the rows they contain.
+"""
+import json
+import os
+
+import numpy as np
+
+from panama_joe.utils import demos
+
+KEYS = ('obs', 'acts', 'next_obs', 'rews', 'dones')
+FORMAT_VERSION = 1
+
+_INDEX_FILE = 'index.json'
+
+
+def demo_transitions(path):
+    """
+    Transitions of one demo, in order. Each `next_obs` is the successor of its `obs`: time travel while recording
+    erases the steps travelled back over (see `AtariDemo.restore_past_state`), so saved demos hold no rewinds, and
+    losing a life goes on in the same game. Only the last transition is marked done.
+
+    :param path: Demo path, in either format.
+    :return: Dictionary of arrays, keyed by `KEYS`.
+    """
+    dat = demos.read_demo(path)
+    n = min(len(dat['actions']), len(dat['rewards']), len(dat['obs']) - 1)
+    dones = np.zeros(n, dtype=bool)
+    if n > 0:
+        dones[-1] = True
+    return {
+        'obs': dat['obs'][:n],
+        'acts': np.asarray(dat['actions'][:n], dtype=np.int64),
+        'next_obs': dat['obs'][1:n + 1],
+        'rews': np.asarray(dat['rewards'][:n], dtype=np.float32),
+        'dones': dones
+    }
+
+
+class ShardWriter:
+    """
+    Accumulates transitions in a preallocated buffer of `shard_size` rows and writes each full buffer as a shard.
+    """
+
+    def __init__(self, path, shard_size=65536):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.buffer = None
+        self.n_buffered = 0
+        self.shards = []
+
+    def extend(self, transitions):
+        if self.buffer is None:
+            self.buffer = {key: np.empty((self.shard_size, *value.shape[1:]), dtype=value.dtype)
+                           for key, value in transitions.items()}
+        n = len(transitions['acts'])
+        start = 0
+        while start < n:
+            count = min(n - start, self.shard_size - self.n_buffered)
+            for key, value in transitions.items():
+                if value.shape[1:] != self.buffer[key].shape[1:]:
+                    raise ValueError(f'Inconsistent shape for `{key}`: {value.shape[1:]} != {self.buffer[key].shape[1:]}')
+                self.buffer[key][self.n_buffered:self.n_buffered + count] = value[start:start + count]
+            self.n_buffered += count
+            start += count
+            if self.n_buffered == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        name = f'shard_{len(self.shards):05d}'
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        for key, value in self.buffer.items():
+            np.save(os.path.join(self.path, name, key + '.npy'), value[:self.n_buffered])
+        self.shards.append({'name': name, 'length': self.n_buffered})
+        self.n_buffered = 0
+
+    def close(self, **meta):
+        self.flush()
+        with open(os.path.join(self.path, _INDEX_FILE), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'shards': self.shards, **meta}, f, indent=2)
+
+
+def build_dataset(demo_paths, path, n_actions, shard_size=65536):
+    """
+    Stream the transitions of each demo into a sharded dataset at `path`. Only one demo and one shard are held in
+    memory at a time.
+
+    :param n_actions: Number of game actions, recorded in the index.
+    :return: Number of transitions written.
+    """
+    writer = ShardWriter(path, shard_size=shard_size)
+    n = 0
+    for demo_path in demo_paths:
+        transitions = demo_transitions(demo_path)
+        writer.extend(transitions)
+        n += len(transitions['acts'])
+    writer.close(demos=[os.path.basename(demo_path) for demo_path in demo_paths], n_actions=n_actions)
+    return n
+
+
+class TransitionDataset:
+    """
+    Memory-mapped view of a dataset written by `build_dataset`.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, _INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.shards = [{key: np.load(os.path.join(path, shard['name'], key + '.npy'), mmap_mode='r') for key in KEYS}
+                       for shard in self.index['shards']]
+
+    def __len__(self):
+        return sum(shard['length'] for shard in self.index['shards'])
+
+    def batches(self, batch_size, shuffle=True, seed=None):
+        return TransitionBatches(self, batch_size, shuffle=shuffle, seed=seed)
+
+
+class TransitionBatches:
+    """
+    Re-iterable sequence of full batches (dictionaries keyed by `KEYS`), e.g. as the `demonstrations` of
+    `imitation.algorithms.bc.BC` or `imitation.algorithms.adversarial.gail.GAIL` with a matching batch size.
+    Each pass visits the shards in a random order and the rows within each shard in a random order, so only the pages
+    behind the current batch are read.
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=True, seed=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.dataset) // self.batch_size
+
+    def __iter__(self):
+        shards = self.dataset.shards
+        order = self.rng.permutation(len(shards)) if self.shuffle else np.arange(len(shards))
+        carry = None
+        for s in order:
+            shard = shards[s]
+            n = len(shard['acts'])
+            indices = self.rng.permutation(n) if self.shuffle else np.arange(n)
+            start = 0
+            if carry is not None:
+                start = min(n, self.batch_size - len(carry['acts']))
+                rows = np.sort(indices[:start])
+                carry = {key: np.concatenate([carry[key], shard[key][rows]]) for key in KEYS}
+                if len(carry['acts']) < self.batch_size:
+                    continue
+                yield carry
+                carry = None
+            while start + self.batch_size <= n:
+                rows = np.sort(indices[start:start + self.batch_size])  # Sorted for locality of reads.
+                yield {key: shard[key][rows] for key in KEYS}
+                start += self.batch_size
+            if start < n:
+                rows = np.sort(indices[start:])
+                carry = {key: shard[key][rows] for key in KEYS}
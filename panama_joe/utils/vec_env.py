@@ -0,0 +1,118 @@
+import functools
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.error import AlreadyPendingCallError
+from gymnasium.vector.async_vector_env import AsyncState
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import VecEnv
+
+
+class GymnasiumVecEnv(VecEnv):
+    """
+    Exposes a gymnasium `AsyncVectorEnv` (e.g. with shared memory) through the stable-baselines3 `VecEnv` interface, so
+    that it can be handed to `PPO`.
+
+    Attributes and methods of some environments only (`indices`) are reached by sending the workers' own commands to
+    those environments' pipes, as gymnasium only addresses all of them at once. `env_is_wrapped` requires environments
+    made by `worker_env_fn`, since wrappers live in the workers and cannot be inspected from here.
+    """
+
+    def __init__(self, venv):
+        self.venv = venv
+        super(GymnasiumVecEnv, self).__init__(venv.num_envs, venv.single_observation_space, venv.single_action_space)
+
+    def reset(self):
+        obs, infos = self.venv.reset(seed=self._seeds)
+        self.reset_infos = _split_infos(infos, self.num_envs)
+        self._reset_seeds()
+        return obs
+
+    def step_async(self, actions):
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        obs, rewards, terminated, truncated, infos = self.venv.step_wait()
+        dones = np.logical_or(terminated, truncated)
+        step_infos = _split_infos(infos, self.num_envs)
+        for i in np.flatnonzero(dones):
+            # On auto-reset, gymnasium reports the reset info at the top level and moves the final step's
+            # observation and info aside. Stable-baselines3 expects the opposite.
+            self.reset_infos[i] = step_infos[i]
+            step_infos[i] = dict(infos['final_info'][i])
+            step_infos[i]['terminal_observation'] = infos['final_observation'][i]
+            step_infos[i]['TimeLimit.truncated'] = bool(truncated[i] and not terminated[i])
+        return obs, rewards.astype(np.float32), dones, step_infos
+
+    def close(self):
+        self.venv.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return self._send('_call', {i: (attr_name, (), {}) for i in self._get_indices(indices)})
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._send('_setattr', {i: (attr_name, value) for i in self._get_indices(indices)})
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._send('_call', {i: (method_name, method_args, method_kwargs) for i in self._get_indices(indices)})
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self.env_method('is_wrapped', wrapper_class, indices=indices)
+
+    def _send(self, command, data):
+        """
+        Send a command of `AsyncVectorEnv`'s worker protocol ('_call' or '_setattr') to the environments in `data`, each
+        with its own data, and gather their replies. Unlike `AsyncVectorEnv.call`, other environments are left alone.
+
+        :param data: Data of the command, by index of environment.
+        :return: Replies, in the order of `data`.
+        """
+        self.venv._assert_is_running()
+        if self.venv._state != AsyncState.DEFAULT:
+            raise AlreadyPendingCallError(f'Calling `{command}` while waiting for a pending call to complete',
+                                          self.venv._state.value)
+        pipes = self.venv.parent_pipes
+        for i, item in data.items():
+            pipes[i].send((command, item))
+        replies = {i: pipes[i].recv() for i in data}
+        # Errors are raised as by `AsyncVectorEnv`, which expects a success flag for each environment.
+        self.venv._raise_if_errors([replies[i][1] if i in replies else True for i in range(self.num_envs)])
+        return [replies[i][0] for i in data]
+
+    def get_images(self):
+        return list(self.venv.call('render'))
+
+
+class WorkerEnv(gym.Wrapper):
+    """
+    Outermost wrapper of the environments of a `GymnasiumVecEnv`, which answers `env_is_wrapped` in the worker.
+    """
+
+    def is_wrapped(self, wrapper_class):
+        return is_wrapped(self.env, wrapper_class)
+
+
+def worker_env_fn(env_fn):
+    """
+    :return: Function making `env_fn`'s environment, wrapped in a `WorkerEnv`.
+    """
+    return functools.partial(_make_worker_env, env_fn)
+
+
+def _make_worker_env(env_fn):
+    return WorkerEnv(env_fn())
+
+
+def _split_infos(infos, num_envs):
+    """
+    Convert gymnasium's dict of per-key arrays (with `_key` presence masks) to a list of per-environment dicts.
+    """
+    split = [{} for _ in range(num_envs)]
+    for key, values in infos.items():
+        if key.startswith('_') or key in ('final_observation', 'final_info'):
+            continue
+        mask = infos.get('_' + key)
+        for i in range(num_envs):
+            if mask is None or mask[i]:
+                split[i][key] = values[i]
+    return split
@@ -0,0 +1,113 @@
+"""
+Reward shaping and observation features applied to whole batches of vectorized environments, instead of by a wrapper
+in each environment. Per-environment state is kept in arrays, and each step is processed with a few numpy operations,
+whatever the number of environments.
+"""
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+from panama_joe.utils import ram
+from panama_joe.utils.lives_buffer import RESET, STEP
+
+
+class VecShapingWrapper(VecEnvWrapper):
+    """
+    Base class of batched reward shaping terms. Subclasses keep per-environment state in arrays, (re)initialize it in
+    `reset_state` when environments start an episode, and implement `shape`. Meant to wrap the vectorized environment
+    directly (beneath `VecMonitor`, as per-environment wrappers would be), so that `reset_infos` are those of the
+    environments' current episodes.
+    """
+
+    def reset(self):
+        obs = self.venv.reset()
+        self.reset_infos = self.venv.reset_infos
+        self.reset_state(np.arange(self.num_envs))
+        return obs
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        self.reset_infos = self.venv.reset_infos
+        rewards = self.shape(rewards, dones, infos)
+        if dones.any():
+            self.reset_state(np.flatnonzero(dones))  # Done environments were reset automatically.
+        return obs, rewards, dones, infos
+
+    def reset_state(self, indices):
+        """
+        Initialize the state of environments `indices` from their `reset_infos`.
+        """
+        raise NotImplementedError
+
+    def shape(self, rewards, dones, infos):
+        """
+        :param rewards: Rewards of the step, which may be modified in place.
+        :return: Shaped rewards.
+        """
+        raise NotImplementedError
+
+
+class VecDeathCost(VecShapingWrapper):
+    """
+    Batched `DeathCostWrapper`: adds `death_cost` to the reward of each environment which lost a life. Lives are NaN
+    where unknown, which never counts as losing one.
+
+    Lives are read from a `LivesBuffer` which the environments write to (made with `make_env(lives_buffer=...)`, see
+    `make_vec_env`), so that no Python code runs per environment; without one, they are read from each environment's
+    info.
+    """
+
+    def __init__(self, venv, death_cost=-10, lives_buffer=None):
+        super(VecDeathCost, self).__init__(venv)
+        self.death_cost = np.float32(death_cost)
+        self.buffer = lives_buffer
+        self.lives = np.full(self.num_envs, np.nan)
+
+    def reset_state(self, indices):
+        if self.buffer is not None:
+            self.lives[indices] = self.buffer.lives[RESET, indices]
+        else:
+            self.lives[indices] = [self.reset_infos[i].get('lives', np.nan) for i in indices]
+
+    def shape(self, rewards, dones, infos):
+        # Copied, as environments overwrite the buffer on their next step.
+        lives = self.buffer.lives[STEP].copy() if self.buffer is not None else info_array(infos, 'lives')
+        rewards[lives < self.lives] += self.death_cost
+        self.lives = lives
+        return rewards
+
+
+class VecRamFeatures(VecEnvWrapper):
+    """
+    Batched `RamFeatureWrapper`: decodes the RAM observations of all environments at once. Each batch of features is
+    a new array, as algorithms keep the last one while stepping (e.g., `PPO.collect_rollouts`).
+    """
+
+    def __init__(self, venv):
+        if venv.observation_space.shape != (128,):
+            raise ValueError(f'RAM features require RAM observations, not shape {venv.observation_space.shape}')
+        super(VecRamFeatures, self).__init__(
+            venv,
+            observation_space=spaces.Box(low=0.0, high=1.0, shape=(ram.N_FEATURES,), dtype=np.float32)
+        )
+
+    def reset(self):
+        obs = self.venv.reset()
+        self.reset_infos = self.venv.reset_infos
+        return ram.ram_features(obs)
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        self.reset_infos = self.venv.reset_infos
+        # The last observations of done environments are decoded too, as policies are evaluated on them.
+        for i in np.flatnonzero(dones):
+            if 'terminal_observation' in infos[i]:
+                infos[i]['terminal_observation'] = ram.ram_features(infos[i]['terminal_observation'])
+        return ram.ram_features(obs), rewards, dones, infos
+
+
+def info_array(infos, key):
+    """
+    :return: Float array of `info[key]` for each environment's info, NaN where it is missing.
+    """
+    return np.array([info.get(key, np.nan) for info in infos], dtype=np.float64)
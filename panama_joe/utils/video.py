@@ -0,0 +1,125 @@
+"""
+Recording of episodes to video files on a background thread, so that encoding never slows down the episodes.
+"""
+import heapq
+import os
+import queue
+import threading
+
+VIDEO_KEEP = ('all', 'best', 'worst')
+
+
+class VideoRecorder:
+    """
+    Frames are handed to an encoder thread through a queue holding at most `max_pending` frames. When it is full,
+    `add_frame` drops the frame instead of waiting. Videos are written with `imageio` (installed with
+    `gymnasium[other]`), one file per episode.
+    """
+
+    def __init__(self, video_dir, fps=60, keep='all', k=5, max_pending=256):
+        """
+        :param video_dir: Directory in which to write videos.
+        :param fps: Frames per second of the videos.
+        :param keep: Which videos to keep: those of all episodes, or those of the `k` best or worst episodes by score.
+        :param k: Number of videos to keep, unless `keep` is 'all'.
+        :param max_pending: Maximum number of frames waiting to be encoded.
+        """
+        if keep not in VIDEO_KEEP:
+            raise ValueError(f'Unknown videos to keep: {keep}')
+        import imageio  # Only needed to record videos.
+        self.imageio = imageio
+        self.video_dir = video_dir
+        self.fps = fps
+        self.keep = keep
+        self.k = k
+        self.n_dropped = 0
+        self.kept = []  # Heap of (rank, path) of the videos kept so far, the first to be deleted on top.
+        self.error = None
+        self.queue = queue.SimpleQueue()
+        self.pending = threading.Semaphore(max_pending)
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def start_episode(self, file_name):
+        """
+        :return: Path of the episode's video.
+        """
+        path = os.path.join(self.video_dir, file_name)
+        self.queue.put(('start', path))
+        return path
+
+    def add_frame(self, frame):
+        """
+        :param frame: RGB frame, which must not be modified afterwards.
+        :return: Whether the frame was queued (rather than dropped).
+        """
+        if not self.pending.acquire(blocking=False):
+            self.n_dropped += 1
+            return False
+        self.queue.put(('frame', frame))
+        return True
+
+    def end_episode(self, score):
+        self.queue.put(('end', score))
+
+    def close(self):
+        """
+        Wait for every queued frame to be encoded.
+        """
+        self.queue.put(('close', None))
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _encode(self):
+        writer, path = None, None
+        while True:
+            kind, value = self.queue.get()
+            try:
+                if kind == 'frame':
+                    if writer is not None:
+                        writer.append_data(value)
+                elif kind == 'start':
+                    path = value
+                    writer = self.imageio.get_writer(path, fps=self.fps, macro_block_size=1)
+                elif kind == 'end':
+                    if writer is not None:
+                        writer.close()
+                        writer = None
+                        self._retain(path, value)
+                else:
+                    break
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+                writer = None
+            finally:
+                if kind == 'frame':
+                    self.pending.release()
+
+    def _retain(self, path, score):
+        if self.keep == 'all':
+            return
+        rank = score if self.keep == 'best' else -score
+        heapq.heappush(self.kept, (rank, path))
+        if len(self.kept) > self.k:
+            _, path = heapq.heappop(self.kept)
+            os.remove(path)
+
+
+def prune_videos(records, keep='all', k=5):
+    """
+    Delete the videos of all but the `k` best or worst of `records` (episode records with `return` and `video` paths,
+    possibly from several recorders) and clear their `video` field.
+    """
+    if keep not in VIDEO_KEEP:
+        raise ValueError(f'Unknown videos to keep: {keep}')
+    if keep == 'all':
+        return
+    recorded = [record for record in records if record.get('video') is not None and os.path.exists(record['video'])]
+    recorded.sort(key=lambda record: record['return'], reverse=(keep == 'best'))
+    for record in recorded[k:]:
+        os.remove(record['video'])
+    for record in records:
+        if record.get('video') is not None and not os.path.exists(record['video']):
+            record['video'] = None
@@ -1,28 +1,47 @@
+import collections
+import functools
+import math
 import os
 import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import gymnasium as gym
+import numpy as np
 from gymnasium import spaces
 from shimmy.atari_env import AtariEnv
 
+from panama_joe.utils import demo_catalog, demos, lives_buffer, ram
+from panama_joe.utils.counts import SimHash
+from panama_joe.utils.demo_replay import DemoObservations, ObservationList, RoomList, replay_actions_ram
+from panama_joe.utils.rewind import SnapshotBuffer
+
 
 class AtariDemo(gym.Wrapper):
     """
     Records actions taken, creates checkpoints, allows time travel, restoring and saving of states
     """
 
-    def __init__(self, env, demos_dir='.', disable_time_travel=False):
+    def __init__(self, env, demos_dir='.', disable_time_travel=False, demo_format='pickle', rewind_every_k=10,
+                 rewind_budget_bytes=64 * 2**20, save_in_background=False):
         super(AtariDemo, self).__init__(env)
-        self.action_space = spaces.Discrete(len(env.unwrapped.get_action_meanings()) + 2)  # "save" and "time travel"
+        self.n_actions = len(env.unwrapped.get_action_meanings())
+        self.action_space = spaces.Discrete(self.n_actions + 2)  # "save" and "time travel"
         self.demos_dir = demos_dir
+        self.demo_suffix = demos.DEMO_FORMAT_SUFFIXES[demo_format]
         self.save_every_k = 100
         self.steps_in_the_past = 0
         self.max_time_travel_steps = 10000
         self.disable_time_travel = disable_time_travel
+        self.rewind_every_k = rewind_every_k
+        self.rewind = SnapshotBuffer(budget_bytes=rewind_budget_bytes)  # Snapshots for restoring after time travel.
+        self.executor = ThreadPoolExecutor(max_workers=1) if save_in_background else None
+        self.pending = None
 
+        self.initial_state = None
         self.actions = None
         self.lives = None
+        self.rooms = None
         self.checkpoints = None
         self.checkpoint_action_nr = None
         self.obs = None
@@ -32,7 +51,7 @@ class AtariDemo(gym.Wrapper):
         self.info = None
 
     def step(self, action):
-        if action == len(self.env.unwrapped.get_action_meanings()) + 1:  # 't': time travel
+        if action == self.n_actions + 1:  # 't': time travel
             if self.disable_time_travel:
                 obs, reward, terminated, truncated, info = self.env.step(0)
             else:
@@ -49,36 +68,41 @@ class AtariDemo(gym.Wrapper):
                 truncated = self.truncated[-1]
                 info = None
 
+            elif action == self.n_actions:  # 's': save
+                # The emulator is not stepped, so that replaying the recorded actions reproduces the demo.
+                stamp = int(time.time())
+                self.save_to_file(str(stamp) + self.demo_suffix)
+                return self.obs[-1], 0, False, False, self.info[-1]
+
             else:
                 atari_env = self.env.unwrapped
                 assert isinstance(atari_env, AtariEnv)
                 self.lives.append(atari_env.ale.lives())
-
-                if action == len(atari_env.get_action_meanings()):  # 's': save
-                    obs, reward, terminated, truncated, info = self.env.step(0)
-                    stamp = int(time.time())
-                    self.save_to_file(str(stamp) + '.demo')
-                else:
-                    obs, reward, terminated, truncated, info = self.env.step(action)
-                    self.actions.append(action)
-                    self.obs.append(obs)
-                    self.rewards.append(reward)
-                    self.terminated.append(terminated)
-                    self.truncated.append(truncated)
-                    self.info.append(info)
+                obs, reward, terminated, truncated, info = self.env.step(action)
+                self.rooms.append(int(atari_env.ale.getRAM()[ram.ROOM]))
+                self.actions.append(action)
+                self.obs.append(obs)
+                self.rewards.append(reward)
+                self.terminated.append(terminated)
+                self.truncated.append(truncated)
+                self.info.append(info)
 
             # periodic checkpoint saving
             if not terminated and not truncated:
                 if (len(self.checkpoint_action_nr) > 0 and len(self.actions) >= self.checkpoint_action_nr[-1] + self.save_every_k) \
                         or (len(self.checkpoint_action_nr) == 0 and len(self.actions) >= self.save_every_k):
                     self.save_checkpoint()
+                if len(self.actions) % self.rewind_every_k == 0:
+                    self.save_rewind_snapshot()
 
         return obs, reward, terminated, truncated, info
 
     def reset(self, seed=None, options=None):
         obs = self.env.reset(seed=seed)
+        self.initial_state = self.env.unwrapped.clone_state()
         self.actions = []
         self.lives = []
+        self.rooms = []
         self.checkpoints = []
         self.checkpoint_action_nr = []
         self.obs = [obs]
@@ -87,6 +111,8 @@ class AtariDemo(gym.Wrapper):
         self.truncated = [False]
         self.info = [None]
         # self.steps_in_the_past = 0
+        self.rewind.clear()
+        self.save_rewind_snapshot()
         return obs
 
     def time_travel(self):
@@ -97,6 +123,7 @@ class AtariDemo(gym.Wrapper):
             self.truncated.pop()
             self.info.pop()
             self.lives.pop()
+            self.rooms.pop()
             obs = self.obs[-1]
             terminated = self.terminated[-1]
             truncated = self.truncated[-1]
@@ -116,30 +143,126 @@ class AtariDemo(gym.Wrapper):
         return obs, reward, terminated, truncated, info
 
     def save_to_file(self, file_name):
-        dat = {
-            'actions': self.actions,
-            'checkpoints': self.checkpoints,
-            'checkpoint_action_nr': self.checkpoint_action_nr,
-            'obs': self.obs,
-            'rewards': self.rewards,
-            'lives': self.lives
-        }
+        """
+        Save the demo so far to `file_name` in the demos directory, in the format of its suffix, and add it to the
+        directory's catalog. With `save_in_background`, the demo is copied and written by a background thread, one demo
+        at a time, while recording goes on.
+        """
         path = os.path.join(self.demos_dir, file_name)
-        with open(path, "wb") as f:
-            pickle.dump(dat, f)
+        atari_env = self.env.unwrapped
+        checkpoints, checkpoint_action_nr = list(self.checkpoints), list(self.checkpoint_action_nr)
+        if file_name.endswith(demos.ACTIONS_SUFFIX):
+            if atari_env._frameskip != 1 or atari_env.ale.getFloat('repeat_action_probability') != 0:
+                raise ValueError('Action-only demos can only be replayed without frameskip and sticky actions')
+            if len(checkpoint_action_nr) == 0 or checkpoint_action_nr[0] != 0:
+                checkpoints, checkpoint_action_nr = [self.initial_state] + checkpoints, [0] + checkpoint_action_nr
+            obs = [self.obs[0]]  # Only the first is saved.
+        else:
+            obs = list(self.obs)
+        demo = {
+            'actions': list(self.actions),
+            'rewards': list(self.rewards),
+            'lives': list(self.lives),
+            'rooms': list(self.rooms),
+            'obs': obs,
+            'checkpoints': checkpoints,
+            'checkpoint_action_nr': checkpoint_action_nr
+        }
+        if self.executor is None:
+            self._write_demo(path, demo, atari_env._obs_type, atari_env._frameskip)
+            return
+        self.wait_for_save()
+        self.pending = self.executor.submit(self._write_demo, path, demo, atari_env._obs_type, atari_env._frameskip)
+
+    def wait_for_save(self):
+        """
+        Wait for the demo being saved in the background, if any, and raise its error, if any.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.wait_for_save()
+            self.executor.shutdown()
+        super(AtariDemo, self).close()
+
+    def _write_demo(self, path, demo, obs_type, frameskip):
+        if path.endswith(demos.ACTIONS_SUFFIX):
+            demos.write_action_demo(path,
+                                    demo['actions'],
+                                    demo['rewards'],
+                                    demo['lives'],
+                                    demo['obs'][0],
+                                    obs_type,
+                                    demo['checkpoints'],
+                                    demo['checkpoint_action_nr'])
+        elif path.endswith(demos.COLUMNAR_SUFFIX):
+            demos.write_demo(path,
+                             demo['actions'],
+                             demo['rewards'],
+                             demo['lives'],
+                             demo['obs'],
+                             demo['checkpoints'],
+                             demo['checkpoint_action_nr'],
+                             frameskip=frameskip)
+        else:
+            dat = {key: demo[key] for key in ('actions', 'checkpoints', 'checkpoint_action_nr', 'obs', 'rewards',
+                                              'lives')}
+            dat['frameskip'] = frameskip
+            with open(path, "wb") as f:
+                pickle.dump(dat, f)
+        demo_catalog.update(self.demos_dir, *demo_catalog.demo_record(path,
+                                                                      demo['actions'],
+                                                                      demo['rewards'],
+                                                                      demo['lives'],
+                                                                      demo['rooms'],
+                                                                      len(demo['checkpoints']),
+                                                                      obs_type=obs_type,
+                                                                      frameskip=frameskip))
 
     def load_from_file(self, file_name):
         obs = self.reset()
         path = os.path.join(self.demos_dir, file_name)
-        with open(path, "rb") as f:
-            dat = pickle.load(f)
-        self.actions = dat['actions']
-        self.checkpoints = dat['checkpoints']
-        self.checkpoint_action_nr = dat['checkpoint_action_nr']
-        self.obs = dat['obs']
-        self.rewards = dat['rewards']
-        self.lives = dat['lives']
+        if demos.is_columnar(path):
+            demo = demos.ColumnarDemo(path)
+            self.actions = demo.actions.tolist()
+            self.checkpoints, self.checkpoint_action_nr = demo.load_checkpoints()
+            if demo.actions_only:
+                self.obs = ObservationList(DemoObservations(demo))  # Regenerated when read.
+            else:
+                self.obs = list(demo.obs)  # Views of the memory map; rows are only read from disk when used.
+            self.rewards = demo.rewards.tolist()
+            self.lives = demo.lives.tolist()
+            frameskip = demos.demo_frameskip(demo.attributes)
+            ram_obs = None if demo.actions_only or demo.obs.shape[1:] != (128,) else demo.obs
+        else:
+            with open(path, "rb") as f:
+                dat = pickle.load(f)
+            self.actions = dat['actions']
+            self.checkpoints = dat['checkpoints']
+            self.checkpoint_action_nr = dat['checkpoint_action_nr']
+            self.obs = dat['obs']
+            self.rewards = dat['rewards']
+            self.lives = dat['lives']
+            frameskip = demos.demo_frameskip(dat)
+            ram_obs = self.obs if len(self.obs) > 1 and np.shape(self.obs[1]) == (128,) else None
+        n = len(self.actions)
+        if ram_obs is not None:
+            self.rooms = [int(obs[ram.ROOM]) for obs in ram_obs[1:n + 1]]
+        else:
+            # Only needed to catalog the demo when it is saved again, so only found by replaying it then.
+            replay = functools.partial(_replay_rooms, list(self.actions), list(self.checkpoints),
+                                       list(self.checkpoint_action_nr), frameskip)
+            self.rooms = RoomList(replay, n)
+        # Recorded steps were neither terminal nor truncated (recording stops at the end of an episode).
+        self.terminated = [False] * len(self.obs)
+        self.truncated = [False] * len(self.obs)
+        self.info = [None] * len(self.obs)
+        self.rewind.clear()
         self.load_state_and_walk_forward()
+        self.save_rewind_snapshot()
         return obs
 
     def save_checkpoint(self):
@@ -147,16 +270,25 @@ class AtariDemo(gym.Wrapper):
         self.checkpoints.append(chk_pnt)
         self.checkpoint_action_nr.append(len(self.actions))
 
+    def save_rewind_snapshot(self):
+        state = pickle.dumps(self.env.unwrapped.clone_state())
+        self.rewind.push(len(self.actions), state)
+
     def restore_past_state(self):
-        self.actions = self.actions[:-self.steps_in_the_past]
+        del self.actions[max(0, len(self.actions) - self.steps_in_the_past):]
         while len(self.checkpoints) > 0 and self.checkpoint_action_nr[-1] > len(self.actions):
             self.checkpoints.pop()
             self.checkpoint_action_nr.pop()
+        self.rewind.truncate(len(self.actions))
         self.load_state_and_walk_forward()
         self.steps_in_the_past = 0
 
     def load_state_and_walk_forward(self):
-        if len(self.checkpoints) == 0:
+        snapshot = self.rewind.nearest(len(self.actions))
+        if snapshot is not None and (len(self.checkpoints) == 0 or snapshot[0] >= self.checkpoint_action_nr[-1]):
+            time_step, state = snapshot
+            self.env.unwrapped.restore_state(pickle.loads(state))
+        elif len(self.checkpoints) == 0:
             self.env.reset()
             time_step = 0
         else:
@@ -167,6 +299,17 @@ class AtariDemo(gym.Wrapper):
             action = self.env.unwrapped._action_set[a]
             self.env.unwrapped.ale.act(action)
 
+        # Wrappers beneath which the state was restored must not count lives lost (or regained) by restoring it.
+        env = self.env
+        while isinstance(env, gym.Wrapper):
+            if isinstance(env, DeathCostWrapper):
+                env.lives = self.env.unwrapped.ale.lives()
+            env = env.env
+
+
+def _replay_rooms(actions, checkpoints, checkpoint_action_nr, frameskip):
+    return replay_actions_ram(actions, checkpoints, checkpoint_action_nr, frameskip=frameskip)[:, ram.ROOM]
+
 
 class DeathCostWrapper(gym.Wrapper):
 
@@ -175,6 +318,11 @@ class DeathCostWrapper(gym.Wrapper):
         self.death_cost = death_cost
         self.lives = None
 
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self.lives = info['lives']  # Episodes may start from a state with fewer lives (see `DemoStartWrapper`).
+        return obs, info
+
     def step(self, action):
         obs, reward, terminated, truncated, info = self.env.step(action)
         lives = info['lives']
@@ -182,3 +330,275 @@ class DeathCostWrapper(gym.Wrapper):
             reward += self.death_cost
         self.lives = lives
         return obs, reward, terminated, truncated, info
+
+
+class LivesWrapper(gym.Wrapper):
+    """
+    Writes the lives after each step and after each reset to column `index` of a `lives_buffer.LivesBuffer` (in its
+    `STEP` and `RESET` rows), for batched reward shaping (see `vec_wrappers.VecDeathCost`).
+    """
+
+    def __init__(self, env, buffer, index):
+        super(LivesWrapper, self).__init__(env)
+        self.buffer = buffer  # Keeps the shared memory open.
+        self.lives = buffer.lives
+        self.index = index
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self.lives[lives_buffer.RESET, self.index] = info['lives']
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.lives[lives_buffer.STEP, self.index] = info['lives']
+        return obs, reward, terminated, truncated, info
+
+
+class CountBonusWrapper(gym.Wrapper):
+    """
+    Adds an exploration bonus of `bonus / sqrt(n)` to the reward of each step, where `n` is the number of visits of the
+    state reached, counted in a `counts.CountTable` which may be shared with environments in other processes. States
+    are keyed by the Go-Explore cell of the emulator's RAM ('cells'), whatever the observations, or by a
+    `counts.SimHash` of the observations ('simhash'). The bonus is also returned as `info['count_bonus']`.
+    """
+
+    def __init__(self, env, table, bonus=1.0, keys='cells'):
+        super(CountBonusWrapper, self).__init__(env)
+        self.table = table
+        self.bonus = bonus
+        if keys == 'cells':
+            self.ale = env.unwrapped.ale
+            self.state_key = self._cell_key
+        elif keys == 'simhash':
+            self.state_key = SimHash(env.observation_space.shape)
+        else:
+            raise ValueError(f'Unknown state keys: {keys}')
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        bonus = self.bonus / math.sqrt(self.table.increment(self.state_key(obs)))
+        info['count_bonus'] = bonus
+        return obs, reward + bonus, terminated, truncated, info
+
+    def _cell_key(self, obs):
+        return ram.cell_key(self.ale.getRAM())
+
+
+class DemoStartWrapper(gym.Wrapper):
+    """
+    Starts episodes from states along recorded demos (see `start_states.StartStateCache`), backward-curriculum style:
+    first from states near the ends of the demos, then from earlier and earlier states as the agent learns to match
+    the demos' score from them. Meant to wrap the base environment directly, beneath any other wrapper.
+
+    An episode succeeds once its game score reaches the score the demo collected from its start state. Whenever the
+    success rate over the last `n_episodes` reaches `success_threshold`, the window of start positions (fractions of
+    a demo's length) moves back by `step_size`, until it includes the start of the game.
+    """
+
+    def __init__(self, env, cache, window=0.1, step_size=0.05, success_threshold=0.2, n_episodes=20):
+        super(DemoStartWrapper, self).__init__(env)
+        self.cache = cache
+        self.window = window
+        self.step_size = step_size
+        self.success_threshold = success_threshold
+        self.positions = np.array(cache.index['position'])
+        self.scores_to_go = np.array(cache.index['score_to_go'])
+        self.position = 1.0  # End of the window of start positions.
+        self.results = collections.deque(maxlen=n_episodes)
+        self.score = 0.0
+        self.target = None
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        starts = np.flatnonzero((self.positions >= self.position - self.window) & (self.positions <= self.position))
+        if len(starts) == 0:  # The states nearest the window, of any demo (caches are never empty).
+            distances = np.abs(self.positions - self.position)
+            starts = np.flatnonzero(distances == distances.min())
+        i = int(starts[self.np_random.integers(len(starts))])
+        atari_env = self.env.unwrapped
+        atari_env.restore_state(self.cache.state(i))
+        self.score = 0.0
+        self.target = float(self.scores_to_go[i])
+        obs, info = atari_env._get_obs(), atari_env._get_info()
+        info['start_position'] = float(self.positions[i])
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        if self.target is not None:
+            self.score += max(0.0, float(reward))
+            if self.score >= self.target:
+                self._end_attempt(True)
+            elif terminated or truncated:
+                self._end_attempt(False)
+        return obs, reward, terminated, truncated, info
+
+    def _end_attempt(self, success):
+        self.target = None
+        self.results.append(success)
+        if len(self.results) == self.results.maxlen and np.mean(self.results) >= self.success_threshold:
+            self.position = max(0.0, self.position - self.step_size)
+            self.results.clear()
+
+
+class MaxAndSkipWrapper(gym.Wrapper):
+    """
+    Repeats each action `skip` times, summing the rewards, and returns the pixel-wise maximum of the last two frames,
+    since Atari sprites flicker between frames. Meant to wrap an environment created with `frameskip=1`.
+    """
+
+    def __init__(self, env, skip=4):
+        super(MaxAndSkipWrapper, self).__init__(env)
+        self.skip = skip
+        self.previous = np.zeros(env.observation_space.shape, dtype=env.observation_space.dtype)
+        self.obs = np.zeros(env.observation_space.shape, dtype=env.observation_space.dtype)
+
+    def step(self, action):
+        total_reward = 0
+        for i in range(self.skip):
+            obs, reward, terminated, truncated, info = self.env.step(action)
+            total_reward += reward
+            if i == self.skip - 2:
+                self.previous[...] = obs
+            if terminated or truncated:
+                break
+        if self.skip > 1 and i == self.skip - 1:
+            np.maximum(self.previous, obs, out=self.obs)
+        else:
+            self.obs[...] = obs
+        return self.obs, total_reward, terminated, truncated, info
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self.obs[...] = obs
+        return self.obs, info
+
+
+class PreprocessFrameWrapper(gym.ObservationWrapper):
+    """
+    Resizes RGB frames to `screen_size` x `screen_size` (nearest neighbor) and optionally converts them to grayscale,
+    in place in preallocated `uint8` buffers. The observation has shape `(screen_size, screen_size, 1 or 3)`.
+    """
+
+    def __init__(self, env, screen_size=84, grayscale=True):
+        super(PreprocessFrameWrapper, self).__init__(env)
+        height, width, channels = env.observation_space.shape
+        self.grayscale = grayscale
+        self.rows = ((np.arange(screen_size) + 0.5) * height / screen_size).astype(np.intp)
+        self.cols = ((np.arange(screen_size) + 0.5) * width / screen_size).astype(np.intp)
+        self.row_buffer = np.zeros((screen_size, width, channels), dtype=np.uint8)
+        self.resized = np.zeros((screen_size, screen_size, channels), dtype=np.uint8)
+        if grayscale:
+            self.luma = np.zeros((screen_size, screen_size), dtype=np.uint16)
+            self.channel = np.zeros((screen_size, screen_size), dtype=np.uint16)
+            self.gray = np.zeros((screen_size, screen_size, 1), dtype=np.uint8)
+        self.observation_space = spaces.Box(low=0,
+                                            high=255,
+                                            shape=(screen_size, screen_size, 1 if grayscale else channels),
+                                            dtype=np.uint8)
+
+    def observation(self, observation):
+        np.take(observation, self.rows, axis=0, out=self.row_buffer)
+        np.take(self.row_buffer, self.cols, axis=1, out=self.resized)
+        if not self.grayscale:
+            return self.resized
+        # ITU-R BT.601 luma in 8-bit fixed point: (77 R + 150 G + 29 B) / 256.
+        np.multiply(self.resized[..., 0], 77, out=self.luma, dtype=np.uint16)
+        np.multiply(self.resized[..., 1], 150, out=self.channel, dtype=np.uint16)
+        self.luma += self.channel
+        np.multiply(self.resized[..., 2], 29, out=self.channel, dtype=np.uint16)
+        self.luma += self.channel
+        np.right_shift(self.luma, 8, out=self.luma)
+        np.copyto(self.gray[..., 0], self.luma, casting='unsafe')
+        return self.gray
+
+
+class RamFeatureWrapper(gym.ObservationWrapper):
+    """
+    Replaces RAM observations by the Montezuma's Revenge state decoded from them (see `ram.ram_features`). The
+    observation has shape `(ram.N_FEATURES,)` and dtype `float32`.
+    """
+
+    def __init__(self, env):
+        super(RamFeatureWrapper, self).__init__(env)
+        if env.observation_space.shape != (128,):
+            raise ValueError(f'RAM features require RAM observations, not shape {env.observation_space.shape}')
+        self.observation_space = spaces.Box(low=0.0, high=1.0, shape=(ram.N_FEATURES,), dtype=np.float32)
+
+    def observation(self, observation):
+        return ram.ram_features(observation)
+
+
+class FrameStackWrapper(gym.Wrapper):
+    """
+    Stacks the last `n_frames` observations along the channel (last) axis, oldest first.
+
+    Frames are written twice into a buffer of `2 * n_frames` slots, so the stack is always a contiguous window of it
+    and is returned as a view without copying. The view is overwritten by later steps; copy it to keep it.
+    """
+
+    def __init__(self, env, n_frames=4):
+        super(FrameStackWrapper, self).__init__(env)
+        height, width, channels = env.observation_space.shape
+        self.n_frames = n_frames
+        self.channels = channels
+        self.frames = np.zeros((height, width, 2 * n_frames * channels), dtype=env.observation_space.dtype)
+        self.t = 0
+        self.observation_space = spaces.Box(low=0,
+                                            high=255,
+                                            shape=(height, width, n_frames * channels),
+                                            dtype=env.observation_space.dtype)
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        return self._push(obs), reward, terminated, truncated, info
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        for _ in range(self.n_frames):
+            stack = self._push(obs)
+        return stack, info
+
+    def _push(self, frame):
+        k = self.t % self.n_frames
+        c = self.channels
+        self.frames[..., k * c:(k + 1) * c] = frame
+        self.frames[..., (k + self.n_frames) * c:(k + self.n_frames + 1) * c] = frame
+        self.t += 1
+        return self.frames[..., (k + 1) * c:(k + self.n_frames + 1) * c]
+
+
+class TimingWrapper(gym.Wrapper):
+    """
+    Records how long each call to the wrapped environment's `step` takes (including every wrapper beneath it).
+    Durations are kept in a preallocated buffer of `capacity` samples until they are drained.
+    """
+
+    def __init__(self, env, name, capacity=65536):
+        super(TimingWrapper, self).__init__(env)
+        self.name = name
+        self.durations = np.zeros(capacity, dtype=np.float64)
+        self.n = 0
+
+    def step(self, action):
+        start = time.perf_counter()
+        result = self.env.step(action)
+        if self.n < len(self.durations):
+            self.durations[self.n] = time.perf_counter() - start
+            self.n += 1
+        return result
+
+    def drain_timings(self):
+        """
+        :return: Step durations (in seconds) recorded since the last drain by this and every `TimingWrapper` beneath
+            it, keyed by name.
+        """
+        timings = {}
+        env = self
+        while isinstance(env, gym.Wrapper):
+            if isinstance(env, TimingWrapper):
+                timings[env.name] = env.durations[:env.n].copy()
+                env.n = 0
+            env = env.env
+        return timings
@@ -0,0 +1,83 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from panama_joe.utils import demos, folders
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description='Replay demos headlessly and check that they replay deterministically.'
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    kwargs = dict(vars(args))
+    invalid = validate_demos(**kwargs)
+    sys.exit(1 if len(invalid) > 0 else 0)
+
+
+def add_arguments(parser):
+    parser.add_argument('file_names',
+                        nargs='*',
+                        help='Demos to validate, in any format. By default, every demo in the demos directory.')
+    parser.add_argument('--demo_type',
+                        default='human',
+                        help='Subdirectory of the demos directory.')
+    parser.add_argument('--n_workers',
+                        default=os.cpu_count(),
+                        type=int,
+                        help='Number of processes which replay demos in parallel.')
+
+
+def validate_demos(file_names=None, demo_type='human', n_workers=1):
+    """
+    Replay each demo from the start at full emulator speed (see `demo_replay.validate_demo`), in a pool of processes.
+
+    :return: Names of the demos which did not replay as recorded.
+    """
+    demo_dir = folders.demo_dir(demo_type)
+    if not file_names:
+        file_names = demos.list_demos(demo_dir)
+    paths = [os.path.join(demo_dir, file_name) for file_name in file_names]
+    invalid = []
+    start = time.perf_counter()
+    if n_workers > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(min(n_workers, len(paths)))
+        try:
+            reports = pool.imap(_validate_demo, paths)
+            invalid = _print_reports(file_names, reports)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        invalid = _print_reports(file_names, map(_validate_demo, paths))
+    print(f'{len(file_names) - len(invalid):d}/{len(file_names):d} demos replayed as recorded'
+          f' in {time.perf_counter() - start:.1f}s')
+    return invalid
+
+
+def _validate_demo(path):
+    from panama_joe.utils.demo_replay import validate_demo
+
+    return validate_demo(path)
+
+
+def _print_reports(file_names, reports):
+    invalid = []
+    for file_name, report in zip(file_names, reports):
+        mismatches = {kind: report[kind] for kind in ('lives', 'rewards', 'obs', 'checkpoints') if report[kind] > 0}
+        if len(mismatches) == 0:
+            status = 'OK'
+        else:
+            invalid.append(file_name)
+            status = ', '.join(f'{n:d} {kind}' for kind, n in mismatches.items())
+            status = f'MISMATCH from step {report["first_mismatch"]:d}: {status}'
+        print(f'{file_name}\t{report["steps"]:d} steps\t{report["steps_per_sec"]:.0f} steps/sec\t{status}')
+    return invalid
+
+
+if __name__ == '__main__':
+    main()
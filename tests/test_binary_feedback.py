@@ -0,0 +1,28 @@
+import threading
+
+import gymnasium as gym
+import numpy as np
+import torch
+
+from panama_joe.binary_feedback import FeedbackBuffer, FeedbackLearner
+
+
+def test_repeated_updates_keep_values_near_labels():
+    from stable_baselines3.ppo import PPO
+
+    env = gym.make('CartPole-v1')
+    model = PPO('MlpPolicy', env, learning_rate=1e-2, seed=0)
+    buffer = FeedbackBuffer(8, env.observation_space.shape, env.observation_space.dtype)
+    rng = np.random.default_rng(0)
+    obs = rng.normal(size=(8, *env.observation_space.shape)).astype(env.observation_space.dtype)
+    labels = np.array([1.0, -1.0] * 4, dtype=np.float32)
+    for o, label in zip(obs, labels):
+        buffer.add(o, 0, label)
+    learner = FeedbackLearner(model, model.policy.optimizer, buffer, threading.Lock(), batch_size=8, seed=0)
+    for _ in range(500):
+        learner.update()
+
+    obs_tensor, _ = model.policy.obs_to_tensor(obs)
+    with torch.no_grad():
+        values = model.policy.predict_values(obs_tensor).flatten().cpu().numpy()
+    np.testing.assert_allclose(values, labels, atol=0.25)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from panama_joe.utils import demos
+from panama_joe.utils.demo_replay import make_replay_env, replay_actions_ram
+from panama_joe.utils.start_states import StartStateCache, build_start_state_cache
+
+
+def test_cache_replays_demo_frameskip(tmp_path):
+    frameskip, n_actions = 4, 60
+    actions = np.random.default_rng(0).integers(0, 18, size=n_actions)
+    rewards = np.zeros(n_actions)
+    rewards[-1] = 100  # States are cached up to the demo's last reward.
+    atari_env = make_replay_env('ram')
+    atari_env.reset()
+    demo_path = str(tmp_path / 'demo')
+    demos.write_demo(demo_path, actions, rewards, np.full(n_actions, 5), None, [atari_env.clone_state()], [0],
+                     frameskip=frameskip)
+
+    cache_path = str(tmp_path / 'cache')
+    n_states = build_start_state_cache([demo_path], cache_path, atari_env, stride=7)
+    ram = replay_actions_ram(actions, *demos.read_checkpoints(demo_path), frameskip=frameskip, atari_env=atari_env)
+
+    cache = StartStateCache(cache_path)
+    assert n_states == len(cache) == len(range(0, n_actions, 7))
+    for i in range(len(cache)):
+        # The RAM read back is only refreshed by emulating, so take the demo's next action from the cached state.
+        step = int(cache.index[i]['step'])
+        atari_env.restore_state(cache.state(i))
+        for _ in range(frameskip):
+            atari_env.ale.act(atari_env._action_set[actions[step]])
+        np.testing.assert_array_equal(atari_env.ale.getRAM(), ram[step])